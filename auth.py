@@ -2,10 +2,18 @@
 import json
 import os
 import time
+import threading
 from datetime import datetime
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from window_registry import clear_window_registry, register_main_window, track_new_windows, close_popups
+
+# ログイン画面のURL（スタブサーバーで検証する場合は login() の引数で差し替える）
+LOGIN_URL = "https://www.ph-netmaster.jp/medicom/LoginTop.aspx"
+
+# accounts.json の同時書き込みを防ぐロック（一括処理で複数セッションから更新されるため）
+_accounts_lock = threading.Lock()
 
 
 def load_accounts():
@@ -26,15 +34,16 @@ def save_accounts(accounts):
 
 def update_last_login(account):
     """最終ログイン日時を更新"""
-    accounts = load_accounts()
+    with _accounts_lock:
+        accounts = load_accounts()
 
-    # 該当アカウントを探して更新
-    for acc in accounts:
-        if acc['user_id'] == account['user_id']:
-            acc['last_login'] = datetime.now().isoformat()
-            break
+        # 該当アカウントを探して更新
+        for acc in accounts:
+            if acc['user_id'] == account['user_id']:
+                acc['last_login'] = datetime.now().isoformat()
+                break
 
-    save_accounts(accounts)
+        save_accounts(accounts)
 
 
 def add_account():
@@ -190,9 +199,28 @@ def select_account():
             print("数字を入力してください。")
 
 
-def login(driver, account):
-    """ログイン処理"""
-    driver.get("https://www.ph-netmaster.jp/medicom/LoginTop.aspx")
+# ログイン後に閉じるウィンドウのURL
+UNWANTED_URLS = [
+    "I_Tenpo_Sakutaihi_Login.aspx",
+    "SubFrameSanyo.aspx",
+    "about:blank"
+]
+
+
+def is_wanted_window(info):
+    """ログイン後に残すウィンドウかどうか（URLが不要な画面でない）"""
+    return not any(unwanted in info['url'] for unwanted in UNWANTED_URLS)
+
+
+def login(driver, account, login_url=None):
+    """ログイン処理
+
+    Args:
+        driver: Seleniumドライバー
+        account: アカウント情報
+        login_url: ログイン画面のURL（省略時は LOGIN_URL）
+    """
+    driver.get(login_url or LOGIN_URL)
 
     wait = WebDriverWait(driver, 10)
 
@@ -206,6 +234,11 @@ def login(driver, account):
     pass_field.clear()
     pass_field.send_keys(account['password'])
 
+    # ログイン画面のウィンドウをメインウィンドウとして記録（前のアカウントの記録は破棄）
+    clear_window_registry(driver)
+    register_main_window(driver)
+    windows_before = driver.window_handles
+
     # ログインボタンをクリック
     login_button = driver.find_element(By.ID, "btnLogin")
     login_button.click()
@@ -238,37 +271,15 @@ def login(driver, account):
     except:
         pass
 
-    # 不要なウィンドウ（統計画面など）を閉じる
+    # ログイン後に開いた不要なウィンドウ（統計画面など）を閉じる
+    # URLが不要な画面のウィンドウだけを閉じ、メインウィンドウが不要な画面に
+    # 移っていた場合は残ったウィンドウをメインにする
     time.sleep(2)  # ウィンドウが開くのを待つ
-    all_windows = driver.window_handles
-
-    print(f"開いているウィンドウ数: {len(all_windows)}")
-
-    # 不要なURLのウィンドウを閉じる
-    unwanted_urls = [
-        "I_Tenpo_Sakutaihi_Login.aspx",
-        "SubFrameSanyo.aspx",
-        "about:blank"
-    ]
-
-    main_window = None
-    for window in all_windows:
-        driver.switch_to.window(window)
-        current_url = driver.current_url
-        print(f"ウィンドウURL: {current_url}")
-
-        # 不要なURLか確認
-        should_close = any(unwanted in current_url for unwanted in unwanted_urls)
-
-        if should_close:
-            print(f"不要なウィンドウを閉じます: {current_url}")
-            driver.close()
-        else:
-            main_window = window
-
-    # メインウィンドウに戻る
-    if main_window:
-        driver.switch_to.window(main_window)
+    popups = track_new_windows(driver, windows_before, "ログイン後のポップアップ", "login")
+    print(f"ログイン後に開いたウィンドウ数: {len(popups)}")
+    if popups or len(windows_before) > 1:
+        closed_count, _ = close_popups(driver, keep_if=is_wanted_window)
+        print(f"不要なウィンドウを閉じました: {closed_count}個")
 
     print("ログイン成功")
 
@@ -0,0 +1,371 @@
+"""複数店舗の一括処理（非対話）
+
+accounts.json の各アカウントについて、ブラウザを1セッションずつ起動し、
+指定された業務（毎日在庫・自動発注・連絡板確認）を並列で実行する。
+店舗ごとの結果は results/ フォルダにJSONで保存する。
+
+使用例:
+    python batch_runner.py --operations daily_inventory auto_order --sessions 4
+    python batch_runner.py --stores 1705 0023 --operations check_messages
+    python batch_runner.py --login-url http://127.0.0.1:8765/medicom/LoginTop.aspx
+"""
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from auth import load_accounts, login, logout
+from operations import (
+    daily_inventory,
+    auto_order,
+    check_messages,
+    extract_store_id,
+    set_interactive_mode,
+    set_pdf_download_mode,
+    set_stock_backend,
+    clear_frame_cache
+)
+from utils import (
+    setup_driver,
+    close_http_session,
+    start_print_queue,
+    stop_print_queue,
+    create_print_backend,
+    get_print_job_status
+)
+from log_setup import setup_logging, set_log_context, shutdown_logging
+from tracing import span, enable_tracing, export_trace, summarize_trace
+from driver_stats import set_command_summary, snapshot_command_stats, diff_command_stats, get_command_stats
+from page_recorder import start_recording, stop_recording, record_step
+from window_registry import clear_window_registry
+from driver_pool import (
+    create_driver_pool,
+    acquire_driver,
+    release_driver,
+    get_pool_health,
+    close_driver_pool
+)
+from main import load_config
+
+
+def run_daily_inventory(driver, account, download_path, config):
+    """毎日在庫を実行"""
+    return daily_inventory(driver, download_path, config['should_print_pdf'],
+                           extract_store_id(account['user_id']))
+
+
+def run_auto_order(driver, account, download_path, config):
+    """自動発注を実行"""
+    return auto_order(driver, download_path, config['should_print_pdf'],
+                      extract_store_id(account['user_id']))
+
+
+def run_check_messages(driver, account, download_path, config):
+    """連絡板確認を実行"""
+    return check_messages(driver, account['user_id'], config)
+
+
+# 業務名と実行関数の対応表
+OPERATIONS = {
+    "daily_inventory": run_daily_inventory,
+    "auto_order": run_auto_order,
+    "check_messages": run_check_messages,
+}
+
+
+def select_accounts(accounts, store_ids=None):
+    """処理対象のアカウントを絞り込む
+
+    Args:
+        accounts: accounts.json のアカウント一覧
+        store_ids: 対象とする店舗ID（4桁）のリスト。省略時は全アカウント
+
+    Returns:
+        list: 対象アカウントのリスト
+    """
+    if not store_ids:
+        return list(accounts)
+
+    targets = set(store_ids)
+    return [acc for acc in accounts if extract_store_id(acc['user_id']) in targets]
+
+
+def run_account(account, operations, config, login_url=None, pool=None):
+    """1アカウント分の処理を実行（1ブラウザセッション）
+
+    Args:
+        account: アカウント情報
+        operations: 実行する業務名のリスト
+        config: 設定情報
+        login_url: ログイン画面のURL（省略時は本番URL）
+        pool: ドライバープール（省略時はこのアカウント用にブラウザを起動・終了する）
+
+    Returns:
+        dict: 店舗ごとの処理結果
+    """
+    store_id = extract_store_id(account['user_id'])
+    # このスレッドのログに店舗IDを付ける（スレッドは店舗間で使い回される）
+    set_log_context(store_id=store_id, operation="login")
+    result = {
+        'store_id': store_id,
+        'store_name': account.get('store_name', account['user_id']),
+        'user_id': account['user_id'],
+        'login': False,
+        'operations': {},
+        'started_at': datetime.now().isoformat(),
+        'elapsed': 0.0,
+        'error': None
+    }
+    start = time.perf_counter()
+
+    # 店舗ごとにダウンロードフォルダを分ける（PDFの取り違え防止）
+    download_path = os.path.join(config['download_path'], store_id)
+    os.makedirs(download_path, exist_ok=True)
+
+    driver = None
+    entry = None
+    healthy = True
+    try:
+        if pool:
+            entry = acquire_driver(pool, download_path)
+            driver = entry['driver']
+            result['session_id'] = entry['id']
+        else:
+            driver = setup_driver(download_path, config.get('batch', {}).get('browser_profile', 'lean'))
+
+        with span("ログイン", "login", driver):
+            logged_in = login(driver, account, login_url)
+        if not logged_in:
+            result['error'] = "ログインに失敗しました"
+            return result
+        result['login'] = True
+        record_step(driver, "ログイン")
+
+        for name in operations:
+            op_start = time.perf_counter()
+            op_result = {'success': False, 'elapsed': 0.0, 'error': None}
+            commands_before = snapshot_command_stats(driver)
+            try:
+                op_result['success'] = bool(OPERATIONS[name](driver, account, download_path, config))
+            except Exception as e:
+                op_result['error'] = str(e)
+            op_result['elapsed'] = round(time.perf_counter() - op_start, 3)
+            commands = diff_command_stats(get_command_stats(driver), commands_before)
+            if commands:
+                # 業務ごとのWebDriverコマンド数（往復の多い呼び出し元の上位）
+                op_result['webdriver_commands'] = {
+                    'total': commands['total'],
+                    'elapsed': round(commands['elapsed'], 3),
+                    'top_callers': {
+                        caller: c['count'] for caller, c in
+                        sorted(commands['by_caller'].items(), key=lambda x: x[1]['count'], reverse=True)[:5]
+                    }
+                }
+            result['operations'][name] = op_result
+
+        logout(driver)
+
+    except Exception as e:
+        result['error'] = str(e)
+        healthy = False
+
+    finally:
+        if entry:
+            release_driver(pool, entry, healthy)
+        elif driver:
+            clear_frame_cache(driver)
+            clear_window_registry(driver)
+            close_http_session(driver)
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        result['elapsed'] = round(time.perf_counter() - start, 3)
+
+    return result
+
+
+def run_batch(accounts, operations, config, max_sessions=4, login_url=None):
+    """複数アカウントの処理を並列で実行
+
+    Args:
+        accounts: 処理対象のアカウントリスト
+        operations: 実行する業務名のリスト
+        config: 設定情報
+        max_sessions: 同時に起動するブラウザセッション数
+        login_url: ログイン画面のURL（省略時は本番URL）
+
+    Returns:
+        tuple: (店舗ごとの処理結果（accountsの順序）, ドライバープールの状態)
+    """
+    unknown = [name for name in operations if name not in OPERATIONS]
+    if unknown:
+        raise ValueError(f"不明な業務です: {', '.join(unknown)}")
+
+    # 無人実行のため入力待ちを無効化
+    set_interactive_mode(False)
+    # 並列実行では業務ごとのコマンド集計の表示が混ざるため、結果ファイルにだけ残す
+    set_command_summary(config.get('batch', {}).get('command_summary', False))
+    set_pdf_download_mode(config.get('pdf_download_mode', 'browser'))
+    set_stock_backend(config.get('stock_backend', 'json'), config.get('stock_db_path'))
+    setup_logging(
+        config.get('log_dir', 'logs'),
+        max_bytes=config.get('log_max_mb', 10) * 1024 * 1024,
+        backup_count=config.get('log_backup_count', 5),
+        retention_days=config.get('log_retention_days', 30)
+    )
+    start_print_queue(
+        create_print_backend(config.get('print_backend', 'printer'), config.get('print_copy_dir')),
+        max_retries=config.get('print_max_retries', 2)
+    )
+
+    # ブラウザを店舗間で再利用する（batch.reuse_sessions が False の場合は店舗ごとに起動）
+    batch_config = config.get('batch', {})
+    pool = None
+    if batch_config.get('reuse_sessions', True):
+        pool = create_driver_pool(
+            size=max_sessions,
+            profile=batch_config.get('browser_profile', 'lean'),
+            max_uses=batch_config.get('session_max_uses', 20),
+            max_memory_mb=batch_config.get('session_max_memory_mb')
+        )
+
+    results = [None] * len(accounts)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_sessions)) as executor:
+            futures = {
+                executor.submit(run_account, account, operations, config, login_url, pool): i
+                for i, account in enumerate(accounts)
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                r = results[i]
+                status = "OK" if r['login'] and all(o['success'] for o in r['operations'].values()) else "NG"
+                print(f"[{status}] {r['store_id']} {r['store_name']} ({r['elapsed']:.1f}秒)")
+    finally:
+        pool_health = get_pool_health(pool) if pool else None
+        if pool:
+            close_driver_pool(pool)
+
+    return results, pool_health
+
+
+def summarize(results):
+    """処理結果の集計
+
+    Args:
+        results: run_batch() の戻り値
+
+    Returns:
+        dict: 集計結果
+    """
+    summary = {
+        'total': len(results),
+        'login_failed': sum(1 for r in results if not r['login']),
+        'operations': {}
+    }
+    for r in results:
+        for name, op in r['operations'].items():
+            stats = summary['operations'].setdefault(name, {'success': 0, 'failed': 0, 'elapsed': 0.0})
+            if op['success']:
+                stats['success'] += 1
+            else:
+                stats['failed'] += 1
+            stats['elapsed'] = round(stats['elapsed'] + op['elapsed'], 3)
+
+    jobs = get_print_job_status()
+    summary['print_jobs'] = {
+        status: sum(1 for job in jobs if job['status'] == status)
+        for status in ('done', 'failed', 'queued', 'printing')
+    }
+    return summary
+
+
+def save_results(results, summary, output_dir="results"):
+    """処理結果をJSONファイルに保存
+
+    Returns:
+        str: 保存したファイルのパス
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_file = os.path.join(output_dir, f"batch_{timestamp}.json")
+
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({'summary': summary, 'stores': results}, f, ensure_ascii=False, indent=2)
+
+    return output_file
+
+
+def main():
+    """一括処理のエントリーポイント"""
+    config = load_config()
+    batch_config = config.get('batch', {})
+
+    parser = argparse.ArgumentParser(description="複数店舗の一括処理")
+    parser.add_argument("--operations", nargs="+", choices=sorted(OPERATIONS),
+                        default=batch_config.get('operations', ["daily_inventory"]),
+                        help="実行する業務")
+    parser.add_argument("--sessions", type=int, default=batch_config.get('max_sessions', 4),
+                        help="同時に起動するブラウザ数")
+    parser.add_argument("--stores", nargs="*", help="対象の店舗ID（4桁、省略時は全アカウント）")
+    parser.add_argument("--login-url", help="ログイン画面のURL（スタブサーバー検証用）")
+    parser.add_argument("--trace", action="store_true", default=config.get('trace_enabled', False),
+                        help="処理ステップごとの所要時間を記録する（trace_dir に保存）")
+    parser.add_argument("--record", action="store_true", default=config.get('record_enabled', False),
+                        help="ステップごとの画面を記録する（record_dir に保存、stub_server.py --snapshots で再生）")
+    args = parser.parse_args()
+
+    accounts = select_accounts(load_accounts(), args.stores)
+    if not accounts:
+        print("処理対象のアカウントがありません。")
+        return
+
+    print(f"=== 一括処理: {len(accounts)}店舗 / 同時{args.sessions}セッション ===")
+    print(f"業務: {', '.join(args.operations)}\n")
+
+    enable_tracing(args.trace)
+    if args.record:
+        print(f"画面の記録: {start_recording(config.get('record_dir', 'recordings'))}\n")
+    start = time.perf_counter()
+    results, pool_health = run_batch(accounts, args.operations, config, args.sessions, args.login_url)
+    # ブラウザ操作が終わった後、印刷待ちのPDFを印刷しきる
+    print("\n印刷キューの完了を待っています...")
+    stop_print_queue(wait=True)
+    shutdown_logging()
+    summary = summarize(results)
+    summary['recording'] = stop_recording()
+    summary['elapsed'] = round(time.perf_counter() - start, 3)
+    summary['driver_pool'] = pool_health
+    if args.trace:
+        # 合計時間の長いステップ上位を結果に残し、トレース全体はファイルに保存
+        summary['slowest_steps'] = [
+            {**step, 'total': round(step['total'], 3), 'max': round(step['max'], 3)}
+            for step in summarize_trace()[:10]
+        ]
+        summary['trace_files'] = export_trace(config.get('trace_dir', 'traces'))
+
+    output_file = save_results(results, summary)
+
+    print("\n=== 処理結果 ===")
+    print(f"店舗数: {summary['total']}（ログイン失敗: {summary['login_failed']}）")
+    for name, stats in summary['operations'].items():
+        print(f"  {name}: 成功 {stats['success']} / 失敗 {stats['failed']}")
+    if pool_health:
+        stats = pool_health['stats']
+        print(f"ブラウザ: 起動 {stats['created']} / 再利用 {stats['reused']} / 入替 {stats['recycled']} / 異常終了 {stats['failed']}")
+    print(f"印刷: 完了 {summary['print_jobs']['done']} / 失敗 {summary['print_jobs']['failed']}")
+    print(f"所要時間: {summary['elapsed']:.1f}秒")
+    print(f"結果ファイル: {output_file}")
+    if summary.get('trace_files') and summary['trace_files'][1]:
+        print(f"トレース: {summary['trace_files'][0]} / {summary['trace_files'][1]}（chrome://tracing で表示）")
+    if summary['recording']:
+        recording = summary['recording']
+        print(f"画面の記録: {recording['archive_dir']}（{recording['steps']}ステップ / "
+              f"{recording['html_bytes'] / 1024:.0f}KB → {recording['stored_bytes'] / 1024:.0f}KB）")
+
+
+if __name__ == "__main__":
+    main()
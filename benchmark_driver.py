@@ -0,0 +1,163 @@
+"""ブラウザプロファイルの比較（メモリ使用量・ページ読み込み時間）
+
+setup_driver() の "default" と "lean" プロファイルについて、
+1セッションあたりのメモリ使用量（Chrome関連プロセスのRSS合計）と
+ページ読み込み時間を計測し、同時に起動できるセッション数の目安を出す。
+
+既定ではスタブサーバー（stub_server.py）を起動して計測するため、
+本番のMedicomには接続しない。
+
+使用例:
+    python benchmark_driver.py
+    python benchmark_driver.py --profiles lean --sessions 4 --loads 10
+    python benchmark_driver.py --url http://127.0.0.1:8765/medicom/HomeMain.aspx
+"""
+import json
+import time
+import tempfile
+import argparse
+import statistics
+from datetime import datetime
+from utils import setup_driver, get_driver_memory
+from stub_server import start_server
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def measure_page_loads(driver, url, loads):
+    """ページ読み込み時間を計測
+
+    Args:
+        driver: WebDriver
+        url: 読み込むURL
+        loads: 読み込み回数
+
+    Returns:
+        list: 読み込み時間（秒）のリスト
+    """
+    timings = []
+    for _ in range(loads):
+        start = time.perf_counter()
+        driver.get(url)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def benchmark_profile(profile, url, sessions=1, loads=5):
+    """1プロファイル分の計測
+
+    Args:
+        profile: setup_driver() のプロファイル名
+        url: 読み込むURL
+        sessions: 同時に起動するセッション数
+        loads: セッションごとの読み込み回数
+
+    Returns:
+        dict: 計測結果
+    """
+    drivers = []
+    startup_times = []
+    load_times = []
+    memory = []
+    download_path = tempfile.mkdtemp(prefix=f"bench_{profile}_")
+
+    try:
+        for _ in range(sessions):
+            start = time.perf_counter()
+            driver = setup_driver(download_path, profile)
+            startup_times.append(time.perf_counter() - start)
+            drivers.append(driver)
+
+        for driver in drivers:
+            load_times.extend(measure_page_loads(driver, url, loads))
+
+        # ページを開いた状態のメモリ使用量
+        for driver in drivers:
+            memory.append(get_driver_memory(driver))
+    finally:
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+    memory = [m for m in memory if m is not None]
+    return {
+        'profile': profile,
+        'sessions': sessions,
+        'startup_avg': round(statistics.mean(startup_times), 3),
+        'load_avg': round(statistics.mean(load_times), 3),
+        'load_median': round(statistics.median(load_times), 3),
+        'load_max': round(max(load_times), 3),
+        'memory_per_session_mb': round(statistics.mean(memory), 1) if memory else None
+    }
+
+
+def estimate_max_sessions(memory_per_session_mb, reserve_mb=1024):
+    """空きメモリから同時に起動できるセッション数の目安を計算
+
+    Args:
+        memory_per_session_mb: 1セッションあたりのメモリ使用量（MB）
+        reserve_mb: OSなどのために残しておくメモリ（MB）
+
+    Returns:
+        int: セッション数の目安。計算できない場合は None
+    """
+    if psutil is None or not memory_per_session_mb:
+        return None
+    available_mb = psutil.virtual_memory().available / (1024 * 1024)
+    return max(0, int((available_mb - reserve_mb) // memory_per_session_mb))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ブラウザプロファイルの比較")
+    parser.add_argument("--profiles", nargs="+", default=["default", "lean"],
+                        choices=["default", "lean"], help="計測するプロファイル")
+    parser.add_argument("--sessions", type=int, default=2, help="同時に起動するセッション数")
+    parser.add_argument("--loads", type=int, default=5, help="セッションごとの読み込み回数")
+    parser.add_argument("--url", help="読み込むURL（省略時はスタブサーバーの受信一覧）")
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if not url:
+        server, login_url = start_server(port=0)
+        url = login_url.replace("LoginTop.aspx", "I_JushinList.aspx")
+
+    if psutil is None:
+        print("⚠️ psutil がインストールされていないため、メモリ使用量は計測しません")
+
+    results = []
+    try:
+        for profile in args.profiles:
+            print(f"計測中: {profile}（{args.sessions}セッション × {args.loads}回）...")
+            result = benchmark_profile(profile, url, args.sessions, args.loads)
+            result['max_sessions_estimate'] = estimate_max_sessions(result['memory_per_session_mb'])
+            results.append(result)
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+
+    print("\n=== 計測結果 ===")
+    print(f"URL: {url}")
+    print(f"{'プロファイル':<10} {'起動':>8} {'読込(平均)':>10} {'読込(中央)':>10} {'メモリ/セッション':>16} {'同時数目安':>10}")
+    for r in results:
+        memory = f"{r['memory_per_session_mb']}MB" if r['memory_per_session_mb'] else "-"
+        estimate = r['max_sessions_estimate'] if r['max_sessions_estimate'] is not None else "-"
+        print(f"{r['profile']:<10} {r['startup_avg']:>7.2f}s {r['load_avg']:>9.3f}s {r['load_median']:>9.3f}s "
+              f"{memory:>16} {estimate:>10}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'url': url, 'measured_at': datetime.now().isoformat(), 'results': results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"\n結果ファイル: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""メッセージ本文パーサーのベンチマーク
+
+合成した購入伺いメッセージのコーパスを使い、parse_message_content() の
+処理速度（件/秒）を以前の実装（正規表現を毎回実行する版）と比較する。
+計測の前に、コーパス全件で両者の結果が一致することを確認する。
+
+使用例:
+    python benchmark_parser.py                        # Sample/purchase_corpus.jsonl で計測
+    python benchmark_parser.py --generate 5000        # 5000件を合成して計測
+    python benchmark_parser.py --write-corpus 300     # コーパスを作り直す
+"""
+import os
+import re
+import json
+import time
+import random
+import argparse
+from operations import parse_message_content, parse_message_contents
+
+CORPUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Sample", "purchase_corpus.jsonl")
+
+STORE_NAMES = [
+    "ツルハドラッグ　札幌北口店", "ウォンツ薬局　日赤病院前店", "くすりの福太郎　船橋店",
+    "杏林堂薬局　浜松中央店", "レデイ薬局　松山南店", "ツルハドラッグ　旭川永山店"
+]
+MEDICINES = [
+    "ロキソプロフェンNa錠60mg「サワイ」", "アムロジピン錠5mg「トーワ」", "レバミピド錠100mg「EMEC」",
+    "ランソプラゾールOD錠15mg「日医工」", "メトホルミン塩酸塩錠250mgMT「DSEP」", "ツムラ葛根湯エキス顆粒（医療用）",
+    "ヒルドイドソフト軟膏0.3%", "カロナール錠200 200mg", "ムコスタ点眼液UD2%", "ビソプロロールフマル酸塩錠2.5mg"
+]
+UNITS = ["錠", "包", "g", "本", "カプセル", "mL", "枚", "瓶"]
+
+
+def generate_message(rng, max_lots=20):
+    """購入伺いメッセージ本文を1件合成
+
+    Args:
+        rng: random.Random
+        max_lots: 最大ロット数
+
+    Returns:
+        str: メッセージ本文
+    """
+    store = rng.choice(STORE_NAMES)
+    lines = []
+    if rng.random() < 0.9:
+        lines += ["*" * 30, f"*  {store}", "*" * 30]
+    else:
+        # 旧形式の送信元表記
+        lines += [f"調剤薬局{store.replace('　', '')} 薬剤師 {rng.choice(['佐藤', '鈴木', '高橋'])}"]
+
+    lines += [
+        f"購入伺い（メッセージID: 3000{rng.randint(10000000, 99999999)}）",
+        "下記の医薬品について購入をご検討ください。",
+        "-" * rng.choice([10, 20, 40]),
+        "薬品名                          数量 単位",
+        "使用期限",
+        "-" * rng.choice([10, 20, 40])
+    ]
+
+    for _ in range(rng.randint(1, max_lots)):
+        quantity = rng.choice([str(rng.randint(1, 500)), f"{rng.randint(1, 50)}.{rng.randint(0, 9)}"])
+        unit = rng.choice(UNITS)
+        lines.append(f"{rng.choice(MEDICINES)}{' ' * rng.randint(1, 6)}{quantity} {unit}")
+        roll = rng.random()
+        if roll < 0.8:
+            lines.append(f" {rng.randint(2025, 2028)}/{rng.randint(1, 12):02d}")
+        elif roll < 0.85:
+            lines.append("")
+        elif roll < 0.9:
+            lines.append("余剰在庫のため")
+
+    lines.append("-" * rng.choice([10, 20, 40]))
+    if rng.random() < 0.5:
+        lines += ["備考: 発送は月曜日になります。", "-" * 20]
+
+    content = "\n".join(lines)
+    if rng.random() < 0.5:
+        content += "\n"
+    return content
+
+
+def generate_corpus(count, seed=0, max_lots=20):
+    """購入伺いメッセージ本文を合成
+
+    Returns:
+        list: メッセージ本文のリスト
+    """
+    rng = random.Random(seed)
+    return [generate_message(rng, max_lots) for _ in range(count)]
+
+
+def load_corpus(corpus_file=CORPUS_FILE):
+    """コーパス（JSONL、1行1件の {"content": 本文}）を読み込み"""
+    with open(corpus_file, 'r', encoding='utf-8') as f:
+        return [json.loads(line)['content'] for line in f if line.strip()]
+
+
+def write_corpus(contents, corpus_file=CORPUS_FILE):
+    """コーパスを保存"""
+    with open(corpus_file, 'w', encoding='utf-8') as f:
+        for content in contents:
+            f.write(json.dumps({'content': content}, ensure_ascii=False) + "\n")
+
+
+def legacy_parse_message_content(content):
+    """以前の parse_message_content()（比較用、処理内容は変更しない）"""
+    try:
+        store_match = re.search(r'\*+\s*\n\s*\*\s+(.+?)\s*\n', content)
+        if not store_match:
+            store_match = re.search(r'調剤薬局(.+?)[\s\*\n]', content)
+
+        sender_store = store_match.group(1).strip() if store_match else None
+
+        dash_sections = re.findall(r'-{10,}\n(.+?)(?=\n-{10,}|$)', content, re.DOTALL)
+
+        if not dash_sections or len(dash_sections) < 2:
+            return []
+
+        medicine_text = dash_sections[1].strip() if len(dash_sections) > 1 else dash_sections[0].strip()
+
+        lines = medicine_text.split('\n')
+        header_keywords = ['薬品名', '数量', '単位', '使用期限', '余剰在庫']
+
+        results = []
+        i = 0
+        while i < len(lines):
+            line = lines[i].strip()
+            if not line or any(keyword in line for keyword in header_keywords):
+                i += 1
+                continue
+
+            qty_match = re.search(r'(\d+\.?\d*)\s+(\S+?)\s*$', line)
+            if qty_match:
+                try:
+                    quantity_str = qty_match.group(1)
+                    unit_str = qty_match.group(2).strip()
+
+                    if len(unit_str) <= 10:
+                        medicine_name = line[:qty_match.start()].strip()
+                        quantity = float(quantity_str)
+                        unit = unit_str
+
+                        expiry_date = None
+                        if i + 1 < len(lines):
+                            next_line = lines[i + 1].strip()
+                            if '/' in next_line and re.match(r'\s*\d{4}/\d{2}', next_line):
+                                expiry_match = re.search(r'(\d{4}/\d{2})', next_line)
+                                if expiry_match:
+                                    expiry_date = expiry_match.group(1)
+                                    i += 1
+
+                        results.append({
+                            'sender_store': sender_store,
+                            'medicine_name': medicine_name,
+                            'quantity': quantity,
+                            'unit': unit,
+                            'expiry_date': expiry_date
+                        })
+                except Exception:
+                    pass
+
+            i += 1
+
+        return results
+
+    except Exception as e:
+        print(f"メッセージパースエラー: {e}")
+        return []
+
+
+def measure(parse, contents, repeat):
+    """パーサーの処理速度を計測
+
+    Returns:
+        float: 1秒あたりの処理件数（repeat 回のうち最速）
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(contents)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(contents) / best if best else float('inf')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="メッセージ本文パーサーのベンチマーク")
+    parser.add_argument("--generate", type=int, help="コーパスの代わりに指定件数を合成して計測")
+    parser.add_argument("--max-lots", type=int, default=20, help="合成するメッセージの最大ロット数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="計測回数（最速値を採用）")
+    parser.add_argument("--write-corpus", type=int, metavar="N", help="N件を合成してコーパスを保存")
+    args = parser.parse_args()
+
+    if args.write_corpus:
+        write_corpus(generate_corpus(args.write_corpus, args.seed, args.max_lots))
+        print(f"✓ コーパスを保存しました: {CORPUS_FILE}（{args.write_corpus}件）")
+        return
+
+    if args.generate:
+        contents = generate_corpus(args.generate, args.seed, args.max_lots)
+    else:
+        contents = load_corpus()
+
+    # 結果が一致することを確認
+    mismatches = [i for i, content in enumerate(contents)
+                  if parse_message_content(content) != legacy_parse_message_content(content)]
+    lots = sum(len(r) for r in parse_message_contents(contents))
+    print(f"メッセージ: {len(contents)}件 / ロット: {lots}件 / 結果の不一致: {len(mismatches)}件")
+    if mismatches:
+        print(f"⚠️ 不一致のメッセージ: {mismatches[:10]}")
+
+    legacy_rate = measure(lambda cs: [legacy_parse_message_content(c) for c in cs], contents, args.repeat)
+    current_rate = measure(parse_message_contents, contents, args.repeat)
+
+    print("\n=== 計測結果 ===")
+    print(f"以前の実装: {legacy_rate:>10,.0f} 件/秒")
+    print(f"現在の実装: {current_rate:>10,.0f} 件/秒（{current_rate / legacy_rate:.2f}倍）")
+
+
+if __name__ == "__main__":
+    main()
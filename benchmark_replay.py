@@ -0,0 +1,206 @@
+"""リプレイサーバーを使った業務処理のベンチマーク
+
+stub_server.py（記録した画面を返すリプレイサーバー）を起動し、ダミーの店舗アカウントで
+毎日在庫・自動発注・連絡板確認をヘッドレスChromeで実行して、店舗ごと・業務ごとの
+所要時間を計測する。本番のMedicomには接続しない。
+
+ログ・ストック・PDF・結果ファイルは作業フォルダ（省略時は一時フォルダ）に出力する。
+
+使用例:
+    python benchmark_replay.py
+    python benchmark_replay.py --stores 8 --sessions 4 --tally-delay 5 --latency-all 0.05
+    python benchmark_replay.py --operations check_messages --snapshots replay/ --trace
+"""
+import os
+import json
+import time
+import tempfile
+import argparse
+import statistics
+from datetime import datetime
+from main import load_config
+from batch_runner import run_batch
+from tracing import enable_tracing, export_trace, summarize_trace
+from utils import stop_print_queue
+from log_setup import shutdown_logging
+from stub_server import start_server, parse_latency
+
+
+def make_accounts(count):
+    """ベンチマーク用のアカウントを作成（店舗IDは 9000 から連番）
+
+    Returns:
+        list: アカウントのリスト
+    """
+    return [
+        {'user_id': f"TRH{9000 + i:04d}01", 'password': "bench", 'store_name': f"ベンチマーク店舗{i + 1}"}
+        for i in range(count)
+    ]
+
+
+def make_benchmark_config(workdir, profile="lean", print_backend="copy"):
+    """ベンチマーク用の設定（出力先はすべて作業フォルダ）
+
+    Args:
+        workdir: 作業フォルダ
+        profile: ブラウザプロファイル
+        print_backend: 印刷方法（copy: 作業フォルダにコピー / noop: 印刷しない）
+
+    Returns:
+        dict: 設定
+    """
+    config = load_config()
+    config.update({
+        'download_path': os.path.join(workdir, "downloads"),
+        'print_backend': print_backend,
+        'print_copy_dir': os.path.join(workdir, "printed"),
+        'should_print_pdf': True,
+        'stock_db_path': os.path.join(workdir, "data", "stock.db"),
+        'log_dir': os.path.join(workdir, "logs"),
+        'trace_dir': os.path.join(workdir, "traces")
+    })
+    config['batch'] = {**config.get('batch', {}), 'browser_profile': profile}
+    return config
+
+
+def summarize_timings(results):
+    """業務ごとの所要時間を集計
+
+    Args:
+        results: run_batch() の結果（全計測回分）
+
+    Returns:
+        dict: 業務名 → {'count', 'failed', 'mean', 'median', 'max'}
+    """
+    timings = {}
+    for r in results:
+        for name, op in r['operations'].items():
+            stats = timings.setdefault(name, {'elapsed': [], 'failed': 0})
+            stats['elapsed'].append(op['elapsed'])
+            if not op['success']:
+                stats['failed'] += 1
+
+    store_elapsed = [r['elapsed'] for r in results]
+    summary = {
+        name: {
+            'count': len(stats['elapsed']),
+            'failed': stats['failed'],
+            'mean': round(statistics.mean(stats['elapsed']), 3),
+            'median': round(statistics.median(stats['elapsed']), 3),
+            'max': round(max(stats['elapsed']), 3)
+        }
+        for name, stats in timings.items()
+    }
+    if store_elapsed:
+        summary['store_total'] = {
+            'count': len(store_elapsed),
+            'failed': sum(1 for r in results if not r['login']),
+            'mean': round(statistics.mean(store_elapsed), 3),
+            'median': round(statistics.median(store_elapsed), 3),
+            'max': round(max(store_elapsed), 3)
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="リプレイサーバーを使った業務処理のベンチマーク")
+    parser.add_argument("--operations", nargs="+", default=["daily_inventory", "auto_order", "check_messages"],
+                        choices=["daily_inventory", "auto_order", "check_messages"], help="計測する業務")
+    parser.add_argument("--stores", type=int, default=4, help="店舗数")
+    parser.add_argument("--sessions", type=int, default=2, help="同時に起動するブラウザ数")
+    parser.add_argument("--repeat", type=int, default=1, help="計測回数")
+    parser.add_argument("--profile", default="lean", choices=["default", "lean"], help="ブラウザプロファイル")
+    parser.add_argument("--tally-delay", type=float, default=2.0, help="印刷ボタンが現れるまでの秒数（集計処理）")
+    parser.add_argument("--latency-all", type=float, default=0.0, help="全画面の応答遅延（秒）")
+    parser.add_argument("--latency", nargs="*", default=[], metavar="画面名=秒", help="画面ごとの応答遅延")
+    parser.add_argument("--snapshots", help="記録した画面のフォルダ（stub_server.py --snapshots と同じ）")
+    parser.add_argument("--workdir", help="ログ・ストック・PDFの出力先（省略時は一時フォルダ）")
+    parser.add_argument("--trace", action="store_true", help="処理ステップごとのトレースを保存")
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="bench_replay_"))
+    os.makedirs(workdir, exist_ok=True)
+    config = make_benchmark_config(workdir, args.profile)
+    snapshot_dir = os.path.abspath(args.snapshots) if args.snapshots else None
+
+    server, login_url = start_server(
+        port=0,
+        latency=parse_latency(args.latency),
+        default_latency=args.latency_all,
+        tally_delay=args.tally_delay,
+        snapshot_dir=snapshot_dir
+    )
+
+    # ストック・ログ・結果ファイルの相対パスを作業フォルダに向ける
+    original_cwd = os.getcwd()
+    os.chdir(workdir)
+
+    enable_tracing(args.trace)
+    accounts = make_accounts(args.stores)
+    all_results = []
+    runs = []
+    print(f"=== リプレイベンチマーク: {args.stores}店舗 / 同時{args.sessions}セッション / {args.repeat}回 ===")
+    print(f"業務: {', '.join(args.operations)} / 集計時間: {args.tally_delay}秒 / 作業フォルダ: {workdir}\n")
+
+    try:
+        for run in range(args.repeat):
+            start = time.perf_counter()
+            results, pool_health = run_batch(accounts, args.operations, config, args.sessions, login_url)
+            elapsed = time.perf_counter() - start
+            all_results.extend(results)
+            runs.append({'run': run + 1, 'elapsed': round(elapsed, 3), 'driver_pool': pool_health})
+            print(f"--- {run + 1}回目: {elapsed:.1f}秒 ---")
+        stop_print_queue(wait=True)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    summary = summarize_timings(all_results)
+    trace_files = None
+    slowest_steps = None
+    if args.trace:
+        slowest_steps = summarize_trace()[:10]
+        trace_files = export_trace(config['trace_dir'])
+    shutdown_logging()
+    os.chdir(original_cwd)
+
+    print("\n=== 店舗ごとの所要時間（秒、! は失敗） ===")
+    names = args.operations
+    print(f"{'店舗':<8} " + " ".join(f"{name:>16}" for name in names) + f" {'合計':>8}")
+    for r in all_results:
+        cells = []
+        for name in names:
+            op = r['operations'].get(name)
+            cells.append(f"{op['elapsed']:>15.2f}{'' if op['success'] else '!'}" if op else f"{'-':>16}")
+        print(f"{r['store_id']:<8} " + " ".join(f"{c:>16}" for c in cells) + f" {r['elapsed']:>8.2f}")
+
+    print("\n=== 業務ごとの集計（秒） ===")
+    for name, stats in summary.items():
+        print(f"{name:<16} 平均 {stats['mean']:>7.2f} / 中央値 {stats['median']:>7.2f} / 最大 {stats['max']:>7.2f}"
+              f"（{stats['count']}件、失敗 {stats['failed']}件）")
+    for run in runs:
+        print(f"{run['run']}回目の全体時間: {run['elapsed']:.1f}秒")
+
+    if slowest_steps:
+        print("\n=== 時間のかかったステップ ===")
+        for step in slowest_steps:
+            print(f"  [{step['category']}] {step['name'][:30]:<30} {step['count']:>4}回 合計 {step['total']:>7.2f}秒")
+    if trace_files and trace_files[1]:
+        print(f"トレース: {trace_files[1]}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'measured_at': datetime.now().isoformat(),
+                'settings': {k: v for k, v in vars(args).items() if k != 'output'},
+                'runs': runs,
+                'summary': summary,
+                'stores': all_results,
+                'trace_files': trace_files
+            }, f, ensure_ascii=False, indent=2, default=str)
+        print(f"\n結果ファイル: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
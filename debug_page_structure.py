@@ -2,13 +2,15 @@
 
 出庫処理ボタンをクリックした後のページ構造を調査する
 """
-import time
-from selenium.webdriver.common.by import By
+from page_recorder import collect_page_structure, record_step
 
 
 def debug_page_structure(driver, operation_logger=None):
     """現在のページ構造を詳しく調査する
 
+    全フレームの構造は execute_script 1回でまとめて取得する（フレームの切り替えはしない）。
+    画面を記録中（page_recorder）の場合は、DOMもアーカイブに保存する。
+
     Args:
         driver: Seleniumドライバー
         operation_logger: ロガー（オプション）
@@ -20,20 +22,6 @@ def debug_page_structure(driver, operation_logger=None):
 
     log("\n========== ページ構造調査開始 ==========")
 
-    # 現在のURL
-    try:
-        current_url = driver.current_url
-        log(f"現在のURL: {current_url}")
-    except Exception as e:
-        log(f"URL取得エラー: {e}")
-
-    # ページタイトル
-    try:
-        title = driver.title
-        log(f"ページタイトル: {title}")
-    except Exception as e:
-        log(f"タイトル取得エラー: {e}")
-
     # ウィンドウ数
     try:
         windows = driver.window_handles
@@ -42,111 +30,52 @@ def debug_page_structure(driver, operation_logger=None):
     except Exception as e:
         log(f"ウィンドウ情報取得エラー: {e}")
 
-    # フレーム構造を確認
-    log("\n--- フレーム構造 ---")
+    # 全フレームの構造を取得
     try:
-        # デフォルトコンテンツに戻る
-        driver.switch_to.default_content()
-
-        iframes = driver.find_elements(By.TAG_NAME, "iframe")
-        log(f"iframeの数: {len(iframes)}")
-
-        for i, iframe in enumerate(iframes):
-            log(f"\niframe {i}:")
-            try:
-                log(f"  - id: {iframe.get_attribute('id')}")
-                log(f"  - name: {iframe.get_attribute('name')}")
-                log(f"  - src: {iframe.get_attribute('src')}")
-            except Exception as e:
-                log(f"  - 属性取得エラー: {e}")
-
-        # 各フレーム内を調査
-        for i, iframe in enumerate(iframes):
-            try:
-                driver.switch_to.frame(iframe)
-                log(f"\n  iframe {i} 内部:")
-
-                # btnRecalcを探す
-                try:
-                    btn_recalc = driver.find_element(By.ID, "btnRecalc")
-                    log(f"    ✓ btnRecalc が見つかりました！")
-                    log(f"      - type: {btn_recalc.get_attribute('type')}")
-                    log(f"      - value: {btn_recalc.get_attribute('value')}")
-                    log(f"      - displayed: {btn_recalc.is_displayed()}")
-                except:
-                    log(f"    ✗ btnRecalc は見つかりません")
-
-                # btnSyukoを探す
-                try:
-                    btn_syuko = driver.find_element(By.ID, "btnSyuko")
-                    log(f"    ✓ btnSyuko が見つかりました！")
-                    log(f"      - type: {btn_syuko.get_attribute('type')}")
-                    log(f"      - value: {btn_syuko.get_attribute('value')}")
-                    log(f"      - displayed: {btn_syuko.is_displayed()}")
-                except:
-                    log(f"    ✗ btnSyuko は見つかりません")
-
-                # フレーム内のボタンを全て列挙
-                buttons = driver.find_elements(By.TAG_NAME, "input")
-                submit_buttons = [b for b in buttons if b.get_attribute('type') in ['submit', 'button']]
-                if submit_buttons:
-                    log(f"    フレーム内のボタン数: {len(submit_buttons)}")
-                    for j, btn in enumerate(submit_buttons[:10]):  # 最初の10個
-                        try:
-                            log(f"      ボタン {j}: id={btn.get_attribute('id')}, "
-                                f"name={btn.get_attribute('name')}, "
-                                f"value={btn.get_attribute('value')}")
-                        except:
-                            pass
-
-                driver.switch_to.default_content()
-            except Exception as e:
-                log(f"  iframe {i} 調査エラー: {e}")
-                driver.switch_to.default_content()
-
+        frames = collect_page_structure(driver)
     except Exception as e:
         log(f"フレーム構造調査エラー: {e}")
-
-    # メインコンテンツ（フレーム外）を調査
-    log("\n--- メインコンテンツ（フレーム外） ---")
-    try:
-        driver.switch_to.default_content()
-
-        # btnRecalcを探す
-        try:
-            btn_recalc = driver.find_element(By.ID, "btnRecalc")
-            log(f"✓ btnRecalc が見つかりました（フレーム外）！")
-            log(f"  - type: {btn_recalc.get_attribute('type')}")
-            log(f"  - value: {btn_recalc.get_attribute('value')}")
-            log(f"  - displayed: {btn_recalc.is_displayed()}")
-        except:
-            log(f"✗ btnRecalc は見つかりません（フレーム外）")
-
-        # btnSyukoを探す
-        try:
-            btn_syuko = driver.find_element(By.ID, "btnSyuko")
-            log(f"✓ btnSyuko が見つかりました（フレーム外）！")
-            log(f"  - type: {btn_syuko.get_attribute('type')}")
-            log(f"  - value: {btn_syuko.get_attribute('value')}")
-            log(f"  - displayed: {btn_syuko.is_displayed()}")
-        except:
-            log(f"✗ btnSyuko は見つかりません（フレーム外）")
-
-        # 全てのボタンを列挙
-        buttons = driver.find_elements(By.TAG_NAME, "input")
-        submit_buttons = [b for b in buttons if b.get_attribute('type') in ['submit', 'button']]
-        log(f"\nメインコンテンツのボタン数: {len(submit_buttons)}")
-        for i, btn in enumerate(submit_buttons[:20]):  # 最初の20個
-            try:
-                btn_id = btn.get_attribute('id')
-                btn_name = btn.get_attribute('name')
-                btn_value = btn.get_attribute('value')
-                log(f"  ボタン {i}: id={btn_id}, name={btn_name}, value={btn_value}")
-            except:
-                pass
-
-    except Exception as e:
-        log(f"メインコンテンツ調査エラー: {e}")
+        log("\n========== ページ構造調査終了 ==========\n")
+        return
+
+    for frame in frames:
+        if frame['path']:
+            log(f"\n--- フレーム {'/'.join(frame['path'])} ---")
+            log(f"  - id: {frame.get('id')}")
+            log(f"  - name: {frame.get('name')}")
+            log(f"  - src: {frame.get('src')}")
+            max_buttons = 10  # 最初の10個
+        else:
+            log("\n--- メインコンテンツ（フレーム外） ---")
+            max_buttons = 20  # 最初の20個
+
+        if not frame.get('accessible'):
+            log("  フレームの内容を取得できません（読み込み前または別オリジン）")
+            continue
+
+        log(f"  URL: {frame.get('url')}")
+        log(f"  ページタイトル: {frame.get('title')}")
+        log(f"  読み込み状態: {frame.get('ready_state')}")
+        timing = frame.get('timing')
+        if timing:
+            log(f"  読み込み時間: 応答 {timing.get('response')}ms / DOM {timing.get('dom_ready')}ms / "
+                f"完了 {timing.get('load')}ms")
+
+        for element_id, element in (frame.get('targets') or {}).items():
+            if element:
+                log(f"    ✓ {element_id} が見つかりました！")
+                log(f"      - type: {element.get('type')}")
+                log(f"      - value: {element.get('value')}")
+                log(f"      - displayed: {element.get('displayed')}")
+            else:
+                log(f"    ✗ {element_id} は見つかりません")
+
+        buttons = frame.get('buttons') or []
+        log(f"    ボタン数: {len(buttons)}")
+        for j, btn in enumerate(buttons[:max_buttons]):
+            log(f"      ボタン {j}: id={btn.get('id')}, name={btn.get('name')}, value={btn.get('value')}")
+
+    record_step(driver, "ページ構造調査")
 
     log("\n========== ページ構造調査終了 ==========\n")
 
@@ -0,0 +1,227 @@
+"""WebDriverセッションプール
+
+一括処理でアカウントごとにChromeを起動・終了すると、起動時間とメモリの確保が
+毎回発生する。プールは起動済みのChromeを保持し、ログアウト後に Cookie などを
+リセットして次のアカウントで再利用する。
+
+使用回数が上限に達したセッション、メモリ使用量が上限を超えたセッション、
+応答しなくなったセッションは終了し、次回の取得時に新しく起動する。
+
+使用例:
+    pool = create_driver_pool(size=4, profile="lean", max_uses=20, max_memory_mb=1500)
+    entry = acquire_driver(pool, download_path)
+    try:
+        login(entry['driver'], account)
+        ...
+    finally:
+        release_driver(pool, entry)
+    close_driver_pool(pool)
+"""
+import queue
+import threading
+from datetime import datetime
+from operations import clear_frame_cache
+from window_registry import clear_window_registry
+from utils import (
+    setup_driver,
+    close_http_session,
+    reset_driver_session,
+    set_download_path,
+    get_driver_memory,
+    is_memory_measurable
+)
+
+
+def create_driver_pool(size=4, profile="lean", max_uses=20, max_memory_mb=None):
+    """ドライバープールを作成（Chromeは取得時に必要な分だけ起動）
+
+    Args:
+        size: 保持するセッション数の上限
+        profile: setup_driver() のプロファイル名
+        max_uses: 1セッションを再利用する最大回数（超えたら終了して起動し直す）
+        max_memory_mb: 1セッションのメモリ使用量の上限（MB、None の場合は確認しない）
+
+    Returns:
+        dict: プール情報
+    """
+    if max_memory_mb and not is_memory_measurable():
+        print(f"⚠️ psutil がインストールされていないため、メモリ使用量の上限（{max_memory_mb}MB）で"
+              "ブラウザを起動し直す機能は無効です（pip install psutil）")
+    return {
+        'size': max(1, size),
+        'profile': profile,
+        'max_uses': max_uses,
+        'max_memory_mb': max_memory_mb,
+        'idle': queue.LifoQueue(),  # 直前に使ったセッションから再利用する
+        'entries': {},  # エントリID → エントリ
+        'lock': threading.Lock(),
+        'slots': threading.BoundedSemaphore(max(1, size)),
+        'next_id': 1,
+        'stats': {
+            'created': 0,
+            'reused': 0,
+            'recycled': 0,
+            'failed': 0
+        }
+    }
+
+
+def _start_entry(pool, download_path):
+    """新しいChromeを起動してプールに登録"""
+    driver = setup_driver(download_path, pool['profile'])
+    with pool['lock']:
+        entry = {
+            'id': pool['next_id'],
+            'driver': driver,
+            'uses': 0,
+            'created_at': datetime.now().isoformat(),
+            'last_used_at': None,
+            'memory_mb': None,
+            'in_use': False
+        }
+        pool['next_id'] += 1
+        pool['entries'][entry['id']] = entry
+        pool['stats']['created'] += 1
+    return entry
+
+
+def _quit_entry(pool, entry, reason):
+    """セッションを終了してプールから外す"""
+    driver = entry['driver']
+    clear_frame_cache(driver)
+    clear_window_registry(driver)
+    close_http_session(driver)
+    try:
+        driver.quit()
+    except Exception:
+        pass
+
+    with pool['lock']:
+        pool['entries'].pop(entry['id'], None)
+        if reason == 'failed':
+            pool['stats']['failed'] += 1
+        elif reason == 'recycled':
+            pool['stats']['recycled'] += 1
+    if reason != 'closed':
+        print(f"ブラウザセッション {entry['id']} を終了しました（{reason}、使用回数 {entry['uses']}）")
+
+
+def is_driver_alive(driver):
+    """ブラウザが応答するかどうかを確認"""
+    try:
+        driver.execute_script("return 1")
+        return True
+    except Exception:
+        return False
+
+
+def acquire_driver(pool, download_path, timeout=None):
+    """プールからセッションを取得（空きがなければ起動、上限に達していれば空くまで待機）
+
+    Args:
+        pool: create_driver_pool() の戻り値
+        download_path: このアカウントのダウンロード先フォルダ
+        timeout: 空きを待つ最大時間（秒、None の場合は無制限）
+
+    Returns:
+        dict: セッションのエントリ（entry['driver'] がドライバー）
+    """
+    if not pool['slots'].acquire(timeout=timeout):
+        raise TimeoutError("ブラウザセッションの空きがありません")
+
+    try:
+        while True:
+            try:
+                entry = pool['idle'].get_nowait()
+            except queue.Empty:
+                entry = _start_entry(pool, download_path)
+                break
+
+            # 待機中に落ちたセッションは捨てて次を探す
+            if is_driver_alive(entry['driver']) and set_download_path(entry['driver'], download_path):
+                with pool['lock']:
+                    pool['stats']['reused'] += 1
+                break
+            _quit_entry(pool, entry, 'failed')
+    except Exception:
+        pool['slots'].release()
+        raise
+
+    entry['in_use'] = True
+    entry['uses'] += 1
+    entry['last_used_at'] = datetime.now().isoformat()
+    return entry
+
+
+def release_driver(pool, entry, healthy=True):
+    """セッションをプールに戻す（リセットできない場合や上限を超えた場合は終了）
+
+    Args:
+        pool: create_driver_pool() の戻り値
+        entry: acquire_driver() の戻り値
+        healthy: 処理中にブラウザの異常がなかった場合True
+    """
+    try:
+        entry['in_use'] = False
+        driver = entry['driver']
+
+        if not healthy or not is_driver_alive(driver):
+            _quit_entry(pool, entry, 'failed')
+            return
+
+        if pool['max_uses'] and entry['uses'] >= pool['max_uses']:
+            _quit_entry(pool, entry, 'recycled')
+            return
+
+        entry['memory_mb'] = get_driver_memory(driver)
+        if pool['max_memory_mb'] and entry['memory_mb'] and entry['memory_mb'] > pool['max_memory_mb']:
+            _quit_entry(pool, entry, 'recycled')
+            return
+
+        # 前のアカウントの状態を残さない
+        clear_frame_cache(driver)
+        if not reset_driver_session(driver):
+            _quit_entry(pool, entry, 'failed')
+            return
+
+        pool['idle'].put(entry)
+    finally:
+        pool['slots'].release()
+
+
+def get_pool_health(pool):
+    """プールの状態を取得
+
+    Returns:
+        dict: セッション数・使用状況・統計
+    """
+    with pool['lock']:
+        entries = list(pool['entries'].values())
+        stats = dict(pool['stats'])
+
+    return {
+        'size': pool['size'],
+        'sessions': len(entries),
+        'in_use': sum(1 for e in entries if e['in_use']),
+        'idle': sum(1 for e in entries if not e['in_use']),
+        'memory_mb': [e['memory_mb'] for e in entries if e['memory_mb'] is not None],
+        'uses': [e['uses'] for e in entries],
+        'stats': stats,
+        'checked_at': datetime.now().isoformat()
+    }
+
+
+def close_driver_pool(pool):
+    """待機中のセッションをすべて終了"""
+    while True:
+        try:
+            entry = pool['idle'].get_nowait()
+        except queue.Empty:
+            break
+        _quit_entry(pool, entry, 'closed')
+
+    # 使用中のまま残ったセッション（異常終了など）も終了
+    with pool['lock']:
+        remaining = list(pool['entries'].values())
+    for entry in remaining:
+        _quit_entry(pool, entry, 'closed')
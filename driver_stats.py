@@ -0,0 +1,259 @@
+"""WebDriverコマンドの集計（種類別・呼び出し元関数別の回数と所要時間）
+
+find_element・switch_to.frame・execute_script・window_handles などの操作は、
+すべて driver.execute() を経由してChromeDriverとの1往復になる。
+instrument_driver() はこれを置き換え、コマンドの種類ごと・呼び出し元の関数ごとに
+回数と所要時間（ヒストグラム）を記録する。どの補助関数が往復を多く使っているか
+（switch_to_frame_with_element やウィンドウ整理のループなど）を調べるために使う。
+
+使用例:
+    driver = setup_driver(download_path)      # setup_driver() で自動的に設定される
+    ...
+    print(format_command_summary(get_command_stats(driver)))
+"""
+import os
+import sys
+import time
+import logging
+import functools
+
+# 所要時間ヒストグラムの区切り（ミリ秒）。最後の区間はこれ以上
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+# 業務終了時に集計を表示するかどうか（set_command_summary() で切り替え）
+command_summary_enabled = True
+
+# 呼び出し元として数えないモジュールのフォルダ・ファイル
+_SKIP_PATHS = (
+    os.path.dirname(os.path.abspath(__file__)) + os.sep + "driver_stats.py",
+    os.sep + "selenium" + os.sep,
+    os.sep + "urllib3" + os.sep
+)
+
+# コードオブジェクト → 呼び出し元の表示名（None の場合は数えない）
+_caller_labels = {}
+
+
+def set_command_summary(enabled):
+    """業務終了時のコマンド集計の表示を切り替える"""
+    global command_summary_enabled
+    command_summary_enabled = enabled
+
+
+def _new_stats():
+    return {'total': 0, 'elapsed': 0.0, 'by_command': {}, 'by_caller': {}}
+
+
+def _caller_label(code):
+    """コードオブジェクトの呼び出し元の表示名（"operations.switch_to_frame_path" など）"""
+    label = _caller_labels.get(code, False)
+    if label is False:
+        filename = code.co_filename
+        if any(path in filename for path in _SKIP_PATHS) or code.co_name == "<lambda>":
+            label = None
+        else:
+            module = os.path.splitext(os.path.basename(filename))[0]
+            label = f"{module}.{code.co_name}"
+        _caller_labels[code] = label
+    return label
+
+
+def find_caller(depth=2):
+    """WebDriverコマンドを実行した関数を探す（Selenium内部と lambda は飛ばす）"""
+    frame = sys._getframe(depth)
+    while frame is not None:
+        label = _caller_label(frame.f_code)
+        if label:
+            return label
+        frame = frame.f_back
+    return "unknown"
+
+
+def _bucket_index(elapsed_ms):
+    for i, limit in enumerate(LATENCY_BUCKETS_MS):
+        if elapsed_ms < limit:
+            return i
+    return len(LATENCY_BUCKETS_MS)
+
+
+def _record(stats, command, caller, elapsed):
+    stats['total'] += 1
+    stats['elapsed'] += elapsed
+
+    entry = stats['by_command'].get(command)
+    if entry is None:
+        entry = stats['by_command'][command] = {
+            'count': 0, 'elapsed': 0.0, 'max': 0.0, 'histogram': [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        }
+    entry['count'] += 1
+    entry['elapsed'] += elapsed
+    entry['max'] = max(entry['max'], elapsed)
+    entry['histogram'][_bucket_index(elapsed * 1000)] += 1
+
+    entry = stats['by_caller'].get(caller)
+    if entry is None:
+        entry = stats['by_caller'][caller] = {'count': 0, 'elapsed': 0.0, 'commands': {}}
+    entry['count'] += 1
+    entry['elapsed'] += elapsed
+    entry['commands'][command] = entry['commands'].get(command, 0) + 1
+
+
+def instrument_driver(driver):
+    """ドライバーのWebDriverコマンドを集計するようにする（2回目以降は何もしない）
+
+    driver._command_count にはコマンドの総数が入る（tracing のスパンで使用）。
+
+    Args:
+        driver: Seleniumドライバー
+
+    Returns:
+        driver: 引数のドライバー
+    """
+    if getattr(driver, '_command_stats', None) is not None:
+        return driver
+
+    execute = driver.execute
+    driver._command_stats = _new_stats()
+    driver._command_count = 0
+
+    def instrumented_execute(driver_command, params=None):
+        caller = find_caller()
+        start = time.perf_counter()
+        try:
+            return execute(driver_command, params)
+        finally:
+            driver._command_count += 1
+            _record(driver._command_stats, driver_command, caller, time.perf_counter() - start)
+
+    driver.execute = instrumented_execute
+    return driver
+
+
+def get_command_stats(driver):
+    """ドライバーのコマンド集計を取得（集計していないドライバーは None）"""
+    return getattr(driver, '_command_stats', None)
+
+
+def reset_command_stats(driver):
+    """ドライバーのコマンド集計を消去（ドライバーをプールで使い回す場合など）"""
+    if getattr(driver, '_command_stats', None) is not None:
+        driver._command_stats = _new_stats()
+
+
+def snapshot_command_stats(driver):
+    """現時点のコマンド集計のコピー（diff_command_stats() で差分を取るため）"""
+    stats = get_command_stats(driver)
+    if stats is None:
+        return None
+    return {
+        'total': stats['total'],
+        'elapsed': stats['elapsed'],
+        'by_command': {k: {**v, 'histogram': list(v['histogram'])} for k, v in stats['by_command'].items()},
+        'by_caller': {k: {**v, 'commands': dict(v['commands'])} for k, v in stats['by_caller'].items()}
+    }
+
+
+def diff_command_stats(after, before):
+    """2つのコマンド集計の差分（before 以降に実行したコマンド）"""
+    if after is None:
+        return None
+    before = before or _new_stats()
+    result = {'total': after['total'] - before['total'], 'elapsed': after['elapsed'] - before['elapsed'],
+              'by_command': {}, 'by_caller': {}}
+
+    for command, entry in after['by_command'].items():
+        prev = before['by_command'].get(command)
+        count = entry['count'] - (prev['count'] if prev else 0)
+        if count:
+            result['by_command'][command] = {
+                'count': count,
+                'elapsed': entry['elapsed'] - (prev['elapsed'] if prev else 0.0),
+                'max': entry['max'],  # 最大値は差分を取れないため累計の値
+                'histogram': [a - b for a, b in zip(entry['histogram'],
+                                                     prev['histogram'] if prev else [0] * len(entry['histogram']))]
+            }
+
+    for caller, entry in after['by_caller'].items():
+        prev = before['by_caller'].get(caller)
+        count = entry['count'] - (prev['count'] if prev else 0)
+        if count:
+            prev_commands = prev['commands'] if prev else {}
+            result['by_caller'][caller] = {
+                'count': count,
+                'elapsed': entry['elapsed'] - (prev['elapsed'] if prev else 0.0),
+                'commands': {k: v - prev_commands.get(k, 0) for k, v in entry['commands'].items()
+                             if v - prev_commands.get(k, 0)}
+            }
+    return result
+
+
+def percentile_from_histogram(histogram, ratio):
+    """ヒストグラムからパーセンタイルの区間上限（ミリ秒）を求める（最後の区間は None）"""
+    total = sum(histogram)
+    if not total:
+        return 0
+    threshold = total * ratio
+    cumulative = 0
+    for i, count in enumerate(histogram):
+        cumulative += count
+        if cumulative >= threshold:
+            return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else None
+    return None
+
+
+def _format_bucket(limit_ms):
+    """パーセンタイルの区間上限の表示（"<20" は20ミリ秒未満）"""
+    return f"<{limit_ms}" if limit_ms is not None else f">={LATENCY_BUCKETS_MS[-1]}"
+
+
+def format_command_summary(stats, title="WebDriverコマンド集計", top=10):
+    """コマンド集計を表示用の文字列にする
+
+    Args:
+        stats: get_command_stats() / diff_command_stats() の戻り値
+        title: 見出し
+        top: 呼び出し元関数の表示件数
+
+    Returns:
+        str: 集計結果
+    """
+    if not stats or not stats['total']:
+        return f"=== {title}: コマンドなし ==="
+
+    lines = [f"=== {title}: {stats['total']}回 / {stats['elapsed']:.2f}秒 ==="]
+    lines.append(f"{'コマンド':<28} {'回数':>6} {'合計(秒)':>9} {'平均(ms)':>9} {'p50':>6} {'p95':>6} {'最大(ms)':>9}")
+    for command, entry in sorted(stats['by_command'].items(), key=lambda x: x[1]['elapsed'], reverse=True):
+        p50 = percentile_from_histogram(entry['histogram'], 0.5)
+        p95 = percentile_from_histogram(entry['histogram'], 0.95)
+        lines.append(
+            f"{command:<28} {entry['count']:>6} {entry['elapsed']:>9.2f} "
+            f"{entry['elapsed'] / entry['count'] * 1000:>9.1f} "
+            f"{_format_bucket(p50):>6} {_format_bucket(p95):>6} {entry['max'] * 1000:>9.1f}"
+        )
+
+    lines.append(f"\n呼び出し元（往復回数の多い順、上位{top}件）")
+    callers = sorted(stats['by_caller'].items(), key=lambda x: x[1]['count'], reverse=True)[:top]
+    for caller, entry in callers:
+        commands = ", ".join(f"{k}×{v}" for k, v in sorted(entry['commands'].items(), key=lambda x: -x[1])[:4])
+        lines.append(f"  {caller:<40} {entry['count']:>6}回 {entry['elapsed']:>7.2f}秒  ({commands})")
+    return "\n".join(lines)
+
+
+def report_commands(name, logger_name="operations"):
+    """業務のWebDriverコマンド集計を終了時に表示するデコレーター（最初の引数がドライバー）"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            driver = args[0] if args else None
+            before = snapshot_command_stats(driver)
+            if before is None or not command_summary_enabled:
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                summary = format_command_summary(
+                    diff_command_stats(get_command_stats(driver), before), f"{name} のWebDriverコマンド")
+                print("\n" + summary)
+                logging.getLogger(logger_name).debug("\n" + summary)
+        return wrapper
+    return decorator
@@ -0,0 +1,224 @@
+"""操作ログの設定（プロセスで1回だけ設定する）
+
+ログはキュー経由で別スレッド（QueueListener）が書き込むため、
+ブラウザ操作のスレッドはファイルへの書き込みを待たない。
+
+ファイルは日付ごと（logs/operation_YYYYMMDD.log）に分け、1日分がサイズ上限を
+超えた場合は operation_YYYYMMDD.log.1, .2 ... に切り替える。
+各行には店舗IDと業務名が付く（一括処理で複数店舗のログが混ざっても区別できる）。
+
+使用例:
+    setup_logging(log_dir="logs", max_bytes=10 * 1024 * 1024)
+    set_log_context(store_id="1234", operation="daily_inventory")
+    logging.getLogger("operations").info("...")
+    shutdown_logging()
+"""
+import os
+import glob
+import queue
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = '[%(asctime)s] %(levelname)s [%(store_id)s/%(operation)s] %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+LOG_FILE_PREFIX = "operation"
+
+# ログを書き込むロガー名
+LOGGER_NAMES = ["operations"]
+
+# 設定状態（setup_logging() で設定）
+_logging_state = {
+    'listener': None,
+    'file_handler': None,
+    'queue_handler': None
+}
+_logging_lock = threading.Lock()
+
+# スレッドごとの店舗ID・業務名（一括処理ではアカウントごとにスレッドが異なる）
+_log_context = threading.local()
+
+
+class ContextFilter(logging.Filter):
+    """ログに店舗ID・業務名を付ける（ログを出したスレッドで実行される）"""
+
+    def filter(self, record):
+        record.store_id = getattr(_log_context, 'store_id', None) or "-"
+        record.operation = getattr(_log_context, 'operation', None) or "-"
+        return True
+
+
+class DailyRotatingFileHandler(RotatingFileHandler):
+    """日付ごとのファイルに書き込み、サイズ上限を超えたら連番のファイルに切り替える"""
+
+    def __init__(self, log_dir, prefix=LOG_FILE_PREFIX, max_bytes=0, backup_count=0, encoding='utf-8'):
+        self.log_dir = log_dir
+        self.prefix = prefix
+        self.day = date.today()
+        super().__init__(self._path_for(self.day), maxBytes=max_bytes, backupCount=backup_count,
+                         encoding=encoding)
+
+    def _path_for(self, day):
+        return os.path.join(self.log_dir, f"{self.prefix}_{day.strftime('%Y%m%d')}.log")
+
+    def shouldRollover(self, record):
+        if date.today() != self.day:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        today = date.today()
+        if today == self.day:
+            # サイズ上限による切り替え（.1, .2 ... に移す）
+            super().doRollover()
+            return
+
+        # 日付が変わったら新しい日付のファイルに書き込む
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        self.day = today
+        self.baseFilename = os.path.abspath(self._path_for(today))
+        self.stream = self._open()
+
+
+def remove_old_logs(log_dir, retention_days, prefix=LOG_FILE_PREFIX):
+    """保存期間を過ぎたログファイルを削除
+
+    Args:
+        log_dir: ログフォルダ
+        retention_days: 保存日数（0 または None の場合は削除しない）
+        prefix: ログファイル名の接頭辞
+
+    Returns:
+        int: 削除したファイル数
+    """
+    if not retention_days:
+        return 0
+
+    limit = (datetime.now() - timedelta(days=retention_days)).timestamp()
+    removed = 0
+    for path in glob.glob(os.path.join(log_dir, f"{prefix}_*.log*")):
+        try:
+            if os.path.getmtime(path) < limit:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def setup_logging(log_dir="logs", max_bytes=10 * 1024 * 1024, backup_count=5, retention_days=30,
+                  console=True):
+    """ログを設定（2回目以降の呼び出しは何もしない）
+
+    Args:
+        log_dir: ログフォルダ
+        max_bytes: 1ファイルのサイズ上限（バイト、0 の場合は日付でのみ切り替える）
+        backup_count: 1日あたりに残す切り替え後のファイル数
+        retention_days: ログファイルの保存日数
+        console: コンソールにも出力する場合True
+
+    Returns:
+        str: 現在のログファイルのパス
+    """
+    with _logging_lock:
+        if _logging_state['listener']:
+            return _logging_state['file_handler'].baseFilename
+
+        os.makedirs(log_dir, exist_ok=True)
+        remove_old_logs(log_dir, retention_days)
+
+        formatter = logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+
+        file_handler = DailyRotatingFileHandler(log_dir, max_bytes=max_bytes, backup_count=backup_count)
+        file_handler.setLevel(logging.DEBUG)
+        file_handler.setFormatter(formatter)
+        handlers = [file_handler]
+
+        if console:
+            console_handler = logging.StreamHandler()
+            console_handler.setLevel(logging.INFO)
+            console_handler.setFormatter(formatter)
+            handlers.append(console_handler)
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = QueueHandler(log_queue)
+        queue_handler.addFilter(ContextFilter())
+
+        for name in LOGGER_NAMES:
+            logger = logging.getLogger(name)
+            logger.setLevel(logging.DEBUG)
+            logger.propagate = False
+            logger.addHandler(queue_handler)
+
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+
+        _logging_state['listener'] = listener
+        _logging_state['file_handler'] = file_handler
+        _logging_state['queue_handler'] = queue_handler
+
+    atexit.register(shutdown_logging)
+    return file_handler.baseFilename
+
+
+def get_log_file():
+    """現在のログファイルのパスを取得（未設定の場合は None）"""
+    file_handler = _logging_state['file_handler']
+    return file_handler.baseFilename if file_handler else None
+
+
+def shutdown_logging():
+    """キューに残ったログを書き込んで終了"""
+    with _logging_lock:
+        listener = _logging_state['listener']
+        if not listener:
+            return
+
+        listener.stop()
+        for name in LOGGER_NAMES:
+            logging.getLogger(name).removeHandler(_logging_state['queue_handler'])
+        for handler in listener.handlers:
+            handler.close()
+
+        _logging_state['listener'] = None
+        _logging_state['file_handler'] = None
+        _logging_state['queue_handler'] = None
+
+
+def set_log_context(store_id=None, operation=None):
+    """このスレッドのログに付ける店舗ID・業務名を設定（None の項目は変更しない）"""
+    if store_id is not None:
+        _log_context.store_id = store_id
+    if operation is not None:
+        _log_context.operation = operation
+
+
+def clear_log_context():
+    """このスレッドの店舗ID・業務名を消去"""
+    _log_context.store_id = None
+    _log_context.operation = None
+
+
+@contextmanager
+def log_context(store_id=None, operation=None):
+    """with ブロックの間だけ店舗ID・業務名を設定"""
+    previous = (getattr(_log_context, 'store_id', None), getattr(_log_context, 'operation', None))
+    set_log_context(store_id, operation)
+    try:
+        yield
+    finally:
+        _log_context.store_id, _log_context.operation = previous
+
+
+def get_log_context():
+    """このスレッドの店舗ID・業務名を取得
+
+    Returns:
+        tuple: (店舗ID, 業務名)。未設定の項目は None
+    """
+    return getattr(_log_context, 'store_id', None), getattr(_log_context, 'operation', None)
@@ -10,8 +10,19 @@ from auth import (
     logout,
     load_accounts
 )
-from operations import daily_inventory, auto_order, check_messages
-from utils import setup_driver
+from operations import (
+    daily_inventory,
+    auto_order,
+    check_messages,
+    set_pdf_download_mode,
+    set_stock_backend,
+    MESSAGE_TITLE_RULES
+)
+from utils import setup_driver, start_print_queue, stop_print_queue, create_print_backend
+from log_setup import setup_logging, shutdown_logging
+from tracing import enable_tracing, export_trace
+from driver_stats import set_command_summary
+from page_recorder import start_recording, stop_recording
 
 
 def normalize_input(text):
@@ -34,13 +45,40 @@ def load_config():
     default_config = {
         "download_path": os.path.join(os.getcwd(), "downloads"),
         "should_print_pdf": True,
+        "pdf_download_mode": "browser",  # browser: ダウンロードフォルダから取得 / direct: 印刷URLを直接取得（見つからない場合は browser と同じ）
+        "print_backend": "printer",  # printer: 既定のプリンタで印刷 / copy: print_copy_dir にコピー / noop: 印刷しない
+        "print_copy_dir": os.path.join(os.getcwd(), "printed"),
+        "print_max_retries": 2,  # 印刷失敗時の再試行回数
         "message_processing": {
             "購入伺い": True,
             "マッチング：使用期限": True,
             "不動在庫転送": True,
             "返信": True
         },
-        "max_message_count": 10  # 連絡板の最大処理件数
+        "max_message_count": 10,  # 連絡板の最大処理件数
+        "message_open_mode": "click",  # click: 一覧をクリックして開く / direct: 処理の直前にメッセージIDを取得してURLで開く（本番での確認前）
+        "message_fetch_mode": "browser",  # browser: ウィンドウで開く / http: 購入伺いの本文をHTTPで先に並列取得（direct のみ）
+        "message_fetch_workers": 4,  # 本文を同時に取得する数
+        "stock_backend": "json",  # json: 店舗ごとのJSONファイル / sqlite: stock_db_path のデータベース
+        "stock_db_path": os.path.join("data", "stock.db"),
+        "browser_profile": "default",  # default: 通常表示 / lean: ヘッドレス・画像なし
+        "log_dir": "logs",
+        "log_max_mb": 10,  # 1日分のログがこれを超えたら別ファイルに切り替える
+        "log_backup_count": 5,  # 1日あたりに残す切り替え後のファイル数
+        "log_retention_days": 30,  # これより古いログファイルは起動時に削除
+        "trace_enabled": False,  # 処理ステップごとの所要時間を記録する
+        "trace_dir": "traces",  # トレースの保存先（JSON Lines と Chrome トレース形式）
+        "command_summary": True,  # 業務の終了時にWebDriverコマンドの回数・所要時間を表示
+        "record_enabled": False,  # クリックなどのステップごとに全フレームの画面を記録する
+        "record_dir": "recordings",  # 画面の記録の保存先（stub_server.py --snapshots で再生）
+        "batch": {
+            "max_sessions": 4,  # 一括処理で同時に起動するブラウザ数
+            "browser_profile": "lean",  # 一括処理で使うブラウザプロファイル
+            "reuse_sessions": True,  # ブラウザを再起動せずに次の店舗を処理する
+            "session_max_uses": 20,  # 1つのブラウザで処理する最大店舗数
+            "session_max_memory_mb": 1500,  # これを超えたブラウザは終了して起動し直す
+            "operations": ["daily_inventory"]  # 一括処理で実行する業務
+        }
     }
 
     if os.path.exists(config_file):
@@ -146,12 +184,7 @@ def main():
                 msg_proc = config['message_processing']
 
                 # 処理可能なメールタイトルのリスト
-                mail_types = [
-                    "購入伺い",
-                    "マッチング：使用期限",
-                    "不動在庫転送",
-                    "返信"
-                ]
+                mail_types = [rule['key'] for rule in MESSAGE_TITLE_RULES]
 
                 print("\n=== スキップするメールの種類 ===")
                 print("処理をスキップするメールの種類を選択してください")
@@ -212,11 +245,27 @@ def main():
     # ダウンロードフォルダを設定
     download_path = config['download_path']
     os.makedirs(download_path, exist_ok=True)
+    set_pdf_download_mode(config.get('pdf_download_mode', 'browser'))
+    set_stock_backend(config.get('stock_backend', 'json'), config.get('stock_db_path'))
+    setup_logging(
+        config.get('log_dir', 'logs'),
+        max_bytes=config.get('log_max_mb', 10) * 1024 * 1024,
+        backup_count=config.get('log_backup_count', 5),
+        retention_days=config.get('log_retention_days', 30)
+    )
+    enable_tracing(config.get('trace_enabled', False))
+    set_command_summary(config.get('command_summary', True))
+    if config.get('record_enabled', False):
+        print(f"画面の記録: {start_recording(config.get('record_dir', 'recordings'))}")
+    start_print_queue(
+        create_print_backend(config.get('print_backend', 'printer'), config.get('print_copy_dir')),
+        max_retries=config.get('print_max_retries', 2)
+    )
 
     driver = None
     try:
         # Seleniumドライバーをセットアップ
-        driver = setup_driver(download_path)
+        driver = setup_driver(download_path, config.get('browser_profile', 'default'))
 
         # ログイン
         if not login(driver, account):
@@ -240,10 +289,10 @@ def main():
             work_choice = normalize_input(input("\n作業を選択してください: "))
 
             if work_choice == "1":
-                if daily_inventory(driver, download_path, config['should_print_pdf']):
+                if daily_inventory(driver, download_path, config['should_print_pdf'], current_store_id):
                     input("\n処理が完了しました。Enterキーを押して続行...")
             elif work_choice == "2":
-                if auto_order(driver, download_path, config['should_print_pdf']):
+                if auto_order(driver, download_path, config['should_print_pdf'], current_store_id):
                     input("\n処理が完了しました。Enterキーを押して続行...")
             elif work_choice == "3":
                 if check_messages(driver, account['user_id'], config):
@@ -263,6 +312,15 @@ def main():
     finally:
         if driver:
             driver.quit()
+        # 印刷待ちのPDFを印刷してから終了
+        stop_print_queue(wait=True)
+        jsonl_path, chrome_path = export_trace(config.get('trace_dir', 'traces'))
+        if chrome_path:
+            print(f"トレース: {jsonl_path} / {chrome_path}（chrome://tracing で表示）")
+        recording = stop_recording()
+        if recording:
+            print(f"画面の記録: {recording['archive_dir']}（{recording['steps']}ステップ）")
+        shutdown_logging()
 
 
 if __name__ == "__main__":
@@ -4,54 +4,334 @@ import os
 import json
 import logging
 import re
+import random
+import threading
+from collections import deque
 from datetime import datetime
+from selenium.common.exceptions import StaleElementReferenceException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from utils import download_pdf, print_pdf
+from urllib.parse import urljoin
+import stock_db
+from log_setup import setup_logging, set_log_context
+from tracing import span, start_span, end_span, traced
+from driver_stats import report_commands
+from page_recorder import record_step
+from window_registry import ensure_main_window, track_new_windows, close_popups, switch_to_main_window
+from utils import get_http_session, fetch_pages, html_to_text, download_pdf, enqueue_print, fetch_pdf, build_pdf_path, watch_downloads, stop_watching_downloads, set_downloads_enabled
 
 
 # ログ設定
-def setup_logger():
-    """操作ログを設定"""
-    log_dir = "logs"
-    os.makedirs(log_dir, exist_ok=True)
+def setup_logger(operation=None, store_id=None):
+    """操作ログを取得（ログの設定はプロセスで1回だけ行い、2回目以降はハンドラを追加しない）
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_file = os.path.join(log_dir, f"operation_{timestamp}.log")
+    Args:
+        operation: ログに付ける業務名
+        store_id: ログに付ける店舗ID
+
+    Returns:
+        tuple: (ロガー, ログファイルのパス)
+    """
+    log_file = setup_logging()
+    set_log_context(store_id, operation)
+    return logging.getLogger("operations"), log_file
+
+
+# 対話モード（Falseの場合は入力待ちで停止せずに処理を継続する）
+interactive_mode = True
+
+
+def set_interactive_mode(enabled):
+    """対話モードを切り替える
+
+    一括処理（batch_runner.py）では無人で実行するためFalseに設定する。
+
+    Args:
+        enabled: 入力待ちを行う場合True
+    """
+    global interactive_mode
+    interactive_mode = enabled
+
+
+# PDFの取得方法（"browser": ブラウザのダウンロードフォルダから取得 / "direct": 印刷URLをHTTPで直接取得）
+# direct は印刷URLが PRINT_URL_PATTERN に一致する場合だけ使われ、見つからない場合は browser と同じ方法で取得する
+pdf_download_mode = "browser"
+
+
+def set_pdf_download_mode(mode):
+    """PDFの取得方法を切り替える
+
+    Args:
+        mode: "direct" または "browser"
+    """
+    global pdf_download_mode
+    if mode not in ("direct", "browser"):
+        raise ValueError(f"不明なPDF取得方法です: {mode}")
+    pdf_download_mode = mode
+
+
+# ストックの保存先（"json": 店舗ごとのJSONファイル / "sqlite": 全店舗共通のデータベース）
+stock_backend = "json"
+stock_db_path = stock_db.DEFAULT_DB_PATH
+
+
+def set_stock_backend(backend, db_path=None):
+    """メッセージストック・不動医薬品リストの保存先を切り替える
+
+    Args:
+        backend: "json" または "sqlite"
+        db_path: SQLiteデータベースのパス（省略時は data/stock.db）
+    """
+    global stock_backend, stock_db_path
+    if backend not in ("json", "sqlite"):
+        raise ValueError(f"不明なストック保存先です: {backend}")
+    stock_backend = backend
+    if db_path:
+        stock_db_path = db_path
+
+
+def wait_for_user(prompt=""):
+    """ユーザーの入力（Enterキー）を待つ
+
+    非対話モードでは待機せずにそのまま戻る。
+
+    Args:
+        prompt: 表示するメッセージ
+    """
+    if interactive_mode:
+        input(prompt)
+    else:
+        print(f"（非対話モードのため入力待ちをスキップ）{prompt}")
+
+
+# ===========================
+# 待機条件（クリック後の「完了」の定義）
+# ===========================
+# 各条件はクリック前に prepare(driver, element) として呼ばれ、
+# クリック後にポーリングする判定関数 predicate(driver) -> bool を返す。
+
+# 待機条件の判定間隔（秒）
+WAIT_POLL_INTERVAL = 0.1
+
+# 印刷ボタン（集計完了後に表示される）
+PRINT_BUTTON_XPATH = "//input[@value='印刷'] | //input[@type='button' and contains(@onclick, '印刷')] | //a[contains(text(), '印刷')]"
+
+# 印刷ボタン待機の上限（秒）。従来の 5秒 + 30秒 + 300秒 に相当
+PRINT_BUTTON_DEADLINE = 335
+
+# 集計時間の記録先
+TALLY_TIMES_FILE = os.path.join("data", "tally_times.jsonl")
+_tally_lock = threading.Lock()
+
+# 待機時間の記録（description, condition, elapsed, met, timeout）
+# 長時間の一括処理でも増え続けないよう、直近 WAIT_TIMINGS_MAX 件だけを保持する
+WAIT_TIMINGS_MAX = 1000
+wait_timings = deque(maxlen=WAIT_TIMINGS_MAX)
+_wait_timings_lock = threading.Lock()
+
+
+def url_changed():
+    """URLが変わるまで待つ条件"""
+    def prepare(driver, element=None):
+        initial_url = driver.current_url
+        return lambda d: d.current_url != initial_url
+    prepare.condition_name = "url_changed"
+    return prepare
+
+
+def element_appears(by, value):
+    """要素が現れるまで待つ条件"""
+    def prepare(driver, element=None):
+        return lambda d: len(d.find_elements(by, value)) > 0
+    prepare.condition_name = f"element_appears({value})"
+    return prepare
+
+
+def element_disappears(by, value):
+    """要素が消えるまで待つ条件"""
+    def prepare(driver, element=None):
+        return lambda d: len(d.find_elements(by, value)) == 0
+    prepare.condition_name = f"element_disappears({value})"
+    return prepare
+
+
+def element_stale():
+    """クリックした要素がDOMから外れる（ポストバックで再描画される）まで待つ条件"""
+    def prepare(driver, element=None):
+        def predicate(d):
+            try:
+                element.is_enabled()
+                return False
+            except StaleElementReferenceException:
+                return True
+        return predicate
+    prepare.condition_name = "element_stale"
+    return prepare
+
+
+def document_ready():
+    """document.readyState が complete になるまで待つ条件"""
+    def prepare(driver, element=None):
+        return lambda d: d.execute_script('return document.readyState') == 'complete'
+    prepare.condition_name = "document_ready"
+    return prepare
+
+
+def alert_appears():
+    """JavaScriptのalert/confirmが表示されるまで待つ条件"""
+    def prepare(driver, element=None):
+        return lambda d: EC.alert_is_present()(d) is not False
+    prepare.condition_name = "alert_appears"
+    return prepare
+
+
+def new_window_opened():
+    """新しいウィンドウが開くまで待つ条件"""
+    def prepare(driver, element=None):
+        initial_count = len(driver.window_handles)
+        return lambda d: len(d.window_handles) > initial_count
+    prepare.condition_name = "new_window_opened"
+    return prepare
+
+
+def window_closed():
+    """ウィンドウが閉じるまで待つ条件"""
+    def prepare(driver, element=None):
+        initial_count = len(driver.window_handles)
+        return lambda d: len(d.window_handles) < initial_count
+    prepare.condition_name = "window_closed"
+    return prepare
+
+
+def network_idle(quiet_period=0.5):
+    """ページ読み込みが完了し、リソース取得が一定時間途絶えるまで待つ条件
 
-    # ロガーの設定
-    logger = logging.getLogger("operations")
-    logger.setLevel(logging.DEBUG)
+    Args:
+        quiet_period: 新しいリソース取得がない状態が続くべき時間（秒）
+    """
+    def prepare(driver, element=None):
+        state = {'count': -1, 'since': time.perf_counter()}
+
+        def predicate(d):
+            ready, count = d.execute_script(
+                "return [document.readyState, performance.getEntriesByType('resource').length];"
+            )
+            now = time.perf_counter()
+            if ready != 'complete' or count != state['count']:
+                state['count'] = count
+                state['since'] = now
+                return False
+            return now - state['since'] >= quiet_period
+        return predicate
+    prepare.condition_name = "network_idle"
+    return prepare
+
+
+def record_wait(description, condition, elapsed, met, timeout):
+    """待機時間を記録する"""
+    with _wait_timings_lock:
+        wait_timings.append({
+            'description': description,
+            'condition': condition,
+            'elapsed': round(elapsed, 3),
+            'met': met,
+            'timeout': timeout
+        })
+
+
+def get_wait_timings(reset=False):
+    """記録された待機時間を取得する
+
+    Args:
+        reset: 取得後に記録を消去する場合True
+
+    Returns:
+        list: 待機時間の記録
+    """
+    with _wait_timings_lock:
+        timings = list(wait_timings)
+        if reset:
+            wait_timings.clear()
+    return timings
 
-    # ファイルハンドラ
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
-    file_handler.setLevel(logging.DEBUG)
 
-    # コンソールハンドラ
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
+def wait_until(driver, predicate=None, timeout=10, description=None, logger=None, condition_name=None, until=None):
+    """判定関数がTrueになるまで待機する（timeoutは上限）
+
+    Args:
+        driver: Seleniumドライバー
+        predicate: 判定関数（driverを受け取りboolを返す）
+        timeout: 最大待機時間（秒）
+        description: 待機の説明（ログ出力用）
+        logger: ロガーオブジェクト
+        condition_name: 待機条件の名前（記録用、省略時は until の条件名）
+        until: 待機条件（network_idle() など。predicate の代わりに指定する）
 
-    # フォーマット
-    formatter = logging.Formatter('[%(asctime)s] %(levelname)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
+    Returns:
+        bool: 条件を満たした場合True、上限時間に達した場合False
+    """
+    if until is not None:
+        predicate = until(driver)
+        condition_name = condition_name or until.condition_name
+    condition_name = condition_name or "condition"
+    wait_span = start_span(description or condition_name, "wait", driver, condition=condition_name)
+    start = time.perf_counter()
+    deadline = start + timeout
+    met = False
+    while True:
+        try:
+            if predicate(driver):
+                met = True
+                break
+        except Exception:
+            # ページ遷移中やアラート表示中の一時的なエラーは未達として扱う
+            pass
+        if time.perf_counter() >= deadline:
+            break
+        time.sleep(WAIT_POLL_INTERVAL)
+
+    elapsed = time.perf_counter() - start
+    record_wait(description, condition_name, elapsed, met, timeout)
+    end_span(wait_span, "ok" if met else "timeout")
+    if logger:
+        if met:
+            logger.debug(f"{description or condition_name}: {elapsed:.2f}秒で完了（{condition_name}）")
+        else:
+            logger.debug(f"{description or condition_name}: 上限{timeout}秒に達しました（{condition_name}）")
+    return met
 
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
 
-    return logger, log_file
+def click_and_wait(driver, element, description, wait_time, until=None, logger=None):
+    """要素をクリックし、待機条件を満たすまで（最大wait_time秒）待機する
 
+    untilを省略した場合は従来どおりwait_time秒の固定待機を行う。
+    画面を記録中（page_recorder）の場合は、待機後の画面を記録する。
+    """
+    condition_name = getattr(until, 'condition_name', 'condition') if until else "sleep"
+    with span(description, "click", driver) as click_span:
+        if until is None:
+            element.click()
+            time.sleep(wait_time)
+            record_wait(description, "sleep", wait_time, True, wait_time)
+            met = True
+        else:
+            predicate = until(driver, element)
+            element.click()
+            met = wait_until(driver, predicate, wait_time, description, logger, condition_name)
+            if click_span and not met:
+                click_span['outcome'] = "timeout"
 
-# グローバルロガー
-operation_logger = None
-current_log_file = None
+    record_step(driver, description, condition=condition_name, met=met)
+    return met
 
 
-def safe_click(driver, element, description, wait_time=2, logger=None):
+def safe_click(driver, element, description, wait_time=2, logger=None, until=None):
     """要素を安全にクリックし、標準待機時間（デフォルト2秒）で待機する
 
     メッセージ閲覧、伝票作成など通常の操作用。
+    untilに待機条件を指定すると、条件を満たした時点で待機を終える
+    （wait_timeは上限として扱う）。
 
     Args:
         driver: Seleniumドライバー
@@ -59,6 +339,7 @@ def safe_click(driver, element, description, wait_time=2, logger=None):
         description: 操作の説明（ログ出力用）
         wait_time: クリック後の待機時間（秒）デフォルト2秒
         logger: ロガーオブジェクト
+        until: 待機条件（url_changed(), alert_appears() など）
 
     Returns:
         bool: 成功時True、失敗時False
@@ -68,8 +349,7 @@ def safe_click(driver, element, description, wait_time=2, logger=None):
             logger.info(f"{description}をクリックします...")
         print(f"{description}をクリックします...")
 
-        element.click()
-        time.sleep(wait_time)
+        click_and_wait(driver, element, description, wait_time, until, logger)
 
         return True
     except Exception as e:
@@ -79,10 +359,12 @@ def safe_click(driver, element, description, wait_time=2, logger=None):
         return False
 
 
-def safe_click_heavy(driver, element, description, wait_time=10, logger=None):
+def safe_click_heavy(driver, element, description, wait_time=10, logger=None, until=None):
     """要素を安全にクリックし、長めの待機時間（デフォルト10秒）で待機する
 
     発注処理など、100件近い医薬品集計を伴う重い処理用。
+    untilに待機条件を指定すると、条件を満たした時点で待機を終える
+    （wait_timeは上限として扱う）。
 
     Args:
         driver: Seleniumドライバー
@@ -90,17 +372,17 @@ def safe_click_heavy(driver, element, description, wait_time=10, logger=None):
         description: 操作の説明（ログ出力用）
         wait_time: クリック後の待機時間（秒）デフォルト10秒
         logger: ロガーオブジェクト
+        until: 待機条件（url_changed(), alert_appears() など）
 
     Returns:
         bool: 成功時True、失敗時False
     """
     try:
         if logger:
-            logger.info(f"{description}をクリックします（重い処理：約{wait_time}秒待機）...")
-        print(f"{description}をクリックします（重い処理：約{wait_time}秒待機）...")
+            logger.info(f"{description}をクリックします（重い処理：最大{wait_time}秒待機）...")
+        print(f"{description}をクリックします（重い処理：最大{wait_time}秒待機）...")
 
-        element.click()
-        time.sleep(wait_time)
+        click_and_wait(driver, element, description, wait_time, until, logger)
 
         return True
     except Exception as e:
@@ -110,7 +392,7 @@ def safe_click_heavy(driver, element, description, wait_time=10, logger=None):
         return False
 
 
-def safe_find_and_click(driver, by, value, description, wait_time=2, logger=None):
+def safe_find_and_click(driver, by, value, description, wait_time=2, logger=None, until=None):
     """要素を検索してクリックし、標準待機時間で待機する
 
     メッセージ閲覧、伝票作成など通常の操作用。
@@ -122,6 +404,7 @@ def safe_find_and_click(driver, by, value, description, wait_time=2, logger=None
         description: 操作の説明（ログ出力用）
         wait_time: クリック後の待機時間（秒）デフォルト2秒
         logger: ロガーオブジェクト
+        until: 待機条件（省略時は固定待機）
 
     Returns:
         bool: 成功時True、失敗時False
@@ -134,7 +417,7 @@ def safe_find_and_click(driver, by, value, description, wait_time=2, logger=None
         if logger:
             logger.info(f"{description}が見つかりました")
 
-        return safe_click(driver, element, description, wait_time, logger)
+        return safe_click(driver, element, description, wait_time, logger, until)
     except Exception as e:
         if logger:
             logger.error(f"{description}の要素が見つかりません: {e}")
@@ -142,7 +425,7 @@ def safe_find_and_click(driver, by, value, description, wait_time=2, logger=None
         return False
 
 
-def safe_find_and_click_heavy(driver, by, value, description, wait_time=10, logger=None):
+def safe_find_and_click_heavy(driver, by, value, description, wait_time=10, logger=None, until=None):
     """要素を検索してクリックし、長めの待機時間で待機する
 
     発注処理など、100件近い医薬品集計を伴う重い処理用。
@@ -154,13 +437,14 @@ def safe_find_and_click_heavy(driver, by, value, description, wait_time=10, logg
         description: 操作の説明（ログ出力用）
         wait_time: クリック後の待機時間（秒）デフォルト10秒
         logger: ロガーオブジェクト
+        until: 待機条件（省略時は固定待機）
 
     Returns:
         bool: 成功時True、失敗時False
     """
     try:
         element = driver.find_element(by, value)
-        return safe_click_heavy(driver, element, description, wait_time, logger)
+        return safe_click_heavy(driver, element, description, wait_time, logger, until)
     except Exception as e:
         if logger:
             logger.error(f"{description}の要素が見つかりません: {e}")
@@ -168,6 +452,82 @@ def safe_find_and_click_heavy(driver, by, value, description, wait_time=10, logg
         return False
 
 
+def poll_until(check, deadline, initial_interval=0.3, max_interval=2.0, backoff=1.5, jitter=0.2,
+               description=None, logger=None):
+    """条件を満たすまで間隔を徐々に延ばしながら確認する（指数バックオフ＋ジッター）
+
+    Args:
+        check: 確認関数（引数なし、boolを返す）
+        deadline: 最大待機時間（秒）
+        initial_interval: 最初の確認間隔（秒）
+        max_interval: 確認間隔の上限（秒）
+        backoff: 確認間隔の倍率
+        jitter: 確認間隔に加えるゆらぎの割合（0.2 = ±20%）
+        description: 待機の説明（ログ出力用）
+        logger: ロガーオブジェクト
+
+    Returns:
+        tuple: (条件を満たした場合True, 経過時間（秒）)
+    """
+    poll_span = start_span(description or "ポーリング", "wait", condition="poll")
+    start = time.perf_counter()
+    interval = initial_interval
+    attempts = 0
+    met = False
+    while True:
+        attempts += 1
+        try:
+            if check():
+                met = True
+                break
+        except Exception:
+            pass
+
+        remaining = deadline - (time.perf_counter() - start)
+        if remaining <= 0:
+            break
+        sleep_time = interval * (1 + random.uniform(-jitter, jitter))
+        time.sleep(max(0, min(sleep_time, remaining)))
+        interval = min(interval * backoff, max_interval)
+
+    elapsed = time.perf_counter() - start
+    record_wait(description, "poll", elapsed, met, deadline)
+    if poll_span:
+        poll_span['attrs']['attempts'] = attempts
+    end_span(poll_span, "ok" if met else "timeout")
+    if logger:
+        logger.debug(f"{description or 'ポーリング'}: {attempts}回確認、{elapsed:.2f}秒（{'完了' if met else '上限到達'}）")
+    return met, elapsed
+
+
+def record_tally_time(store_id, operation, elapsed, found, tally_file=TALLY_TIMES_FILE):
+    """店舗ごとの集計時間を記録する（待機上限の調整用）
+
+    data/tally_times.jsonl に1行1件のJSONで追記する。
+
+    Args:
+        store_id: 店舗ID（4桁、不明な場合None）
+        operation: 業務名（daily_inventory / auto_order）
+        elapsed: 印刷ボタンが現れるまでの時間（秒）
+        found: 印刷ボタンが見つかった場合True
+        tally_file: 記録先ファイル
+    """
+    record = {
+        'store_id': store_id,
+        'operation': operation,
+        'elapsed': round(elapsed, 3),
+        'found': found,
+        'recorded_at': datetime.now().isoformat()
+    }
+    try:
+        os.makedirs(os.path.dirname(tally_file), exist_ok=True)
+        with _tally_lock:
+            with open(tally_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except Exception as e:
+        print(f"集計時間の記録エラー: {e}")
+
+
 def safe_wait(seconds, description=None, logger=None):
     """指定時間待機する（通常用）
 
@@ -217,8 +577,8 @@ def wait_for_page_load(driver, wait, max_retries=3, retry_delay=5):
             # document.readyStateが'complete'になるまで待機
             wait.until(lambda d: d.execute_script('return document.readyState') == 'complete')
 
-            # さらに少し待機（JavaScriptの実行完了を待つ）
-            time.sleep(2)
+            # リソース取得が落ち着くまで待機（JavaScriptの実行完了を待つ、最大2秒）
+            wait_until(driver, timeout=2, description="ページ読み込み後の待機", until=network_idle())
 
             print(f"✓ ページ読み込み完了（試行 {attempt + 1}/{max_retries}）")
             return True
@@ -274,8 +634,8 @@ def wait_for_shipping_screen(driver, logger=None, timeout=15):
         if logger:
             logger.debug("ページの基本読み込みが完了しました")
 
-        # 追加で3秒待機（JavaScriptやフレームの読み込み完了を待つ）
-        time.sleep(3)
+        # JavaScriptやフレームの読み込み完了を待つ（最大3秒）
+        wait_until(driver, timeout=3, description="出庫画面の読み込み待機", logger=logger, until=network_idle())
 
         # 出庫画面の特徴的な要素が存在するか確認
         # （btnRecalcやbtnSyukoが存在するか、またはフレーム内に存在するか）
@@ -284,42 +644,28 @@ def wait_for_shipping_screen(driver, logger=None, timeout=15):
             driver.switch_to.default_content()
 
             # ページ内に btnRecalc または btnSyuko が存在するか確認
-            # （フレーム内にある可能性もあるので、存在確認のみ）
-            wait_short = WebDriverWait(driver, 3)
+            # （フレーム内外を1回のスクリプト実行でまとめて走査、存在確認のみ）
+            shipping_xpaths = ["//*[@id='btnRecalc']", "//*[@id='btnSyuko']"]
+            found = {}
 
-            # まずフレーム外を確認
-            try:
-                wait_short.until(
-                    lambda d: len(d.find_elements(By.ID, "btnRecalc")) > 0 or
-                             len(d.find_elements(By.ID, "btnSyuko")) > 0
-                )
+            def shipping_buttons_found(d):
+                found.update(scan_frames(d, shipping_xpaths, main_first=True))
+                return any(path is not None for path in found.values())
+
+            if wait_until(driver, shipping_buttons_found, 3, "出庫画面ボタン検出", logger, "frame_scan"):
+                path = next(path for path in found.values() if path is not None)
                 if logger:
-                    logger.info("✓ 出庫画面への遷移を確認しました（フレーム外にボタンを検出）")
+                    if path == ():
+                        logger.info("✓ 出庫画面への遷移を確認しました（フレーム外にボタンを検出）")
+                    else:
+                        logger.info(f"✓ 出庫画面への遷移を確認しました（フレーム{list(path)}内にボタンを検出）")
+                driver.switch_to.default_content()
                 return True
-            except:
-                # フレーム外に見つからない場合、フレーム内を確認
-                iframes = driver.find_elements(By.TAG_NAME, "iframe")
-                if logger:
-                    logger.debug(f"フレーム数: {len(iframes)}")
-
-                for i, iframe in enumerate(iframes):
-                    try:
-                        driver.switch_to.frame(iframe)
-                        if len(driver.find_elements(By.ID, "btnRecalc")) > 0 or \
-                           len(driver.find_elements(By.ID, "btnSyuko")) > 0:
-                            if logger:
-                                logger.info(f"✓ 出庫画面への遷移を確認しました（フレーム{i}内にボタンを検出）")
-                            driver.switch_to.default_content()
-                            return True
-                        driver.switch_to.default_content()
-                    except:
-                        driver.switch_to.default_content()
-                        continue
 
-                # どのフレームにも見つからなかった場合は失敗
-                if logger:
-                    logger.error("⚠️ 出庫画面のボタンが見つかりません")
-                return False
+            # どのフレームにも見つからなかった場合は失敗
+            if logger:
+                logger.error("⚠️ 出庫画面のボタンが見つかりません")
+            return False
 
         except Exception as e:
             if logger:
@@ -372,15 +718,155 @@ def go_back_to_main(driver, wait, max_attempts=3):
     return False
 
 
-def switch_to_frame_with_element(driver, xpath, timeout=10):
-    """指定された要素を含むフレームに切り替える"""
+# ===========================
+# フレーム位置キャッシュ
+# ===========================
+# セッションごとに {(ページURLパターン, XPath): フレーム経路} を保持する。
+# フレーム経路は frame/iframe 要素の番号のタプル（() はメインコンテンツ）。
+_frame_caches = {}
+_frame_caches_lock = threading.Lock()
+
+
+def get_url_pattern(url):
+    """URLからクエリ文字列を除いたパターンを取得（例: .../HomeMain.aspx）"""
+    return url.split('?', 1)[0].split('#', 1)[0]
+
+
+def get_frame_cache(driver):
+    """セッションのフレーム位置キャッシュを取得（なければ作成）"""
+    with _frame_caches_lock:
+        return _frame_caches.setdefault(driver.session_id, {
+            'url_pattern': None,
+            'entries': {},
+            'hits': 0,
+            'misses': 0
+        })
+
+
+def clear_frame_cache(driver):
+    """セッションのフレーム位置キャッシュを破棄（ブラウザ終了時など）"""
+    with _frame_caches_lock:
+        _frame_caches.pop(driver.session_id, None)
+
+
+def get_frames(driver):
+    """現在のコンテキストにある frame/iframe 要素の一覧を取得（文書順 = window.frames の順）"""
+    return driver.find_elements(By.XPATH, "//frame | //iframe")
+
+
+# 全フレームを再帰的に走査し、XPathごとに最初に見つかったフレーム経路を返すスクリプト
+# （別オリジンのフレームは参照できないためスキップする）
+FRAME_SCAN_SCRIPT = """
+var xpaths = arguments[0];
+var mainFirst = arguments[1];
+var result = [];
+for (var k = 0; k < xpaths.length; k++) { result.push(null); }
+
+function check(win, path) {
+    var doc;
+    try { doc = win.document; } catch (e) { return; }
+    if (!doc) { return; }
+    for (var k = 0; k < xpaths.length; k++) {
+        if (result[k] !== null) { continue; }
+        try {
+            var node = doc.evaluate(xpaths[k], doc, null,
+                XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+            if (node) { result[k] = path; }
+        } catch (e) {}
+    }
+}
+
+function walk(win, path) {
+    var count;
+    try { count = win.frames.length; } catch (e) { return; }
+    for (var i = 0; i < count; i++) {
+        var child = win.frames[i];
+        var childPath = path.concat([i]);
+        check(child, childPath);
+        walk(child, childPath);
+    }
+}
+
+if (mainFirst) { check(window, []); }
+walk(window, []);
+if (!mainFirst) { check(window, []); }
+return result;
+"""
+
+
+def scan_frames(driver, xpaths, main_first=False):
+    """1回のexecute_scriptで全フレームを走査し、XPathごとのフレーム経路を取得する
+
+    Args:
+        driver: Seleniumドライバー
+        xpaths: 検索するXPathのリスト
+        main_first: メインコンテンツを先に確認する場合True（既定はフレーム内を優先）
+
+    Returns:
+        dict: {XPath: フレーム経路（見つからない場合None）}
+    """
+    xpaths = list(xpaths)
+    driver.switch_to.default_content()
+    paths = driver.execute_script(FRAME_SCAN_SCRIPT, xpaths, main_first)
+    return {xpath: (tuple(path) if path is not None else None) for xpath, path in zip(xpaths, paths)}
+
+
+def find_first_element(driver, xpaths, main_first=True):
+    """XPathの候補を全フレームから検索し、最初に見つかった要素のフレームに切り替える
+
+    メインコンテンツのヒットを優先し、次にXPathの順序で選ぶ。
+
+    Returns:
+        tuple: (要素, フレーム経路, XPath)。見つからない場合 (None, None, None)
+    """
+    hits = scan_frames(driver, xpaths, main_first)
+    candidates = [(xpath, path) for xpath, path in hits.items() if path is not None]
+    if main_first:
+        candidates.sort(key=lambda c: 0 if c[1] == () else 1)
+
+    for xpath, path in candidates:
+        if switch_to_frame_path(driver, path):
+            elements = driver.find_elements(By.XPATH, xpath)
+            if elements:
+                return elements[0], path, xpath
+
+    driver.switch_to.default_content()
+    return None, None, None
+
+
+def switch_to_frame_path(driver, path):
+    """フレーム経路に従ってフレームを切り替える
+
+    Args:
+        driver: Seleniumドライバー
+        path: window.frames の番号のタプル（() はメインコンテンツ）
+
+    Returns:
+        bool: 切り替えに成功した場合True
+    """
+    driver.switch_to.default_content()
+    try:
+        for index in path:
+            driver.switch_to.frame(index)
+        return True
+    except Exception:
+        driver.switch_to.default_content()
+        return False
+
+
+def find_frame_path_by_walk(driver, xpath):
+    """フレームを1つずつ切り替えて要素を検索する（スクリプト走査が使えない場合の代替）
+
+    Returns:
+        tuple: 見つかったフレームの経路。見つからない場合None
+    """
     # まずメインフレームに戻る
     driver.switch_to.default_content()
 
     # 全フレームを検索
-    frames = driver.find_elements(By.TAG_NAME, "frame") + driver.find_elements(By.TAG_NAME, "iframe")
+    frames = get_frames(driver)
 
-    for frame in frames:
+    for i, frame in enumerate(frames):
         try:
             driver.switch_to.default_content()
             driver.switch_to.frame(frame)
@@ -389,17 +875,17 @@ def switch_to_frame_with_element(driver, xpath, timeout=10):
             elements = driver.find_elements(By.XPATH, xpath)
             if elements and len(elements) > 0:
                 print(f"要素が見つかりました: フレーム内")
-                return True
+                return (i,)
 
             # ネストされたフレームもチェック
-            nested_frames = driver.find_elements(By.TAG_NAME, "frame") + driver.find_elements(By.TAG_NAME, "iframe")
-            for nested_frame in nested_frames:
+            nested_frames = get_frames(driver)
+            for j, nested_frame in enumerate(nested_frames):
                 try:
                     driver.switch_to.frame(nested_frame)
                     elements = driver.find_elements(By.XPATH, xpath)
                     if elements and len(elements) > 0:
                         print(f"要素が見つかりました: ネストされたフレーム内")
-                        return True
+                        return (i, j)
                     driver.switch_to.parent_frame()
                 except:
                     driver.switch_to.parent_frame()
@@ -411,21 +897,239 @@ def switch_to_frame_with_element(driver, xpath, timeout=10):
     elements = driver.find_elements(By.XPATH, xpath)
     if elements and len(elements) > 0:
         print(f"要素が見つかりました: メインコンテンツ")
-        return True
+        return ()
+
+    return None
+
+
+def find_frame_path(driver, xpath):
+    """全フレーム（ネストされたフレームを含む）を検索し、要素を含むフレームに切り替える
+
+    Returns:
+        tuple: 見つかったフレームの経路。見つからない場合None
+    """
+    try:
+        path = scan_frames(driver, [xpath])[xpath]
+    except Exception:
+        return find_frame_path_by_walk(driver, xpath)
+
+    if path is None:
+        driver.switch_to.default_content()
+        return None
+
+    if not switch_to_frame_path(driver, path):
+        return find_frame_path_by_walk(driver, xpath)
+
+    print(f"要素が見つかりました: {'メインコンテンツ' if path == () else 'フレーム内'}")
+    return path
+
+
+@traced("フレーム検索", "frame")
+def switch_to_frame_with_element(driver, xpath, timeout=10):
+    """指定された要素を含むフレームに切り替える
+
+    前回要素が見つかったフレームをキャッシュから先に確認し、
+    見つからない場合のみ全フレームを検索する。
+    """
+    cache = get_frame_cache(driver)
+
+    # ページURLが変わっていればキャッシュを破棄
+    driver.switch_to.default_content()
+    url_pattern = get_url_pattern(driver.current_url)
+    if url_pattern != cache['url_pattern']:
+        cache['entries'].clear()
+        cache['url_pattern'] = url_pattern
+
+    key = (url_pattern, xpath)
+    cached_path = cache['entries'].get(key)
+    if cached_path is not None:
+        if switch_to_frame_path(driver, cached_path) and driver.find_elements(By.XPATH, xpath):
+            cache['hits'] += 1
+            return True
+        # 画面が変わっていた場合はエントリを破棄して全検索
+        del cache['entries'][key]
+
+    cache['misses'] += 1
+    path = find_frame_path(driver, xpath)
+    if path is None:
+        return False
+
+    cache['entries'][key] = path
+    return True
+
+
+# 印刷後のページに出力される window.open("...") からURLを取得するスクリプト
+# （Medicomはポストバックの応答に window.open のスクリプトを埋め込んで別ウィンドウを開く）
+POPUP_URL_SCRIPT = """
+var urls = [];
+var re = /window\\.open\\(\\s*["']([^"']+)["']/g;
+var html = document.documentElement ? document.documentElement.outerHTML : "";
+var m;
+while ((m = re.exec(html)) !== null) {
+    try { urls.push(new URL(m[1], document.baseURI).href); } catch (e) {}
+}
+return urls;
+"""
+
+# 現在のフレームの経路（window.frames の番号）を取得するスクリプト
+CURRENT_FRAME_PATH_SCRIPT = """
+var path = [];
+var win = window;
+while (win !== win.parent) {
+    var parent = win.parent;
+    var index = -1;
+    for (var i = 0; i < parent.frames.length; i++) {
+        if (parent.frames[i] === win) { index = i; break; }
+    }
+    if (index < 0) { return null; }
+    path.unshift(index);
+    win = parent;
+}
+return path;
+"""
+
+# 印刷・PDFのURLとみなすパターン（ページ内の他の window.open と区別する）
+PRINT_URL_PATTERN = re.compile(r"\.pdf\b|/pdf/|print|insatsu|report", re.IGNORECASE)
+
+
+def is_print_url(url):
+    """印刷・PDFのURLかどうか"""
+    return bool(url) and url.startswith("http") and PRINT_URL_PATTERN.search(url) is not None
+
+
+def get_current_frame_path(driver):
+    """現在のフレームの経路を取得する
+
+    Returns:
+        tuple: window.frames の番号のタプル（取得できない場合はNone）
+    """
+    try:
+        path = driver.execute_script(CURRENT_FRAME_PATH_SCRIPT)
+    except Exception:
+        return None
+    return tuple(path) if path is not None else None
 
-    return False
 
+def find_print_url(driver, windows_before):
+    """印刷ボタンで開かれたPDFのURLを探す
 
-def daily_inventory(driver, download_path, should_print=True):
+    1. 現在のフレームに埋め込まれた window.open のURL
+    2. 印刷後に新しく開いたウィンドウのURL
+
+    どちらも印刷・PDFのURL（PRINT_URL_PATTERN）に一致するものだけを使う。
+    ウィンドウを確認した後は、元のウィンドウとフレームに戻る。
+
+    Args:
+        driver: Seleniumドライバー
+        windows_before: 印刷ボタンをクリックする前のウィンドウハンドル
+
+    Returns:
+        str: PDFのURL。見つからない場合None
+    """
+    urls = [url for url in driver.execute_script(POPUP_URL_SCRIPT) or [] if is_print_url(url)]
+    if urls:
+        return urls[-1]
+
+    new_windows = [w for w in driver.window_handles if w not in windows_before]
+    if not new_windows:
+        return None
+
+    current_window = driver.current_window_handle
+    frame_path = get_current_frame_path(driver)
+    try:
+        for window in new_windows:
+            try:
+                driver.switch_to.window(window)
+                url = driver.current_url
+            except Exception:
+                continue  # 既に閉じられたウィンドウ
+            if is_print_url(url):
+                return url
+    finally:
+        # switch_to.window はトップのドキュメントに戻るため、フレームも元に戻す
+        driver.switch_to.window(current_window)
+        if frame_path:
+            switch_to_frame_path(driver, frame_path)
+    return None
+
+
+def start_pdf_capture(driver, download_path):
+    """印刷ボタンをクリックする直前に呼ぶ（終了時は例外の場合も finish_pdf_capture() を呼ぶ）
+
+    ダウンロードフォルダの監視を開始する。直接取得モードでも、印刷URLが見つからない場合は
+    このフォルダからPDFを取得するため、ブラウザのダウンロードは止めない。
+
+    Returns:
+        dict: ダウンロードフォルダの監視情報
+    """
+    return watch_downloads(download_path)
+
+
+def finish_pdf_capture(driver, download_path, download_watcher):
+    """ダウンロードフォルダの監視を終了し、obtain_pdf() で止めたブラウザのダウンロードを元に戻す"""
+    if download_watcher:
+        stop_watching_downloads(download_watcher)
+    if pdf_download_mode == "direct":
+        set_downloads_enabled(driver, download_path, True)
+
+
+@traced("PDF取得", "download")
+def obtain_pdf(driver, download_path, store_id, operation, windows_before, download_watcher, logger=None):
+    """印刷ボタンで出力されたPDFを取得する
+
+    直接取得モードでは、印刷URLが見つかった時点でブラウザのダウンロードを止め
+    （同じPDFを二重に保存しないため）、URLをHTTPで取得して店舗・業務ごとのファイル名で保存する。
+    印刷URLが見つからない場合や取得に失敗した場合は、ダウンロードを許可したまま（または戻して）
+    クリック前から監視しているダウンロードフォルダに新しいPDFが完成するのを待って取得する。
+
+    Returns:
+        str: PDFのパス。失敗時None
+    """
+    if pdf_download_mode == "direct":
+        found = {}
+
+        def print_url_found(d):
+            found['url'] = find_print_url(d, windows_before)
+            return found['url'] is not None
+
+        if wait_until(driver, print_url_found, 10, "印刷URL検出", logger, "print_url"):
+            set_downloads_enabled(driver, download_path, False)
+            pdf_path = fetch_pdf(driver, found['url'], build_pdf_path(download_path, store_id, operation))
+            if pdf_path:
+                if logger:
+                    logger.info(f"✓ PDFを直接取得しました: {pdf_path}")
+                stop_watching_downloads(download_watcher)
+                return pdf_path
+
+            if logger:
+                logger.warning("PDFの直接取得ができませんでした。ブラウザでダウンロードします")
+            set_downloads_enabled(driver, download_path, True)
+            # 止めている間にブラウザのダウンロードが取り消された場合に備えて開き直す
+            driver.execute_script("window.open(arguments[0], '_blank');", found['url'])
+        elif logger:
+            logger.warning("印刷URLが見つかりませんでした。ダウンロードフォルダから取得します")
+
+    return download_pdf(driver, download_path, download_watcher)
+
+
+def is_medicom_window(info):
+    """Medicomの画面のウィンドウかどうか（ウィンドウ整理で残す）"""
+    return "medicom" in info['url'].lower() or "Medicom" in info['title']
+
+
+@traced("daily_inventory", "operation")
+@report_commands("daily_inventory")
+def daily_inventory(driver, download_path, should_print=True, store_id=None):
     """毎日在庫処理（月次処理→棚卸タブ→印刷）
 
     Args:
         driver: Seleniumドライバー
         download_path: PDFダウンロードパス
         should_print: PDFを印刷するかどうか（デフォルト: True）
+        store_id: 店舗ID（集計時間の記録用）
     """
     # ログ設定
-    operation_logger, log_file_path = setup_logger()
+    operation_logger, log_file_path = setup_logger("daily_inventory", store_id)
     operation_logger.info(f"ログファイル: {log_file_path}")
     operation_logger.info("============================================================")
     operation_logger.info("毎日在庫処理を開始します")
@@ -433,6 +1137,8 @@ def daily_inventory(driver, download_path, should_print=True):
 
     try:
         wait = WebDriverWait(driver, 10)
+        # ウィンドウ整理で残すメインウィンドウ（ログイン時に記録済みの場合はそれを使う）
+        ensure_main_window(driver)
 
         # ステップ1: 月次処理ボタンをクリック
         print("月次処理ボタンを探しています...")
@@ -449,7 +1155,7 @@ def daily_inventory(driver, download_path, should_print=True):
         # ページが完全に読み込まれるまで待機
         if not wait_for_page_load(driver, wait):
             print("⚠️ ページ読み込みに時間がかかっています。続行しますか？")
-            input("Enterキーを押して続行...")
+            wait_for_user("Enterキーを押して続行...")
 
         # ステップ2: 棚卸タブをクリック
         operation_logger.info("棚卸タブを探しています...")
@@ -598,57 +1304,38 @@ def daily_inventory(driver, download_path, should_print=True):
         if not checkbox_success:
             operation_logger.warning("チェックボックス操作に失敗しました")
 
-        # ステップ5: 印刷ボタンをクリック（集計完了を待つため、3段階で待機してリトライ）
+        # ステップ5: 印刷ボタンをクリック（集計完了を待つため、印刷ボタンが現れるまでポーリング）
         operation_logger.info("棚卸集計の完了を待機しています...")
         print("棚卸集計の完了を待機しています...")
 
-        print_button_found = False
-
-        # 第1回試行: 5秒待機
-        operation_logger.info("[第1回] 5秒待機してから印刷ボタンを探します...")
-        print("[第1回] 5秒待機してから印刷ボタンを探します...")
-        safe_wait(5, "第1回印刷ボタン待機", operation_logger)
+        # 印刷ボタンが現れるまで短い間隔で確認（間隔は徐々に延ばし、最大 PRINT_BUTTON_DEADLINE 秒）
+        print_button_found, tally_elapsed = poll_until(
+            lambda: switch_to_frame_with_element(driver, PRINT_BUTTON_XPATH),
+            PRINT_BUTTON_DEADLINE,
+            description="印刷ボタン待機（集計処理）",
+            logger=operation_logger
+        )
+        record_tally_time(store_id, "daily_inventory", tally_elapsed, print_button_found)
 
-        if switch_to_frame_with_element(driver, "//input[@value='印刷'] | //input[@type='button' and contains(@onclick, '印刷')] | //a[contains(text(), '印刷')]"):
-            print_button_found = True
-            operation_logger.info("✓ 印刷ボタンが見つかりました")
-            print("✓ 印刷ボタンが見つかりました")
+        if print_button_found:
+            operation_logger.info(f"✓ 印刷ボタンが見つかりました（集計時間: {tally_elapsed:.1f}秒）")
+            print(f"✓ 印刷ボタンが見つかりました（集計時間: {tally_elapsed:.1f}秒）")
         else:
-            # 第2回試行: 30秒待機（集計処理中）
-            operation_logger.warning("⚠️ 印刷ボタンが見つかりませんでした。")
-            operation_logger.info("[第2回] 30秒待機してから再度探します...")
-            print("⚠️ 印刷ボタンが見つかりませんでした。")
-            print("[第2回] 30秒待機してから再度探します...")
-            safe_wait_heavy(30, "第2回印刷ボタン待機（集計処理中）", operation_logger)
-
-            if switch_to_frame_with_element(driver, "//input[@value='印刷'] | //input[@type='button' and contains(@onclick, '印刷')] | //a[contains(text(), '印刷')]"):
-                print_button_found = True
-                operation_logger.info("✓ 印刷ボタンが見つかりました")
-                print("✓ 印刷ボタンが見つかりました")
-            else:
-                # 第3回試行: 300秒(5分)待機（重い集計処理）
-                operation_logger.warning("⚠️ 印刷ボタンが見つかりませんでした。集計に時間がかかっている可能性があります。")
-                operation_logger.info("[第3回] 300秒(5分)待機してから再度探します...")
-                print("⚠️ 集計に時間がかかっている可能性があります。")
-                print("[第3回] 300秒(5分)待機してから再度探します...")
-                safe_wait_heavy(300, "第3回印刷ボタン待機（重い集計処理）", operation_logger)
-
-                if switch_to_frame_with_element(driver, "//input[@value='印刷'] | //input[@type='button' and contains(@onclick, '印刷')] | //a[contains(text(), '印刷')]"):
-                    print_button_found = True
-                    operation_logger.info("✓ 印刷ボタンが見つかりました")
-                    print("✓ 印刷ボタンが見つかりました")
-                else:
-                    operation_logger.error("⚠️ 5分待機後も印刷ボタンが見つかりませんでした")
-                    print("⚠️ 5分待機後も印刷ボタンが見つかりませんでした")
-                    return False
+            operation_logger.error(f"⚠️ {PRINT_BUTTON_DEADLINE}秒待機後も印刷ボタンが見つかりませんでした")
+            print(f"⚠️ {PRINT_BUTTON_DEADLINE}秒待機後も印刷ボタンが見つかりませんでした")
+            return False
 
+        windows_before = None
+        download_watcher = None
         if print_button_found:
             try:
                 print_button = wait.until(
-                    EC.element_to_be_clickable((By.XPATH, "//input[@value='印刷'] | //input[@type='button' and contains(@onclick, '印刷')] | //a[contains(text(), '印刷')]"))
+                    EC.element_to_be_clickable((By.XPATH, PRINT_BUTTON_XPATH))
                 )
                 operation_logger.info("✓ 印刷ボタンをクリックします...")
                 print("✓ 印刷ボタンをクリックします...")
+                windows_before = driver.window_handles
+                download_watcher = start_pdf_capture(driver, download_path)
                 print_button.click()
 
                 # 確認ダイアログ（JavaScript alert）が表示されるまで待機
@@ -656,6 +1343,7 @@ def daily_inventory(driver, download_path, should_print=True):
                 print("確認ダイアログの表示を待機しています...")
 
                 alert_handled = False
+                alert_span = start_span("確認ダイアログ（印刷）", "alert", driver)
                 for alert_attempt in range(3):  # 最大3回リトライ
                     try:
                         operation_logger.debug(f"確認ダイアログ検索試行 {alert_attempt + 1}/3")
@@ -679,94 +1367,56 @@ def daily_inventory(driver, download_path, should_print=True):
                             operation_logger.warning("確認ダイアログが見つかりませんでした")
                             print("⚠️ 確認ダイアログが見つかりません。")
 
+                end_span(alert_span, "ok" if alert_handled else "failed")
                 if not alert_handled:
                     operation_logger.warning("確認ダイアログの処理に失敗しました")
 
                 # PDFダウンロード・印刷処理
-                time.sleep(3)
-                if download_pdf(driver, download_path):
+                pdf_path = obtain_pdf(driver, download_path, store_id, "daily_inventory", windows_before, download_watcher, operation_logger)
+                if pdf_path:
                     if should_print:
-                        print_pdf(download_path)
-                    print("✓ PDFダウンロード・印刷が完了しました")
+                        # 印刷はバックグラウンドで行い、ブラウザ操作はそのまま続行
+                        job_id = enqueue_print(pdf_path, f"daily_inventory {store_id}")
+                        operation_logger.info(f"印刷キューに登録しました（ジョブ {job_id}）: {pdf_path}")
+                        print("✓ PDFダウンロードが完了しました（印刷キューに登録）")
+                    else:
+                        print("✓ PDFダウンロードが完了しました")
                 else:
                     print("⚠️ PDFのダウンロードに失敗しました")
 
             except Exception as e:
                 print(f"印刷ボタンクリックエラー: {e}")
+            finally:
+                if windows_before is not None:
+                    finish_pdf_capture(driver, download_path, download_watcher)
 
-        # ウィンドウ整理：about:blank や印刷ページを閉じる
+        # ウィンドウ整理：印刷で開いたウィンドウ（about:blank や印刷ページ）を閉じる
+        window_span = start_span("ウィンドウ整理", "window", driver)
         try:
             operation_logger.info("ウィンドウ状態を確認しています...")
             print("ウィンドウ状態を確認しています...")
-            time.sleep(3)  # ウィンドウが開くまで待機
-
-            initial_windows = driver.window_handles
-            operation_logger.info(f"初期ウィンドウ数: {len(initial_windows)}")
-            print(f"現在のウィンドウ数: {len(initial_windows)}")
-
-            # 全ウィンドウの詳細情報を収集
-            window_info = []
-            for i, window in enumerate(initial_windows, 1):
-                try:
-                    driver.switch_to.window(window)
-                    url = driver.current_url
-                    title = driver.title
-                    info = {
-                        'handle': window,
-                        'index': i,
-                        'url': url,
-                        'title': title,
-                        'is_medicom': "medicom" in url.lower() or "Medicom" in title
-                    }
-                    window_info.append(info)
-                    operation_logger.info(f"ウィンドウ {i}: URL={url[:80]}, タイトル={title[:50]}, Medicom={info['is_medicom']}")
-                    print(f"  ウィンドウ {i}: {'[Medicom]' if info['is_medicom'] else '[その他]'} {url[:50]}")
-                except Exception as e:
-                    operation_logger.debug(f"ウィンドウ {i} アクセスエラー: {e}")
-                    continue
-
-            # メインウィンドウ（Medicom）を特定
-            main_windows = [w for w in window_info if w['is_medicom']]
-            other_windows = [w for w in window_info if not w['is_medicom']]
-
-            operation_logger.info(f"Medicomウィンドウ: {len(main_windows)}個")
-            operation_logger.info(f"その他のウィンドウ: {len(other_windows)}個")
-
-            if main_windows:
-                main_window = main_windows[0]['handle']
-                operation_logger.info(f"メインウィンドウ: {main_windows[0]['url']}")
-            else:
-                main_window = None
-                operation_logger.warning("⚠️ Medicomウィンドウが見つかりません")
-
-            # Medicom以外の全ウィンドウを閉じる（about:blank、印刷ページなど）
-            closed_count = 0
-            for window in other_windows:
-                try:
-                    driver.switch_to.window(window['handle'])
-                    operation_logger.info(f"余分なウィンドウを閉じます: {window['url'][:80]}")
-                    driver.close()
-                    closed_count += 1
-                    print(f"✓ ウィンドウを閉じました: {window['url'][:50]}")
-                except Exception as e:
-                    operation_logger.debug(f"ウィンドウクローズエラー（既に閉じられている）: {e}")
-
-            # メインウィンドウに戻る
-            if main_window:
-                driver.switch_to.window(main_window)
-                operation_logger.info("✓ メインウィンドウに戻りました")
-
-            final_count = len(driver.window_handles)
+            if windows_before is not None:
+                # 印刷ボタンで開いたウィンドウを記録（まだ開いていない場合は最大3秒待機）
+                wait_until(driver, lambda d: len(d.window_handles) > len(windows_before), 3,
+                           "印刷ウィンドウ", operation_logger, "new_window_opened")
+                popups = track_new_windows(driver, windows_before, "印刷", "daily_inventory")
+                operation_logger.info(f"印刷で開いたウィンドウ: {len(popups)}個")
+
+            # 印刷で開いたウィンドウはURL・タイトルを調べずに閉じ、
+            # それ以外のウィンドウはMedicomの画面でないものだけを閉じる
+            printed_count, _ = close_popups(driver, purposes=["印刷"], logger=operation_logger)
+            other_count, final_count = close_popups(driver, logger=operation_logger, keep_if=is_medicom_window)
+            closed_count = printed_count + other_count
             operation_logger.info(f"✓ ウィンドウ整理完了。{closed_count}個のウィンドウを閉じました。残り: {final_count}個")
             print(f"✓ ウィンドウ整理完了（{closed_count}個のウィンドウを閉じました）")
+            end_span(window_span)
         except Exception as e:
+            end_span(window_span, "error", e)
             operation_logger.warning(f"ウィンドウ整理エラー: {e}")
             print(f"⚠️ ウィンドウ整理でエラーが発生しましたが、処理を継続します")
             # エラーが発生してもメインウィンドウには戻る
             try:
-                remaining = driver.window_handles
-                if remaining:
-                    driver.switch_to.window(remaining[0])
+                switch_to_main_window(driver)
             except:
                 pass
 
@@ -774,7 +1424,7 @@ def daily_inventory(driver, download_path, should_print=True):
         print("メインメニューに戻ります...")
         if not go_back_to_main(driver, wait):
             print("⚠️ 自動で戻れませんでした。手動で戻ってください。")
-            input("メインメニューに戻ったらEnterキーを押してください...")
+            wait_for_user("メインメニューに戻ったらEnterキーを押してください...")
 
         operation_logger.info("毎日在庫処理が正常に完了しました")
         operation_logger.info(f"ログファイル: {log_file_path}")
@@ -793,16 +1443,19 @@ def daily_inventory(driver, download_path, should_print=True):
             pass
 
 
-def auto_order(driver, download_path, should_print=True):
+@traced("auto_order", "operation")
+@report_commands("auto_order")
+def auto_order(driver, download_path, should_print=True, store_id=None):
     """自動発注処理（発注ボタン→発注表示ボタン→印刷→発注実行）
 
     Args:
         driver: Seleniumドライバー
         download_path: PDFダウンロードパス
         should_print: PDFを印刷するかどうか（デフォルト: True）
+        store_id: 店舗ID（集計時間の記録用）
     """
     # ログ設定
-    operation_logger, log_file_path = setup_logger()
+    operation_logger, log_file_path = setup_logger("auto_order", store_id)
     operation_logger.info(f"ログファイル: {log_file_path}")
     operation_logger.info("============================================================")
     operation_logger.info("自動発注処理を開始します")
@@ -810,6 +1463,8 @@ def auto_order(driver, download_path, should_print=True):
 
     try:
         wait = WebDriverWait(driver, 10)
+        # ウィンドウ整理で残すメインウィンドウ（ログイン時に記録済みの場合はそれを使う）
+        ensure_main_window(driver)
 
         # ステップ1: 発注ボタンをクリック
         operation_logger.info("発注ボタンを探しています...")
@@ -830,7 +1485,7 @@ def auto_order(driver, download_path, should_print=True):
         if not wait_for_page_load(driver, wait):
             operation_logger.warning("⚠️ ページ読み込みに時間がかかっています")
             print("⚠️ ページ読み込みに時間がかかっています。続行しますか？")
-            input("Enterキーを押して続行...")
+            wait_for_user("Enterキーを押して続行...")
 
         # ステップ2: 発注表示ボタンをクリック
         operation_logger.info("発注表示ボタンを探しています...")
@@ -839,7 +1494,7 @@ def auto_order(driver, download_path, should_print=True):
             operation_logger.warning("⚠️ 発注表示ボタンが見つかりません")
             print("⚠️ 発注表示ボタンが見つかりません。手動で発注表示ボタンをクリックしてください。")
             print("準備ができたらEnterキーを押してください...")
-            input()
+            wait_for_user()
 
             # 再度発注表示ボタンを探す
             if not switch_to_frame_with_element(driver, "//input[@value='発注表示'] | //input[@type='button' and contains(@value, '発注表示')] | //*[contains(text(), '発注表示')]"):
@@ -868,65 +1523,46 @@ def auto_order(driver, download_path, should_print=True):
                 if not wait_for_page_load(driver, wait):
                     operation_logger.warning("⚠️ ページ読み込みに時間がかかっています")
                     print("⚠️ ページ読み込みに時間がかかっています。続行しますか？")
-                    input("Enterキーを押して続行...")
+                    wait_for_user("Enterキーを押して続行...")
             except Exception as e:
                 operation_logger.error(f"発注表示ボタンクリックエラー: {e}")
                 print(f"発注表示ボタンクリックエラー: {e}")
                 print("手動で発注表示ボタンをクリックしてください。")
-                input("準備ができたらEnterキーを押してください...")
+                wait_for_user("準備ができたらEnterキーを押してください...")
 
         # ステップ3: 印刷ボタンをクリック（発注前にリストを印刷）
-        # 集計完了を待つため、3段階で待機してリトライ
+        # 集計完了を待つため、印刷ボタンが現れるまでポーリング
         operation_logger.info("発注集計の完了を待機しています...")
         print("発注集計の完了を待機しています...")
 
-        print_button_found = False
-
-        # 第1回試行: 5秒待機
-        operation_logger.info("[第1回] 5秒待機してから印刷ボタンを探します...")
-        print("[第1回] 5秒待機してから印刷ボタンを探します...")
-        safe_wait(5, "第1回印刷ボタン待機", operation_logger)
+        # 印刷ボタンが現れるまで短い間隔で確認（間隔は徐々に延ばし、最大 PRINT_BUTTON_DEADLINE 秒）
+        print_button_found, tally_elapsed = poll_until(
+            lambda: switch_to_frame_with_element(driver, PRINT_BUTTON_XPATH),
+            PRINT_BUTTON_DEADLINE,
+            description="印刷ボタン待機（集計処理）",
+            logger=operation_logger
+        )
+        record_tally_time(store_id, "auto_order", tally_elapsed, print_button_found)
 
-        if switch_to_frame_with_element(driver, "//input[@value='印刷'] | //input[@type='button' and contains(@onclick, '印刷')] | //a[contains(text(), '印刷')]"):
-            print_button_found = True
-            operation_logger.info("✓ 印刷ボタンが見つかりました")
-            print("✓ 印刷ボタンが見つかりました")
+        if print_button_found:
+            operation_logger.info(f"✓ 印刷ボタンが見つかりました（集計時間: {tally_elapsed:.1f}秒）")
+            print(f"✓ 印刷ボタンが見つかりました（集計時間: {tally_elapsed:.1f}秒）")
         else:
-            # 第2回試行: 30秒待機（集計処理中）
-            operation_logger.warning("⚠️ 印刷ボタンが見つかりませんでした。")
-            operation_logger.info("[第2回] 30秒待機してから再度探します...")
-            print("⚠️ 印刷ボタンが見つかりませんでした。")
-            print("[第2回] 30秒待機してから再度探します...")
-            safe_wait_heavy(30, "第2回印刷ボタン待機（集計処理中）", operation_logger)
-
-            if switch_to_frame_with_element(driver, "//input[@value='印刷'] | //input[@type='button' and contains(@onclick, '印刷')] | //a[contains(text(), '印刷')]"):
-                print_button_found = True
-                operation_logger.info("✓ 印刷ボタンが見つかりました")
-                print("✓ 印刷ボタンが見つかりました")
-            else:
-                # 第3回試行: 300秒(5分)待機（重い集計処理）
-                operation_logger.warning("⚠️ 印刷ボタンが見つかりませんでした。集計に時間がかかっている可能性があります。")
-                operation_logger.info("[第3回] 300秒(5分)待機してから再度探します...")
-                print("⚠️ 集計に時間がかかっている可能性があります。")
-                print("[第3回] 300秒(5分)待機してから再度探します...")
-                safe_wait_heavy(300, "第3回印刷ボタン待機（重い集計処理）", operation_logger)
-
-                if switch_to_frame_with_element(driver, "//input[@value='印刷'] | //input[@type='button' and contains(@onclick, '印刷')] | //a[contains(text(), '印刷')]"):
-                    print_button_found = True
-                    operation_logger.info("✓ 印刷ボタンが見つかりました")
-                    print("✓ 印刷ボタンが見つかりました")
-                else:
-                    operation_logger.error("⚠️ 5分待機後も印刷ボタンが見つかりませんでした")
-                    print("⚠️ 5分待機後も印刷ボタンが見つかりませんでした")
-                    return False
+            operation_logger.error(f"⚠️ {PRINT_BUTTON_DEADLINE}秒待機後も印刷ボタンが見つかりませんでした")
+            print(f"⚠️ {PRINT_BUTTON_DEADLINE}秒待機後も印刷ボタンが見つかりませんでした")
+            return False
 
+        windows_before = None
+        download_watcher = None
         if print_button_found:
             try:
                 print_button = wait.until(
-                    EC.element_to_be_clickable((By.XPATH, "//input[@value='印刷'] | //input[@type='button' and contains(@onclick, '印刷')] | //a[contains(text(), '印刷')]"))
+                    EC.element_to_be_clickable((By.XPATH, PRINT_BUTTON_XPATH))
                 )
                 operation_logger.info("✓ 印刷ボタンをクリックします...")
                 print("✓ 印刷ボタンをクリックします...")
+                windows_before = driver.window_handles
+                download_watcher = start_pdf_capture(driver, download_path)
                 print_button.click()
 
                 # 確認ダイアログ（JavaScript alert）が表示されるまで待機
@@ -934,6 +1570,7 @@ def auto_order(driver, download_path, should_print=True):
                 print("確認ダイアログの表示を待機しています...")
 
                 alert_handled = False
+                alert_span = start_span("確認ダイアログ（印刷）", "alert", driver)
                 for alert_attempt in range(3):  # 最大3回リトライ
                     try:
                         operation_logger.debug(f"確認ダイアログ検索試行 {alert_attempt + 1}/3")
@@ -957,94 +1594,56 @@ def auto_order(driver, download_path, should_print=True):
                             operation_logger.warning("確認ダイアログが見つかりませんでした")
                             print("⚠️ 確認ダイアログが見つかりません。")
 
+                end_span(alert_span, "ok" if alert_handled else "failed")
                 if not alert_handled:
                     operation_logger.warning("確認ダイアログの処理に失敗しました")
 
                 # PDFダウンロード・印刷処理
-                time.sleep(3)
-                if download_pdf(driver, download_path):
+                pdf_path = obtain_pdf(driver, download_path, store_id, "auto_order", windows_before, download_watcher, operation_logger)
+                if pdf_path:
                     if should_print:
-                        print_pdf(download_path)
-                    print("✓ PDFダウンロード・印刷が完了しました")
+                        # 印刷はバックグラウンドで行い、ブラウザ操作はそのまま続行
+                        job_id = enqueue_print(pdf_path, f"auto_order {store_id}")
+                        operation_logger.info(f"印刷キューに登録しました（ジョブ {job_id}）: {pdf_path}")
+                        print("✓ PDFダウンロードが完了しました（印刷キューに登録）")
+                    else:
+                        print("✓ PDFダウンロードが完了しました")
                 else:
                     print("⚠️ PDFのダウンロードに失敗しました")
 
             except Exception as e:
                 print(f"印刷ボタンクリックエラー: {e}")
+            finally:
+                if windows_before is not None:
+                    finish_pdf_capture(driver, download_path, download_watcher)
 
-        # ウィンドウ整理：about:blank や印刷ページを閉じる
+        # ウィンドウ整理：印刷で開いたウィンドウ（about:blank や印刷ページ）を閉じる
+        window_span = start_span("ウィンドウ整理", "window", driver)
         try:
             operation_logger.info("ウィンドウ状態を確認しています...")
             print("ウィンドウ状態を確認しています...")
-            time.sleep(3)  # ウィンドウが開くまで待機
-
-            initial_windows = driver.window_handles
-            operation_logger.info(f"初期ウィンドウ数: {len(initial_windows)}")
-            print(f"現在のウィンドウ数: {len(initial_windows)}")
-
-            # 全ウィンドウの詳細情報を収集
-            window_info = []
-            for i, window in enumerate(initial_windows, 1):
-                try:
-                    driver.switch_to.window(window)
-                    url = driver.current_url
-                    title = driver.title
-                    info = {
-                        'handle': window,
-                        'index': i,
-                        'url': url,
-                        'title': title,
-                        'is_medicom': "medicom" in url.lower() or "Medicom" in title
-                    }
-                    window_info.append(info)
-                    operation_logger.info(f"ウィンドウ {i}: URL={url[:80]}, タイトル={title[:50]}, Medicom={info['is_medicom']}")
-                    print(f"  ウィンドウ {i}: {'[Medicom]' if info['is_medicom'] else '[その他]'} {url[:50]}")
-                except Exception as e:
-                    operation_logger.debug(f"ウィンドウ {i} アクセスエラー: {e}")
-                    continue
-
-            # メインウィンドウ（Medicom）を特定
-            main_windows = [w for w in window_info if w['is_medicom']]
-            other_windows = [w for w in window_info if not w['is_medicom']]
-
-            operation_logger.info(f"Medicomウィンドウ: {len(main_windows)}個")
-            operation_logger.info(f"その他のウィンドウ: {len(other_windows)}個")
-
-            if main_windows:
-                main_window = main_windows[0]['handle']
-                operation_logger.info(f"メインウィンドウ: {main_windows[0]['url']}")
-            else:
-                main_window = None
-                operation_logger.warning("⚠️ Medicomウィンドウが見つかりません")
-
-            # Medicom以外の全ウィンドウを閉じる（about:blank、印刷ページなど）
-            closed_count = 0
-            for window in other_windows:
-                try:
-                    driver.switch_to.window(window['handle'])
-                    operation_logger.info(f"余分なウィンドウを閉じます: {window['url'][:80]}")
-                    driver.close()
-                    closed_count += 1
-                    print(f"✓ ウィンドウを閉じました: {window['url'][:50]}")
-                except Exception as e:
-                    operation_logger.debug(f"ウィンドウクローズエラー（既に閉じられている）: {e}")
-
-            # メインウィンドウに戻る
-            if main_window:
-                driver.switch_to.window(main_window)
-                operation_logger.info("✓ メインウィンドウに戻りました")
-
-            final_count = len(driver.window_handles)
+            if windows_before is not None:
+                # 印刷ボタンで開いたウィンドウを記録（まだ開いていない場合は最大3秒待機）
+                wait_until(driver, lambda d: len(d.window_handles) > len(windows_before), 3,
+                           "印刷ウィンドウ", operation_logger, "new_window_opened")
+                popups = track_new_windows(driver, windows_before, "印刷", "auto_order")
+                operation_logger.info(f"印刷で開いたウィンドウ: {len(popups)}個")
+
+            # 印刷で開いたウィンドウはURL・タイトルを調べずに閉じ、
+            # それ以外のウィンドウはMedicomの画面でないものだけを閉じる
+            printed_count, _ = close_popups(driver, purposes=["印刷"], logger=operation_logger)
+            other_count, final_count = close_popups(driver, logger=operation_logger, keep_if=is_medicom_window)
+            closed_count = printed_count + other_count
             operation_logger.info(f"✓ ウィンドウ整理完了。{closed_count}個のウィンドウを閉じました。残り: {final_count}個")
             print(f"✓ ウィンドウ整理完了（{closed_count}個のウィンドウを閉じました）")
+            end_span(window_span)
         except Exception as e:
+            end_span(window_span, "error", e)
             operation_logger.warning(f"ウィンドウ整理エラー: {e}")
             print(f"⚠️ ウィンドウ整理でエラーが発生しましたが、処理を継続します")
             # エラーが発生してもメインウィンドウには戻る
             try:
-                remaining = driver.window_handles
-                if remaining:
-                    driver.switch_to.window(remaining[0])
+                switch_to_main_window(driver)
             except:
                 pass
 
@@ -1069,11 +1668,6 @@ def auto_order(driver, download_path, should_print=True):
             operation_logger.info(f"現在のURL: {current_url}")
             print(f"現在のURL: {current_url[:80]}")
 
-            # 発注ボタンを含むフレームを探す
-            operation_logger.info("発注ボタンを含むフレームを探しています...")
-            frames = driver.find_elements(By.TAG_NAME, "frame") + driver.find_elements(By.TAG_NAME, "iframe")
-            operation_logger.info(f"フレーム数: {len(frames)}")
-
             # 発注ボタンのXPathパターン（id="btnHatyu" または value="発注する"）
             hatyu_button_xpaths = [
                 "//input[@id='btnHatyu']",
@@ -1082,64 +1676,27 @@ def auto_order(driver, download_path, should_print=True):
                 "//input[@type='submit' and contains(@value, '発注')]"
             ]
 
-            hatyu_button = None
-            found_frame = None
-
-            # まずメインコンテンツで検索
-            for xpath in hatyu_button_xpaths:
-                try:
-                    hatyu_button = driver.find_element(By.XPATH, xpath)
-                    if hatyu_button:
-                        operation_logger.info(f"✓ 発注ボタンが見つかりました（メインコンテンツ）: {xpath}")
-                        print(f"✓ 発注ボタンが見つかりました（メインコンテンツ）")
-                        found_frame = "main"
-                        break
-                except:
-                    continue
-
-            # メインで見つからなければフレーム内を検索
-            if not hatyu_button:
-                for i, frame in enumerate(frames):
-                    try:
-                        driver.switch_to.default_content()
-                        driver.switch_to.frame(frame)
-                        operation_logger.debug(f"フレーム {i+1} を確認中...")
-
-                        for xpath in hatyu_button_xpaths:
-                            try:
-                                hatyu_button = driver.find_element(By.XPATH, xpath)
-                                if hatyu_button:
-                                    operation_logger.info(f"✓ 発注ボタンが見つかりました（フレーム {i+1}）: {xpath}")
-                                    print(f"✓ 発注ボタンが見つかりました（フレーム {i+1}）")
-                                    found_frame = f"frame_{i}"
-                                    break
-                            except:
-                                continue
-
-                        if hatyu_button:
-                            break
-
-                    except Exception as e:
-                        operation_logger.debug(f"フレーム {i+1} アクセスエラー: {e}")
-                        driver.switch_to.default_content()
-                        continue
+            # 発注ボタンを含むフレームを探す（メインコンテンツ優先、1回のスクリプト実行で全フレームを走査）
+            operation_logger.info("発注ボタンを含むフレームを探しています...")
+            hatyu_button, found_frame, found_xpath = find_first_element(driver, hatyu_button_xpaths)
+            if hatyu_button:
+                if found_frame == ():
+                    operation_logger.info(f"✓ 発注ボタンが見つかりました（メインコンテンツ）: {found_xpath}")
+                    print(f"✓ 発注ボタンが見つかりました（メインコンテンツ）")
+                else:
+                    operation_logger.info(f"✓ 発注ボタンが見つかりました（フレーム {list(found_frame)}）: {found_xpath}")
+                    print(f"✓ 発注ボタンが見つかりました（フレーム {list(found_frame)}）")
 
             if not hatyu_button:
                 operation_logger.warning("⚠️ 発注ボタンが見つかりません")
                 print("⚠️ 発注ボタン（薬品リスト下部）が見つかりません。手動で発注ボタンをクリックしてください。")
                 print("準備ができたらEnterキーを押してください...")
-                input()
+                wait_for_user()
 
                 # 再度探す（ユーザーがページを操作した可能性）
-                driver.switch_to.default_content()
-                for xpath in hatyu_button_xpaths:
-                    try:
-                        hatyu_button = driver.find_element(By.XPATH, xpath)
-                        if hatyu_button:
-                            operation_logger.info(f"✓ 発注ボタンが見つかりました（再試行）: {xpath}")
-                            break
-                    except:
-                        continue
+                hatyu_button, found_frame, found_xpath = find_first_element(driver, hatyu_button_xpaths)
+                if hatyu_button:
+                    operation_logger.info(f"✓ 発注ボタンが見つかりました（再試行）: {found_xpath}")
 
                 if not hatyu_button:
                     operation_logger.error("⚠️ 発注ボタンが見つかりません")
@@ -1157,6 +1714,7 @@ def auto_order(driver, download_path, should_print=True):
             hatyu_button.click()
 
             # 確認ダイアログ（"発注しても宜しいですか？"）を処理
+            alert_span = start_span("確認ダイアログ（発注）", "alert", driver)
             time.sleep(1)
             try:
                 alert = driver.switch_to.alert
@@ -1166,13 +1724,15 @@ def auto_order(driver, download_path, should_print=True):
                 alert.accept()  # OKをクリック
                 operation_logger.info("✓ 確認ダイアログでOKをクリックしました")
                 print("✓ 確認ダイアログでOKをクリックしました")
+                end_span(alert_span)
             except:
+                end_span(alert_span, "not_found")
                 operation_logger.debug("確認ダイアログなし、またはすでに処理済み")
 
             # ページが完全に読み込まれるまで待機
             if not wait_for_page_load(driver, wait):
                 print("⚠️ ページ読み込みに時間がかかっています。続行しますか？")
-                input("Enterキーを押して続行...")
+                wait_for_user("Enterキーを押して続行...")
 
             operation_logger.info("✓ 発注処理が完了しました")
             print("✓ 発注処理が完了しました")
@@ -1181,7 +1741,7 @@ def auto_order(driver, download_path, should_print=True):
             operation_logger.error(f"発注ボタンクリックエラー: {e}")
             print(f"発注ボタンクリックエラー: {e}")
             print("手動で発注ボタンをクリックしてください。")
-            input("準備ができたらEnterキーを押してください...")
+            wait_for_user("準備ができたらEnterキーを押してください...")
 
         # 戻るボタンをクリックしてメインメニューに戻る
         operation_logger.info("メインメニューに戻ります...")
@@ -1189,7 +1749,7 @@ def auto_order(driver, download_path, should_print=True):
         if not go_back_to_main(driver, wait):
             operation_logger.warning("⚠️ 自動で戻れませんでした")
             print("⚠️ 自動で戻れませんでした。手動で戻ってください。")
-            input("メインメニューに戻ったらEnterキーを押してください...")
+            wait_for_user("メインメニューに戻ったらEnterキーを押してください...")
 
         operation_logger.info("自動発注処理が正常に完了しました")
         operation_logger.info(f"ログファイル: {log_file_path}")
@@ -1213,6 +1773,21 @@ def auto_order(driver, download_path, should_print=True):
 # 不動在庫転送機能
 # ===========================
 
+def write_json_atomic(path, data):
+    """JSONを一時ファイルに書いてから置き換える（書き込み中の異常終了でファイルを壊さない）
+
+    Args:
+        path: 保存先のパス
+        data: 保存するデータ
+    """
+    temp_file = f"{path}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, path)
+
+
 def load_immobile_stock(store_id):
     """不動医薬品リストのJSON読み込み（店舗IDごと）
 
@@ -1222,6 +1797,9 @@ def load_immobile_stock(store_id):
     Returns:
         dict: 不動医薬品リストデータ
     """
+    if stock_backend == "sqlite":
+        return stock_db.load_immobile_stock(store_id, stock_db_path)
+
     stock_file = f"data/immobile_stock_{store_id}.json"
 
     # ディレクトリが存在しない場合は作成
@@ -1241,13 +1819,38 @@ def save_immobile_stock(data, store_id):
         data: 保存するデータ
         store_id: 店舗ID（4桁）
     """
+    if stock_backend == "sqlite":
+        stock_db.save_immobile_stock(data, store_id, stock_db_path)
+        return
+
     stock_file = f"data/immobile_stock_{store_id}.json"
 
     # ディレクトリが存在しない場合は作成
     os.makedirs("data", exist_ok=True)
 
-    with open(stock_file, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    write_json_atomic(stock_file, data)
+
+
+def make_medicine_id(store_id, medicines):
+    """薬品IDを作成（{店舗ID}_{追加日時}）
+
+    同じ秒に追加した薬品と重ならないよう、既にあるIDには連番を付ける。
+
+    Args:
+        store_id: 店舗ID（4桁）
+        medicines: 不動医薬品リストの薬品
+
+    Returns:
+        str: 薬品ID
+    """
+    base = f"{store_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    existing = {medicine.get('medicine_id') for medicine in medicines}
+    medicine_id = base
+    n = 2
+    while medicine_id in existing:
+        medicine_id = f"{base}_{n}"
+        n += 1
+    return medicine_id
 
 
 def add_medicine_to_immobile_stock(store_id, medicine_data):
@@ -1283,7 +1886,7 @@ def add_medicine_to_immobile_stock(store_id, medicine_data):
 
         # 新しい薬品データに必要なフィールドを追加
         new_medicine = {
-            'medicine_id': f"{store_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}",
+            'medicine_id': make_medicine_id(store_id, immobile_stock['medicines']),
             'medicine_name': medicine_data.get('medicine_name'),
             'quantity': medicine_data.get('quantity'),
             'unit': medicine_data.get('unit'),
@@ -1321,31 +1924,59 @@ def update_target_store_status(store_id, medicine_id, target_store_id, status, m
     Returns:
         bool: 更新成功時True
     """
+    updated = update_target_store_statuses(store_id, [(medicine_id, target_store_id, status, message_id)])
+    return updated == 1
+
+
+def update_target_store_statuses(store_id, updates):
+    """送り先店舗の受け入れ可否ステータスをまとめて更新（読み込み・保存は1回）
+
+    Args:
+        store_id: 自店舗ID（4桁）
+        updates: (薬品ID, 送り先店舗ID, ステータス[, 返信メッセージID]) のリスト
+
+    Returns:
+        int: 更新した件数
+    """
     try:
+        responded_at = datetime.now().isoformat()
+
+        if stock_backend == "sqlite":
+            return stock_db.update_target_stores(store_id, updates, responded_at, stock_db_path)
+
         # 不動在庫リストを読み込み
         immobile_stock = load_immobile_stock(store_id)
 
-        # 該当する薬品を探す
+        # (薬品ID, 送り先店舗ID) → 送り先 の索引を作成
+        targets = {}
         for medicine in immobile_stock['medicines']:
-            if medicine['medicine_id'] == medicine_id:
-                # 該当する送り先店舗を探す
-                for target in medicine['target_stores']:
-                    if target['store_id'] == target_store_id:
-                        # ステータスを更新
-                        target['status'] = status
-                        target['responded_at'] = datetime.now().isoformat()
-                        if message_id:
-                            target['response_message_id'] = message_id
-
-                        # 保存
-                        save_immobile_stock(immobile_stock, store_id)
-                        return True
+            for target in medicine['target_stores']:
+                targets.setdefault((medicine['medicine_id'], target['store_id']), target)
 
-        return False
+        updated = 0
+        for update in updates:
+            medicine_id, target_store_id, status = update[:3]
+            message_id = update[3] if len(update) > 3 else None
+
+            target = targets.get((medicine_id, target_store_id))
+            if target is None:
+                continue
+
+            # ステータスを更新
+            target['status'] = status
+            target['responded_at'] = responded_at
+            if message_id:
+                target['response_message_id'] = message_id
+            updated += 1
+
+        # 保存
+        if updated:
+            save_immobile_stock(immobile_stock, store_id)
+        return updated
 
     except Exception as e:
         print(f"ステータス更新エラー: {e}")
-        return False
+        return 0
 
 
 # ===========================
@@ -1371,38 +2002,310 @@ def extract_store_id(user_id):
         return user_id
 
 
+# メッセージストックのジャーナル（追記専用）がこの件数を超えたらスナップショットに統合する
+MESSAGE_JOURNAL_COMPACT_THRESHOLD = 500
+
+
+def get_message_stock_files(store_id):
+    """メッセージストックのファイルパスを取得
+
+    Returns:
+        tuple: (スナップショットJSON, ジャーナルJSONL)
+    """
+    return f"data/message_stock_{store_id}.json", f"data/message_stock_{store_id}.journal.jsonl"
+
+
+def make_lot_key(message_id, medicine_name, expiry_date):
+    """ロットの重複判定キー（メッセージID + 医薬品名 + 使用期限）"""
+    return f"{message_id}_{medicine_name}_{expiry_date}"
+
+
+def read_message_journal(journal_file):
+    """ジャーナルに追記されたメッセージを読み込み（書き込み途中の行は無視）
+
+    Returns:
+        list: メッセージのリスト
+    """
+    records = []
+    if not os.path.exists(journal_file):
+        return records
+
+    with open(journal_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # 異常終了で最後の行が途中までしか書かれていない場合
+                continue
+    return records
+
+
 def load_message_stock(store_id):
     """メッセージストックのJSON読み込み（店舗IDごと）
 
+    スナップショットにジャーナルの追記分を加えた内容を返す。
+
+    Args:
+        store_id: 店舗ID（4桁）
+    """
+    data, _ = load_message_stock_with_journal(store_id)
+    return data
+
+
+def load_message_stock_with_journal(store_id):
+    """メッセージストックを読み込み、ジャーナルの追記件数も返す
+
     Args:
         store_id: 店舗ID（4桁）
+
+    Returns:
+        tuple: (ストック, ジャーナルの件数)。データベースの場合は件数0
     """
-    stock_file = f"data/message_stock_{store_id}.json"
+    if stock_backend == "sqlite":
+        return stock_db.load_message_stock(store_id, stock_db_path), 0
+
+    stock_file, journal_file = get_message_stock_files(store_id)
 
     # ディレクトリが存在しない場合は作成
     os.makedirs("data", exist_ok=True)
 
     if os.path.exists(stock_file):
         with open(stock_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
+            data = json.load(f)
     else:
-        return {"messages": []}
+        data = {"messages": []}
+
+    journal = read_message_journal(journal_file)
+    data['messages'].extend(journal)
+    return data, len(journal)
 
 
 def save_message_stock(data, store_id):
     """メッセージストックのJSON保存（店舗IDごと）
 
+    全件をスナップショットに書き出し、ジャーナルを空にする。
+
     Args:
         data: 保存するデータ
         store_id: 店舗ID（4桁）
     """
-    stock_file = f"data/message_stock_{store_id}.json"
+    if stock_backend == "sqlite":
+        stock_db.save_message_stock(data, store_id, stock_db_path)
+        return
+
+    stock_file, journal_file = get_message_stock_files(store_id)
 
     # ディレクトリが存在しない場合は作成
     os.makedirs("data", exist_ok=True)
 
-    with open(stock_file, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    write_json_atomic(stock_file, {"messages": data['messages']})
+
+    if os.path.exists(journal_file):
+        os.remove(journal_file)
+
+
+def open_message_stock(store_id):
+    """メッセージストックを読み込み、lot_key の索引を作成（処理開始時に1回呼ぶ）
+
+    メッセージは索引（lot_key → メッセージ、登録順）にだけ保持し、一覧は別に持たない。
+
+    Args:
+        store_id: 店舗ID（4桁）
+
+    Returns:
+        dict: ストック（index, journal_count を含む）
+    """
+    data, journal_count = load_message_stock_with_journal(store_id)
+
+    index = {}
+    for message in data['messages']:
+        lot_key = message.get('lot_key') or make_lot_key(
+            message.get('message_id'), message.get('medicine_name'), message.get('expiry_date'))
+        index[lot_key] = message
+
+    return {
+        'store_id': store_id,
+        'index': index,
+        'journal_count': journal_count
+    }
+
+
+def has_message_lot(stock, lot_key):
+    """ロットがストックに登録済みかどうか"""
+    return lot_key in stock['index']
+
+
+def append_message_lots(stock, records):
+    """新しいロットをジャーナルに追記（登録済みの lot_key は追加しない）
+
+    Args:
+        stock: open_message_stock() の戻り値
+        records: 追加するメッセージのリスト（lot_key を含む）
+
+    Returns:
+        int: 追加した件数
+    """
+    new_records = []
+    for record in records:
+        if record['lot_key'] in stock['index']:
+            continue
+        stock['index'][record['lot_key']] = record
+        new_records.append(record)
+
+    if not new_records:
+        return 0
+
+    if stock_backend == "sqlite":
+        # データベースは追加分だけを1トランザクションで書き込む
+        return stock_db.insert_messages(stock['store_id'], new_records, stock_db_path)
+
+    _, journal_file = get_message_stock_files(stock['store_id'])
+    os.makedirs("data", exist_ok=True)
+    # 途中までしか書かれていない最終行があれば改行して区切る
+    needs_newline = False
+    if os.path.exists(journal_file) and os.path.getsize(journal_file) > 0:
+        with open(journal_file, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+
+    with open(journal_file, 'a', encoding='utf-8') as f:
+        if needs_newline:
+            f.write("\n")
+        for record in new_records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+    stock['journal_count'] += len(new_records)
+
+    if stock['journal_count'] >= MESSAGE_JOURNAL_COMPACT_THRESHOLD:
+        compact_message_stock(stock)
+
+    return len(new_records)
+
+
+def compact_message_stock(stock):
+    """ジャーナルの追記分をスナップショットに統合"""
+    save_message_stock({"messages": list(stock['index'].values())}, stock['store_id'])
+    stock['journal_count'] = 0
+
+
+# メッセージ本文のパース用（コンパイル済み）
+SENDER_STORE_PATTERN = re.compile(r'\*+\s*\n\s*\*\s+(.+?)\s*\n')  # 例: "*  ウォンツ薬局　日赤病院前店"
+SENDER_STORE_LEGACY_PATTERN = re.compile(r'調剤薬局(.+?)[\s\*\n]')  # 旧パターン: "調剤薬局ツルハドラッグ..."
+DASH_LINE_START_PATTERN = re.compile(r'-{10,}')  # 区切り行の始まり（セクションの終わり）
+QUANTITY_PATTERN = re.compile(r'(\d+\.?\d*)\s+(\S+?)\s*$')  # "薬品名  100 錠"
+EXPIRY_PATTERN = re.compile(r'\s*(\d{4}/\d{2})')  # " 2026/07"
+HEADER_PATTERN = re.compile('薬品名|数量|単位|使用期限|余剰在庫')
+
+
+def _iter_lines(content):
+    """本文を1行ずつ取り出す（全体を分割したリストを作らない）
+
+    Yields:
+        tuple: (行, 後ろに改行があるかどうか)
+    """
+    position = 0
+    while True:
+        newline = content.find('\n', position)
+        if newline == -1:
+            yield content[position:], False
+            return
+        yield content[position:newline], True
+        position = newline + 1
+
+
+def _iter_medicine_lines(content):
+    """区切り行（----------）で囲まれた2番目のセクション（ヘッダーの次＝薬品一覧）の行を順に取り出す
+
+    本文を先頭から1回だけ走査し、2番目のセクションを読み終えた時点で終了する。
+    """
+    section_count = 0
+    section_lines = None  # 現在のセクションの行数（セクション外は None）
+    first_line_empty = False
+
+    for line, has_newline in _iter_lines(content):
+        if section_lines is not None:
+            # セクションは1文字以上を含む（先頭の行、先頭が空行ならその次の行までは区切り行でも本文扱い）
+            if not DASH_LINE_START_PATTERN.match(line) or section_lines == 0 or \
+                    (section_lines == 1 and first_line_empty):
+                if section_lines == 0:
+                    first_line_empty = not line
+                section_lines += 1
+                if section_count == 2:
+                    yield line
+                continue
+            # 区切り行でセクション終了
+            if section_count == 2:
+                return
+            section_lines = None
+
+        # 区切り行（末尾が10文字以上の - で、次の行がある）から新しいセクションを開始
+        if has_newline and line.endswith('----------'):
+            section_count += 1
+            section_lines = 0
+
+
+def iter_message_lots(content):
+    """メッセージ本文から医薬品情報（ロット）を1件ずつ取り出す
+
+    parse_message_content() と同じ内容を、リストを作らずに順に返す。
+    複数ロットの長いメッセージや過去メッセージの一括取り込みでもメモリ使用量が増えない。
+
+    Args:
+        content: メッセージ本文（テキスト）
+
+    Yields:
+        dict: {送信店舗名、医薬品名、数量、単位、使用期限}
+    """
+    # 送信店舗名の抽出（***で囲まれた部分から正式名称を取得）
+    store_match = SENDER_STORE_PATTERN.search(content) or SENDER_STORE_LEGACY_PATTERN.search(content)
+    sender_store = store_match.group(1).strip() if store_match else None
+
+    pending = None  # 使用期限の行を待っているロット
+
+    # 薬品情報の抽出（--------で囲まれた2番目のセクション）
+    for raw_line in _iter_medicine_lines(content):
+        line = raw_line.strip()
+
+        # 薬品名の次の行に使用期限があれば付けてから返す
+        if pending is not None:
+            lot, pending = pending, None
+            if '/' in line:
+                expiry_match = EXPIRY_PATTERN.match(line)
+                if expiry_match:
+                    lot['expiry_date'] = expiry_match.group(1)
+                    yield lot
+                    continue
+            yield lot
+
+        # ヘッダー行・空行をスキップ
+        if not line or HEADER_PATTERN.search(line):
+            continue
+
+        # 薬品名と数量が同じ行にある場合
+        qty_match = QUANTITY_PATTERN.search(line)
+        if not qty_match:
+            continue
+
+        # 単位は通常1-10文字程度
+        unit = qty_match.group(2)
+        if len(unit) > 10:
+            continue
+
+        pending = {
+            'sender_store': sender_store,
+            'medicine_name': line[:qty_match.start()].strip(),
+            'quantity': float(qty_match.group(1)),
+            'unit': unit,
+            'expiry_date': None
+        }
+
+    if pending is not None:
+        yield pending
 
 
 def parse_message_content(content):
@@ -1417,85 +2320,683 @@ def parse_message_content(content):
               パース失敗時は空リスト
     """
     try:
-        # 送信店舗名の抽出（***で囲まれた部分から正式名称を取得）
-        # 例: "*  ウォンツ薬局　日赤病院前店"
-        store_match = re.search(r'\*+\s*\n\s*\*\s+(.+?)\s*\n', content)
-        if not store_match:
-            # 旧パターン: "調剤薬局ツルハドラッグ..."
-            store_match = re.search(r'調剤薬局(.+?)[\s\*\n]', content)
+        return list(iter_message_lots(content))
+    except Exception as e:
+        print(f"メッセージパースエラー: {e}")
+        return []
 
-        sender_store = store_match.group(1).strip() if store_match else None
 
-        # 薬品情報の抽出（--------で囲まれた部分全体）
-        # 全てのダッシュ行で区切られたセクションを取得
-        dash_sections = re.findall(r'-{10,}\n(.+?)(?=\n-{10,}|$)', content, re.DOTALL)
+def parse_message_contents(contents):
+    """複数のメッセージ本文をまとめてパース
 
-        if not dash_sections or len(dash_sections) < 2:
-            return []
+    Args:
+        contents: メッセージ本文のリスト
+
+    Returns:
+        list: 本文ごとの parse_message_content() の結果（contents の順序）
+    """
+    return [parse_message_content(content) for content in contents]
 
-        # 2番目のセクション（ヘッダーの次）が実際のデータ
-        medicine_text = dash_sections[1].strip() if len(dash_sections) > 1 else dash_sections[0].strip()
 
-        # 薬品名と数量の抽出（複数ロット対応）
-        lines = medicine_text.split('\n')
+# ストックへの書き込みをまとめる件数（ロットはこの件数ごとにジャーナルへ追記する）
+MESSAGE_STREAM_CHUNK_SIZE = 50
 
-        # ヘッダー行をスキップするためのフラグ
-        header_keywords = ['薬品名', '数量', '単位', '使用期限', '余剰在庫']
 
-        results = []
-        current_medicine = None
+def build_message_record(lot, message_id, received_datetime=None, title="購入伺い", sender=None):
+    """パースしたロットからメッセージストックのレコードを作成
 
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            if not line or any(keyword in line for keyword in header_keywords):
-                i += 1
-                continue
+    Args:
+        lot: iter_message_lots() が返すロット
+        message_id: メッセージID
+        received_datetime: 受信日時
+        title: メッセージタイトル
+        sender: 送信者
 
-            # 薬品名と数量が同じ行にある場合
-            qty_match = re.search(r'(\d+\.?\d*)\s+(\S+?)\s*$', line)
-            if qty_match:
-                try:
-                    quantity_str = qty_match.group(1)
-                    unit_str = qty_match.group(2).strip()
-
-                    # 単位は通常1-10文字程度
-                    if len(unit_str) <= 10:
-                        medicine_name = line[:qty_match.start()].strip()
-                        quantity = float(quantity_str)
-                        unit = unit_str
-
-                        # 次の行に使用期限があるかチェック
-                        expiry_date = None
-                        if i + 1 < len(lines):
-                            next_line = lines[i + 1].strip()
-                            if '/' in next_line and re.match(r'\s*\d{4}/\d{2}', next_line):
-                                expiry_match = re.search(r'(\d{4}/\d{2})', next_line)
-                                if expiry_match:
-                                    expiry_date = expiry_match.group(1)
-                                    i += 1  # 期限行をスキップ
-
-                        # 結果に追加
-                        results.append({
-                            'sender_store': sender_store,
-                            'medicine_name': medicine_name,
-                            'quantity': quantity,
-                            'unit': unit,
-                            'expiry_date': expiry_date
-                        })
-                        current_medicine = medicine_name
-                except Exception:
-                    pass
+    Returns:
+        dict: メッセージストックのレコード
+    """
+    return {
+        'message_id': message_id,
+        'lot_key': make_lot_key(message_id, lot['medicine_name'], lot['expiry_date']),
+        'received_datetime': received_datetime,
+        'title': title,
+        'sender': sender,
+        'sender_store': lot['sender_store'],
+        'medicine_name': lot['medicine_name'],
+        'quantity': lot['quantity'],
+        'unit': lot['unit'],
+        'expiry_date': lot['expiry_date'],
+        'status': 'unprocessed',
+        'created_at': datetime.now().isoformat()
+    }
+
+
+def stream_message_records(stock, records, chunk_size=MESSAGE_STREAM_CHUNK_SIZE):
+    """レコードを受け取った順に一定件数ずつストックへ書き込む（全件をリストに溜めない）
+
+    Args:
+        stock: open_message_stock() の戻り値
+        records: レコードのイテラブル（ジェネレータ可）
+        chunk_size: 1回に書き込む件数
+
+    Returns:
+        int: 追加した件数
+    """
+    saved_count = 0
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            saved_count += append_message_lots(stock, chunk)
+            chunk = []
+    if chunk:
+        saved_count += append_message_lots(stock, chunk)
+    return saved_count
+
+
+def iter_archived_messages(archive_file):
+    """過去メッセージのアーカイブ（JSONL、1行1件）を1件ずつ読み込み
+
+    各行は {"message_id", "content", "received_datetime", "title", "sender"} 形式。
+    """
+    with open(archive_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def backfill_message_stock(store_id, archive_file, chunk_size=500):
+    """過去メッセージの本文をパースしてメッセージストックに取り込む
+
+    アーカイブを1件ずつ読み、ロットを順にストックへ流し込む。
+
+    Args:
+        store_id: 店舗ID（4桁）
+        archive_file: アーカイブファイル（JSONL）
+        chunk_size: 1回に書き込む件数
+
+    Returns:
+        dict: 処理したメッセージ数と追加したロット数
+    """
+    stock = open_message_stock(store_id)
+    counts = {'messages': 0, 'lots': 0}
+
+    def records():
+        for message in iter_archived_messages(archive_file):
+            counts['messages'] += 1
+            try:
+                for lot in iter_message_lots(message['content']):
+                    yield build_message_record(
+                        lot,
+                        message['message_id'],
+                        message.get('received_datetime'),
+                        message.get('title', "購入伺い"),
+                        message.get('sender')
+                    )
+            except Exception as e:
+                print(f"メッセージパースエラー（{message.get('message_id')}）: {e}")
+
+    counts['lots'] = stream_message_records(stock, records(), chunk_size)
+    if stock_backend == "json":
+        compact_message_stock(stock)
+    return counts
+
+
+# 受信一覧（grdJushin）の全行を1回のスクリプト実行で取得する
+# 先頭2行（ページ送り・見出し）を除いた各行について、受信日時・タイトル・送信者・状態と
+# タイトルリンク（要素・onclick/href・ポストバック先・メッセージID）を返す
+MESSAGE_LIST_SCRIPT = """
+var table = document.getElementById('grdJushin');
+if (!table) {
+    var ids = [];
+    var tables = document.getElementsByTagName('table');
+    for (var t = 0; t < tables.length; t++) { ids.push(tables[t].id || ''); }
+    return {found: false, table_ids: ids};
+}
+function text(node) {
+    return node ? (node.innerText || node.textContent || '').replace(/\\s+/g, ' ').trim() : '';
+}
+var rows = [];
+for (var i = 2; i < table.rows.length; i++) {
+    var cells = table.rows[i].cells;
+    var link = cells.length > 2 ? cells[2].querySelector('a') : null;
+    var action = link ? (link.getAttribute('onclick') || link.getAttribute('href') || '') : '';
+    var target = action.match(/target=(\\d+)/);
+    var postback = action.match(/__doPostBack\\('([^']+)'/);
+    rows.push({
+        index: i - 2,
+        received: text(cells[1]),
+        title: text(link),
+        sender: text(cells[3]),
+        status: text(cells[4]),
+        link: link,
+        onclick: action,
+        postback: postback ? postback[1] : null,
+        target_id: target ? target[1] : null
+    });
+}
+return {found: true, rows: rows};
+"""
+
+
+def get_message_list(driver, logger=None):
+    """受信一覧（grdJushin）のメッセージを取得（受信一覧フレーム内で呼ぶ）
+
+    行ごとに find_element を繰り返さず、1回の execute_script で全行を取得する。
+
+    Args:
+        driver: Seleniumドライバー
+        logger: ロガー（省略可）
+
+    Returns:
+        list: メッセージ行のリスト。各要素は dict:
+              {index, received, title, sender, status, link（タイトルリンク要素）,
+               onclick, postback（__doPostBack の対象）, target_id（メッセージID、一覧に無い場合は None）}
+              タイトルリンクの無い行は含めない
+    """
+    result = driver.execute_script(MESSAGE_LIST_SCRIPT)
+    if not result or not result.get('found'):
+        if logger:
+            table_ids = (result or {}).get('table_ids', [])
+            logger.warning(f"受信一覧テーブル（grdJushin）が見つかりません（テーブル: {table_ids}）")
+        return []
+    return [row for row in result['rows'] if row['link'] is not None]
+
+
+# 受信一覧のフォーム（ASP.NET のポストバックに必要な hidden 項目など）を取得するスクリプト
+MESSAGE_FORM_SCRIPT = """
+var form = document.forms[0];
+var fields = [];
+if (form) {
+    for (var i = 0; i < form.elements.length; i++) {
+        var el = form.elements[i];
+        if (!el.name || el.disabled) { continue; }
+        var type = (el.type || '').toLowerCase();
+        if (type === 'submit' || type === 'button' || type === 'image' || type === 'file') { continue; }
+        if ((type === 'checkbox' || type === 'radio') && !el.checked) { continue; }
+        fields.push([el.name, el.value]);
+    }
+}
+return {url: location.href, action: form ? form.action : location.href, fields: fields};
+"""
+
+# ポストバックの応答に含まれるメッセージ詳細のURL（window.open("I_Jushin.aspx?target=..."））
+MESSAGE_TARGET_PATTERN = re.compile(r'I_Jushin\.aspx\?target=(\d+)')
+
+
+def switch_to_message_list(driver, logger=None):
+    """受信一覧フレーム（Itiran）に切り替え（切り替えられない場合のみページを再読み込み）
+
+    Returns:
+        bool: 切り替えできた場合True
+    """
+    for attempt in range(2):
+        try:
+            driver.switch_to.default_content()
+            driver.switch_to.frame("Itiran")
+            return True
+        except Exception as e:
+            if attempt == 0:
+                if logger:
+                    logger.info(f"受信一覧フレームが見つからないため再読み込みします: {e}")
+                driver.refresh()
+                wait_for_page_load(driver, WebDriverWait(driver, 10))
+    return False
+
+
+def resolve_message_targets(driver, rows, logger=None):
+    """一覧の行のメッセージID（target）を、ポストバックをHTTPで再現して取得（受信一覧フレーム内で呼ぶ）
+
+    一覧の行はポストバック（__doPostBack）でメッセージ詳細を開くため、一覧にはIDが無い。
+    ブラウザと同じCookieで同じフォームを送信し、応答の window.open のURLからIDを取り出す。
+    ブラウザの画面は変わらない。
+
+    Args:
+        driver: Seleniumドライバー
+        rows: get_message_list() の行（target_id を書き込む）
+        logger: ロガー（省略可）
+
+    Returns:
+        int: IDが分かった行の数
+    """
+    form = driver.execute_script(MESSAGE_FORM_SCRIPT)
+    session = get_http_session(driver)
+
+    resolved = 0
+    for row in rows:
+        if row.get('target_id'):
+            resolved += 1
+            continue
+        if not row.get('postback'):
+            continue
+
+        data = [(name, value) for name, value in form['fields']
+                if name not in ('__EVENTTARGET', '__EVENTARGUMENT')]
+        data += [('__EVENTTARGET', row['postback']), ('__EVENTARGUMENT', '')]
+        try:
+            response = session.post(form['action'], data=data, timeout=15,
+                                    headers={'Referer': form['url']})
+            match = MESSAGE_TARGET_PATTERN.search(response.text)
+        except Exception as e:
+            if logger:
+                logger.warning(f"メッセージIDの取得に失敗しました（{row['postback']}）: {e}")
+            continue
+
+        if match:
+            row['target_id'] = match.group(1)
+            resolved += 1
+        elif logger:
+            logger.warning(f"メッセージIDが応答に含まれていません（{row['postback']}）")
+
+    return resolved
+
+
+def prepare_next_messages(driver, rows, fetch_bodies=False, max_workers=4, logger=None):
+    """次に処理するメッセージのIDを取得し、購入伺いは本文もHTTPで取得（処理の直前に呼ぶ）
+
+    メッセージを開くとサーバー側で既読になるため、全件のIDや本文を最初にまとめて取得すると、
+    途中で中断した場合に未処理のメッセージが既読のまま残る。そのため1件ずつ取得する。
+    fetch_bodies を指定した場合（message_fetch_mode: http）だけ、購入伺いが続くときに
+    続く購入伺い（最大 max_workers 件）の本文も並列に取得する。取得した分はブラウザを使わずに
+    すぐ順番に処理されるが、途中で例外が起きると取得済みの分は未処理のまま既読になる。
+
+    Args:
+        driver: Seleniumドライバー
+        rows: 未処理の行（先頭が次に処理する行、取得した行には prepared を書き込む）
+        fetch_bodies: 購入伺いの本文をHTTPで取得する場合True
+        max_workers: 本文を同時に取得する数
+        logger: ロガー（省略可）
+
+    Returns:
+        bool: 先頭の行のメッセージIDが分かった場合True
+    """
+    head = rows[0]
+    batch = [head]
+    if fetch_bodies and head['rule']['kind'] == "purchase":
+        for row in rows[1:max(max_workers, 1)]:
+            if row['rule']['kind'] != "purchase":
+                break
+            batch.append(row)
+
+    # 出庫処理の後などで一覧から離れている場合に備えて受信一覧フレームに戻る
+    if not switch_to_message_list(driver, logger):
+        return False
+    resolve_message_targets(driver, batch, logger)
+    for row in batch:
+        if row.get('target_id'):
+            row['prepared'] = True
+    if not head.get('target_id'):
+        return False
+
+    if fetch_bodies and head['rule']['kind'] == "purchase":
+        try:
+            fetch_message_bodies(driver, [row for row in batch if row.get('target_id')], max_workers, logger)
+        except Exception as e:
+            if logger:
+                logger.warning(f"メッセージ本文の取得エラー（ブラウザで開きます）: {e}")
+    return True
 
-            i += 1
 
-        return results
+def get_message_detail_url(driver, target_id):
+    """メッセージ詳細（I_Jushin.aspx）のURLを作成（受信一覧フレーム内で呼ぶ）"""
+    list_url = driver.execute_script("return location.href;")
+    return urljoin(list_url, f"I_Jushin.aspx?target={target_id}")
 
+
+@traced("メッセージを開く", "window")
+def open_message_window(driver, url, timeout=5, logger=None):
+    """受信一覧フレームからメッセージ詳細を新しいウィンドウで開く
+
+    一覧のポストバックと同じく受信一覧フレームの window.open で開くため、
+    詳細画面から元の画面（opener）を操作する処理（出庫処理など）もそのまま動く。
+    開いたウィンドウは用途「メッセージ」として window_registry に記録する。
+
+    Returns:
+        str: 開いたウィンドウのハンドル。開かなかった場合None
+    """
+    handles_before = driver.window_handles
+    driver.execute_script("window.open(arguments[0], '_blank');", url)
+    if not wait_until(driver, lambda d: len(d.window_handles) > len(handles_before), timeout,
+                      "メッセージ詳細", logger, "new_window_opened"):
+        return None
+    new_handles = track_new_windows(driver, handles_before, "メッセージ", "check_messages")
+    return new_handles[-1] if new_handles else None
+
+
+@traced("メッセージ本文取得", "download")
+def fetch_message_bodies(driver, rows, max_workers=4, logger=None):
+    """メッセージ詳細の本文をHTTPで並列に取得（ブラウザのウィンドウは開かない）
+
+    ブラウザと同じCookieを持つHTTPセッションで I_Jushin.aspx?target=... を取得し、
+    本文のテキストを row['content'] に書き込む（受信一覧フレーム内で呼ぶ）。
+
+    Args:
+        driver: Seleniumドライバー
+        rows: メッセージIDが分かっている行のリスト
+        max_workers: 同時に取得する数
+        logger: ロガー（省略可）
+
+    Returns:
+        int: 本文を取得できた行の数
+    """
+    urls = {row['target_id']: get_message_detail_url(driver, row['target_id'])
+            for row in rows if row.get('target_id')}
+    if not urls:
+        return 0
+
+    start = time.perf_counter()
+    pages = fetch_pages(driver, list(urls.values()), max_workers)
+
+    fetched = 0
+    for row in rows:
+        html = pages.get(urls.get(row.get('target_id')))
+        if html:
+            row['content'] = html_to_text(html)
+            fetched += 1
+
+    if logger:
+        logger.info(f"メッセージ本文をHTTPで取得しました（{fetched}/{len(rows)}件、"
+                    f"{time.perf_counter() - start:.2f}秒、同時{max_workers}件）")
+    return fetched
+
+
+def handle_purchase_message(driver, message, message_stock, logger):
+    """「購入伺い」メッセージ：医薬品情報を抽出してストックに保存
+
+    Args:
+        driver: Seleniumドライバー（本文を取得済みでない場合はメッセージウィンドウ）
+        message: メッセージ情報（title, sender, received, message_id, content, main_window）
+        message_stock: open_message_stock() の戻り値
+        logger: ロガー
+
+    Returns:
+        int: 新しく保存したロット数
+    """
+    title = message['title']
+    sender = message['sender']
+    received_datetime = message['received']
+    message_id = message['message_id']
+
+    # 購入伺いメッセージ：医薬品情報を抽出してストック保存
+    logger.info("「購入伺い」メッセージを処理します")
+    print("\n「購入伺い」メッセージを処理します")
+
+    # メッセージ本文を取得（HTTPで取得済みでなければ開いたウィンドウから）
+    message_content = message['content']
+    if message_content is None:
+        wait_until(driver, timeout=1, description="メッセージ本文読み込み待機", logger=logger,
+                   until=document_ready())
+        body_element = driver.find_element(By.TAG_NAME, "body")
+        message_content = body_element.text
+
+    logger.info("メッセージ本文:")
+    logger.info("-" * 50)
+    logger.info(message_content)
+    logger.info("-" * 50)
+
+    print("\nメッセージ本文:")
+    print("-" * 50)
+    print(message_content)
+    print("-" * 50)
+
+    # メッセージ本文をパースし、ロットを順にストックへ保存（複数ロット対応）
+    lot_count = 0
+    new_lots = []
+    saved_count = 0
+    try:
+        for lot_count, parsed_data in enumerate(iter_message_lots(message_content), 1):
+            logger.info(f"  [{lot_count}] 送信店舗: {parsed_data['sender_store']}")
+            logger.info(f"      医薬品名: {parsed_data['medicine_name']}")
+            logger.info(f"      数量: {parsed_data['quantity']}")
+            logger.info(f"      単位: {parsed_data['unit']}")
+            logger.info(f"      使用期限: {parsed_data['expiry_date']}")
+
+            print(f"  [{lot_count}] 送信店舗: {parsed_data['sender_store']}")
+            print(f"      医薬品名: {parsed_data['medicine_name']}")
+            print(f"      数量: {parsed_data['quantity']}")
+            print(f"      単位: {parsed_data['unit']}")
+            print(f"      使用期限: {parsed_data['expiry_date']}")
+
+            # メッセージストックに保存（重複チェック）
+            if message_id:
+                # 重複チェック（メッセージID + 医薬品名 + 使用期限で判定）
+                new_message = build_message_record(parsed_data, message_id, received_datetime, title, sender)
+
+                if not has_message_lot(message_stock, new_message['lot_key']):
+                    new_lots.append(new_message)
+                    # 一定件数ごとにジャーナルへ追記（全ロットを溜めない）
+                    if len(new_lots) >= MESSAGE_STREAM_CHUNK_SIZE:
+                        saved_count += append_message_lots(message_stock, new_lots)
+                        new_lots = []
+                else:
+                    logger.info(f"      → このロットは既にストックに存在します")
+                    print(f"      → このロットは既にストックに存在します")
     except Exception as e:
+        logger.error(f"メッセージパースエラー: {e}")
         print(f"メッセージパースエラー: {e}")
-        return []
 
+    # 残りの新しいロットをジャーナルに追記
+    saved_count += append_message_lots(message_stock, new_lots)
+
+    if lot_count:
+        logger.info(f"抽出されたデータ: {lot_count}件のロット")
+        print(f"\n抽出されたデータ: {lot_count}件のロット")
+
+        if saved_count > 0:
+            logger.info(f"✓ メッセージをストックに保存しました（{saved_count}件のロット）")
+            print(f"\n✓ メッセージをストックに保存しました（{saved_count}件のロット）")
+        else:
+            logger.info("全てのロットが既にストックに存在します")
+            print("\n全てのロットが既にストックに存在します")
+    else:
+        logger.warning("メッセージのパースに失敗しました")
+        print("\n⚠️ メッセージのパースに失敗しました")
+
+    return saved_count
+
+
+def handle_matching_message(driver, message, message_stock, logger):
+    """「マッチング：使用期限」メッセージ：出庫処理を自動実行（最大3回リトライ）
+
+    出庫処理ボタンのクリックでメッセージウィンドウは閉じ、メインウィンドウに戻る。
+
+    Args:
+        driver: Seleniumドライバー（メッセージウィンドウ）
+        message: メッセージ情報（main_window を使用）
+        message_stock: 未使用（処理関数の引数をそろえるため）
+        logger: ロガー
+
+    Returns:
+        bool: 出庫処理が完了した場合True
+    """
+    main_window = message['main_window']
+
+    # マッチングメッセージ：出庫処理を自動実行（最大3回リトライ）
+    logger.info("「マッチング：使用期限」メッセージを処理します")
+    print("\n「マッチング：使用期限」メッセージを処理します")
+
+    max_retries = 3
+    success = False
+
+    for retry_count in range(max_retries):
+        try:
+            if retry_count > 0:
+                logger.info(f"リトライ {retry_count}/{max_retries - 1} を実行します...")
+                print(f"\nリトライ {retry_count}/{max_retries - 1} を実行します...")
+                safe_wait(3, "リトライ前待機", logger)
+            else:
+                # 初回のみ：出庫処理リンクをクリック（このクリックでメッセージウィンドウが閉じる）
+                safe_wait(1, "出庫処理ボタン検索前", logger)
+
+                logger.info(f"出庫処理ボタン（lnkSyukko）を探します...")
+                # 出庫処理ボタンをクリックするとメッセージウィンドウが閉じて
+                # メインウィンドウに出庫画面が表示される（閉じるまで最大4秒待機）
+                if not safe_find_and_click(driver, By.ID, "lnkSyukko", "出庫処理ボタン", 4, logger,
+                                           until=window_closed()):
+                    raise Exception("出庫処理ボタンのクリックに失敗")
+
+                logger.info("メインウィンドウに切り替えます...")
+
+                # メインウィンドウに切り替え
+                try:
+                    driver.switch_to.window(main_window)
+                    logger.info("メインウィンドウに切り替わりました")
+                except Exception as e:
+                    logger.warning(f"メインウィンドウ切り替えエラー: {e}")
+                    # フォールバック：記録したメインウィンドウ（なければ最初のウィンドウ）に切り替え
+                    if switch_to_main_window(driver):
+                        logger.info("メインウィンドウに切り替えました")
+
+                # 出庫画面への遷移を確認（ページ読み込み完了＋ボタン存在確認）
+                if not wait_for_shipping_screen(driver, logger, timeout=15):
+                    raise Exception("出庫画面への遷移がタイムアウトしました")
+
+            # 再計算ボタンをクリック
+            logger.info(f"再計算ボタン（btnRecalc）を探します...")
+            if not safe_find_and_click(driver, By.ID, "btnRecalc", "再計算ボタン", 3, logger,
+                                       until=element_stale()):
+                # ボタンが見つからない場合、初回のみページ構造を調査
+                if retry_count == 0:
+                    logger.warning("再計算ボタンが見つかりません。ページ構造を調査します...")
+                    try:
+                        from debug_page_structure import debug_page_structure
+                        debug_page_structure(driver, logger)
+                    except Exception as e:
+                        logger.warning(f"ページ構造調査エラー: {e}")
+                raise Exception("再計算ボタンのクリックに失敗")
+
+            # 出庫するボタンをクリック
+            logger.info(f"出庫するボタン（btnSyuko）を探します...")
+            if not safe_find_and_click(driver, By.ID, "btnSyuko", "出庫するボタン", 2, logger,
+                                       until=alert_appears()):
+                raise Exception("出庫するボタンのクリックに失敗")
+
+            # アラート（確認ダイアログ）の処理
+            alert_span = start_span("確認ダイアログ（出庫）", "alert", driver)
+            try:
+                alert = driver.switch_to.alert
+                alert_text = alert.text
+                logger.info(f"確認ダイアログ: {alert_text}")
+                print(f"確認ダイアログ: {alert_text}")
+                alert.accept()  # OKをクリック
+                end_span(alert_span)
+                time.sleep(2)
+                logger.info("✓ 出庫処理が完了しました")
+                print("\n✓ 出庫処理が完了しました")
+                success = True
+                break
+            except:
+                end_span(alert_span, "not_found")
+                # アラートがない場合も成功とみなす
+                logger.info("✓ 出庫処理が完了しました（確認ダイアログなし）")
+                print("\n✓ 出庫処理が完了しました")
+                success = True
+                break
+
+        except Exception as e:
+            logger.error(f"出庫処理エラー (試行 {retry_count + 1}/{max_retries}): {e}")
+            print(f"\n⚠️ 出庫処理に失敗しました (試行 {retry_count + 1}/{max_retries}): {e}")
+
+            if retry_count < max_retries - 1:
+                logger.info("待機時間を3秒に延長してリトライします...")
+                print("待機時間を3秒に延長してリトライします...")
+            else:
+                logger.error("最大リトライ回数に達しました。このメッセージの処理をスキップします。")
+                print("\n⚠️ 最大リトライ回数に達しました。このメッセージの処理をスキップします。")
+
+    if not success:
+        logger.warning("出庫処理が完了できませんでした")
+        print("\n⚠️ 出庫処理が完了できませんでした")
+
+    return success
+
+
+# メッセージ種別ごとの処理関数（MESSAGE_TITLE_RULES の処理名 → 関数）
+# 処理関数のないメッセージ種別は開いて既読にするだけ
+MESSAGE_HANDLERS = {
+    'purchase': handle_purchase_message,
+    'matching': handle_matching_message
+}
+
+# メッセージタイトルの振り分けルール（上から順に判定し、最初に一致したものを使う）
+#   key: config['message_processing'] の設定キー
+#   match: "exact"（完全一致）または "prefix"（前方一致）
+#   title: 比較するタイトル
+#   kind: 処理名（MESSAGE_HANDLERS のキー）
+#   closes_window: 処理関数がメッセージウィンドウを閉じる場合True
+MESSAGE_TITLE_RULES = [
+    {'key': "購入伺い", 'match': "exact", 'title': "購入伺い", 'kind': "purchase", 'closes_window': False},
+    {'key': "マッチング：使用期限", 'match': "prefix", 'title': "マッチング：使用期限", 'kind': "matching",
+     'closes_window': True},
+    {'key': "不動在庫転送", 'match': "prefix", 'title': "不動在庫転送", 'kind': "transfer", 'closes_window': False},
+    {'key': "返信", 'match': "prefix", 'title': "Re:", 'kind': "reply", 'closes_window': False}
+]
+
+
+def build_message_router(msg_processing=None, rules=None):
+    """メッセージタイトルの振り分け表を作成（有効なルールを1つの正規表現にまとめる）
 
+    Args:
+        msg_processing: config['message_processing']（設定キー → 処理するかどうか、未設定は処理する）
+        rules: 振り分けルール（省略時は MESSAGE_TITLE_RULES）
+
+    Returns:
+        dict: 振り分け表（classify_message() に渡す）
+    """
+    msg_processing = msg_processing or {}
+    rules = MESSAGE_TITLE_RULES if rules is None else rules
+
+    enabled = [rule for rule in rules if msg_processing.get(rule['key'], True)]
+    alternatives = []
+    for i, rule in enumerate(enabled):
+        suffix = r"\Z" if rule['match'] == "exact" else ""
+        alternatives.append(f"(?P<r{i}>{re.escape(rule['title'])}{suffix})")
+
+    return {
+        'pattern': re.compile("|".join(alternatives)) if alternatives else None,
+        'rules': {f"r{i}": rule for i, rule in enumerate(enabled)}
+    }
+
+
+def classify_message(router, title):
+    """タイトルに一致するルールを取得
+
+    Args:
+        router: build_message_router() の戻り値
+        title: メッセージタイトル
+
+    Returns:
+        dict: 一致したルール。処理対象でない場合は None
+    """
+    if router['pattern'] is None or not title:
+        return None
+    match = router['pattern'].match(title)
+    return router['rules'][match.lastgroup] if match else None
+
+
+def reload_message_list(driver, logger=None):
+    """受信一覧フレーム（Itiran）だけを再読み込み（既読状態を反映）"""
+    try:
+        driver.switch_to.default_content()
+        reloaded = driver.execute_script("""
+            var frame = document.getElementById('Itiran') || document.getElementsByName('Itiran')[0];
+            if (!frame) { return false; }
+            var url = frame.contentWindow.location.href;
+            frame.src = url.split('#')[0];
+            return true;
+        """)
+        if reloaded and logger:
+            logger.info("✓ 受信一覧を再読み込みしました")
+        return bool(reloaded)
+    except Exception as e:
+        if logger:
+            logger.warning(f"受信一覧の再読み込みに失敗しました: {e}")
+        return False
+
+
+@traced("check_messages", "operation")
+@report_commands("check_messages")
 def check_messages(driver, user_id, config=None):
     """連絡板の未読メッセージを確認（連続処理）
 
@@ -1520,7 +3021,7 @@ def check_messages(driver, user_id, config=None):
     max_message_count = config.get('max_message_count', 10)
 
     # ログ設定
-    operation_logger, log_file_path = setup_logger()
+    operation_logger, log_file_path = setup_logger("check_messages", extract_store_id(user_id))
     operation_logger.info(f"ログファイル: {log_file_path}")
     operation_logger.info("============================================================")
     operation_logger.info(f"連絡板メッセージ確認処理を開始します（最大{max_message_count}件連続処理）")
@@ -1530,6 +3031,9 @@ def check_messages(driver, user_id, config=None):
     msg_processing = config.get('message_processing', {})
     operation_logger.info(f"メッセージ処理設定: {msg_processing}")
 
+    # タイトルの振り分け表（設定で無効なメッセージ種別は含まない）
+    router = build_message_router(msg_processing)
+
     # 処理可能なメールタイトルとその設定
     enabled_count = sum(1 for enabled in msg_processing.values() if enabled)
     disabled_count = len(msg_processing) - enabled_count
@@ -1543,6 +3047,7 @@ def check_messages(driver, user_id, config=None):
 
     try:
         wait = WebDriverWait(driver, 10)
+        ensure_main_window(driver)
 
         # 店舗IDを抽出
         store_id = extract_store_id(user_id)
@@ -1551,8 +3056,8 @@ def check_messages(driver, user_id, config=None):
         print(f"\n店舗ID: {store_id}")
 
         # メッセージストックを読み込み（店舗IDごと）
-        message_stock = load_message_stock(store_id)
-        operation_logger.info(f"現在のストック数: {len(message_stock['messages'])}")
+        message_stock = open_message_stock(store_id)
+        operation_logger.info(f"現在のストック数: {len(message_stock['index'])}")
 
         # 受信一覧フレームに切り替え
         operation_logger.info("受信一覧フレームに切り替えます...")
@@ -1575,17 +3080,7 @@ def check_messages(driver, user_id, config=None):
 
         # メッセージ一覧のテーブル行を取得（ヘッダー行を除く）
         try:
-            # デバッグ: テーブルの存在確認
-            tables = driver.find_elements(By.TAG_NAME, "table")
-            operation_logger.info(f"ページ内のテーブル数: {len(tables)}件")
-
-            # テーブルのIDを確認
-            for i, table in enumerate(tables):
-                table_id = table.get_attribute("id")
-                operation_logger.info(f"テーブル{i}: id={table_id}")
-
-            # テーブル内のメッセージ行を取得
-            message_rows = driver.find_elements(By.XPATH, "//table[@id='grdJushin']//tr[position()>2]")
+            message_rows = get_message_list(driver, operation_logger)
             operation_logger.info(f"未読メッセージ: {len(message_rows)}件")
             print(f"未読メッセージ: {len(message_rows)}件")
 
@@ -1596,37 +3091,23 @@ def check_messages(driver, user_id, config=None):
 
             # 処理対象メッセージの件数をカウント
             target_count = 0
+            target_rows = []
             for row in message_rows:
-                try:
-                    title_link = row.find_element(By.XPATH, "./td[3]/a")
-                    title = title_link.text.strip()
-
-                    # タイトルが処理対象かチェック
-                    should_process = False
-
-                    # 「購入伺い」の完全一致チェック
-                    if title == "購入伺い" and msg_processing.get("購入伺い", True):
-                        should_process = True
-                    # 「マッチング：使用期限」の前方一致チェック
-                    elif title.startswith("マッチング：使用期限") and msg_processing.get("マッチング：使用期限", True):
-                        should_process = True
-                    # その他のタイトル（将来の拡張用）
-                    elif title.startswith("不動在庫転送") and msg_processing.get("不動在庫転送", True):
-                        should_process = True
-                    elif title.startswith("Re:") and msg_processing.get("返信", True):
-                        should_process = True
-
-                    if not should_process:
-                        operation_logger.info(f"スキップ: {title} (設定で無効)")
-                        continue
+                title = row['title']
 
-                    target_count += 1
-                    operation_logger.info(f"処理対象メッセージを発見: {title}")
-                    if target_count >= max_message_count:  # 設定された最大件数
-                        break
-                except:
+                # タイトルが処理対象かチェック
+                rule = classify_message(router, title)
+                if not rule:
+                    operation_logger.info(f"スキップ: {title} (設定で無効)")
                     continue
 
+                row['rule'] = rule
+                target_count += 1
+                target_rows.append(row)
+                operation_logger.info(f"処理対象メッセージを発見: {title}")
+                if target_count >= max_message_count:  # 設定された最大件数
+                    break
+
             if target_count == 0:
                 operation_logger.info("処理対象メッセージが見つかりませんでした")
                 print("処理対象メッセージが見つかりませんでした")
@@ -1635,309 +3116,201 @@ def check_messages(driver, user_id, config=None):
             operation_logger.info(f"処理対象メッセージ: {target_count}件")
             print(f"\n処理対象メッセージ: {target_count}件")
 
-            # 各メッセージを順番に処理（F5リロードで画面更新）
+            # メッセージの開き方
+            #   click: 一覧のリンクをクリックして開く（メッセージごとにF5リロード、既定）
+            #   direct: 処理の直前にメッセージIDを取得し、詳細画面をURLで直接開く（リロード不要）
+            #           IDの取得はポストバックをHTTPで再現するため、本番で確認できるまでは設定で選んだ場合だけ使う
+            open_mode = config.get('message_open_mode', 'click')
+            # 購入伺いは本文だけが必要なため、設定した場合はブラウザを使わずにHTTPで取得する
+            # （続く購入伺いを先に取得して既読にするため、既定では使わない）
+            fetch_bodies = config.get('message_fetch_mode', 'browser') == "http"
+            fetch_workers = config.get('message_fetch_workers', 4)
+
+            # 各メッセージを順番に処理
             for idx in range(1, target_count + 1):
                 operation_logger.info(f"========== メッセージ {idx}/{target_count} の処理開始 ==========")
                 print(f"\n========== メッセージ {idx}/{target_count} の処理開始 ==========")
 
-                # 2件目以降はF5でリロード（DOM要素をリフレッシュ）
-                if idx > 1:
+                if open_mode == "direct" and not target_rows[idx - 1].get('prepared'):
                     try:
-                        operation_logger.debug(f"メッセージ {idx} 処理前: F5リロード実行")
-
-                        # メインコンテンツに戻る
-                        driver.switch_to.default_content()
-
-                        # driver.refresh()を使用（F5と同等）
-                        driver.refresh()
-                        time.sleep(3)  # リロード完了待機
-
-                        # 再度フレームに切り替え
-                        driver.switch_to.frame("Itiran")
-                        time.sleep(1)
-
-                        operation_logger.info("✓ ページをリロードしました")
-                        print("✓ ページをリロードしました")
+                        ready = prepare_next_messages(driver, target_rows[idx - 1:], fetch_bodies, fetch_workers,
+                                                      operation_logger)
                     except Exception as e:
-                        operation_logger.error(f"リロードエラー: {e}")
-                        print(f"⚠️ リロードに失敗しました")
-                        continue
-
-                # メッセージリストを再取得
-                try:
-                    message_rows = driver.find_elements(By.XPATH, "//table[@id='grdJushin']//tr[position()>2]")
-
-                    # 最初の処理対象メッセージを探す
-                    row = None
-                    for msg_row in message_rows:
-                        try:
-                            title_link = msg_row.find_element(By.XPATH, "./td[3]/a")
-                            title = title_link.text.strip()
-
-                            # タイトルが処理対象かチェック
-                            should_process = False
-
-                            # 「購入伺い」の完全一致チェック
-                            if title == "購入伺い" and msg_processing.get("購入伺い", True):
-                                should_process = True
-                            # 「マッチング：使用期限」の前方一致チェック
-                            elif title.startswith("マッチング：使用期限") and msg_processing.get("マッチング：使用期限", True):
-                                should_process = True
-                            # その他のタイトル
-                            elif title.startswith("不動在庫転送") and msg_processing.get("不動在庫転送", True):
-                                should_process = True
-                            elif title.startswith("Re:") and msg_processing.get("返信", True):
-                                should_process = True
-
-                            if should_process:
-                                row = msg_row
-                                break
-                        except:
-                            continue
+                        operation_logger.warning(f"メッセージIDの取得エラー: {e}")
+                        ready = False
+                    if not ready:
+                        operation_logger.warning(f"メッセージ {idx} のIDを取得できなかったため、以降はクリックで開きます")
+                        open_mode = "click"
+
+                # メッセージ詳細のウィンドウを開くかどうか（本文をHTTPで取得済みの場合は開かない）
+                detail_window = True
+                message_window = None
+                message_content = None
+                main_window = None
 
-                    if not row:
-                        operation_logger.warning(f"メッセージ {idx} が見つかりません（スキップ）")
-                        print(f"⚠️ メッセージ {idx} が見つかりません（スキップ）")
+                if open_mode == "direct" and target_rows[idx - 1].get('content') is not None:
+                    row = target_rows[idx - 1]
+                    received_datetime = row['received']
+                    title = row['title']
+                    sender = row['sender']
+                    message_id = row['target_id']
+                    message_content = row['content']
+                    detail_window = False
+
+                    operation_logger.info(f"処理対象メッセージ: {title}（本文取得済み）")
+                    operation_logger.info(f"  受信日時: {received_datetime}")
+                    operation_logger.info(f"  送信者: {sender}")
+                    operation_logger.info(f"メッセージID: {message_id}")
+                    print(f"\n処理対象メッセージ:")
+                    print(f"  タイトル: {title}")
+                    print(f"  受信日時: {received_datetime}")
+                    print(f"  送信者: {sender}")
+
+                elif open_mode == "direct":
+                    row = target_rows[idx - 1]
+                    received_datetime = row['received']
+                    title = row['title']
+                    sender = row['sender']
+                    message_id = row['target_id']
+
+                    # 出庫処理の後などで一覧から離れている場合に備えて受信一覧フレームに戻る
+                    if not switch_to_message_list(driver, operation_logger):
+                        operation_logger.warning(f"メッセージ {idx}: 受信一覧に戻れませんでした（スキップ）")
+                        print(f"⚠️ メッセージ {idx}: 受信一覧に戻れませんでした（スキップ）")
                         continue
 
-                    # 受信日時を取得
-                    date_cell = row.find_element(By.XPATH, "./td[2]")
-                    received_datetime = date_cell.text.strip()
+                    operation_logger.info(f"処理対象メッセージ: {title}")
+                    operation_logger.info(f"  受信日時: {received_datetime}")
+                    operation_logger.info(f"  送信者: {sender}")
+                    print(f"\n処理対象メッセージ:")
+                    print(f"  タイトル: {title}")
+                    print(f"  受信日時: {received_datetime}")
+                    print(f"  送信者: {sender}")
+
+                    # メインウィンドウ（ログイン時に記録済み）
+                    main_window = ensure_main_window(driver)
+
+                    # メッセージ詳細をURLで直接開く（新しいウィンドウ）
+                    message_window = open_message_window(driver, get_message_detail_url(driver, message_id), 5,
+                                                         operation_logger)
+                    if not message_window:
+                        operation_logger.warning(f"メッセージ {idx} を開けませんでした（スキップ）")
+                        print(f"⚠️ メッセージ {idx} を開けませんでした（スキップ）")
+                        continue
 
-                    # タイトルリンクを取得
-                    title_link = row.find_element(By.XPATH, "./td[3]/a")
-                    title = title_link.text.strip()
+                else:
+                    # 2件目以降はF5でリロード（DOM要素をリフレッシュ）
+                    if idx > 1:
+                        try:
+                            operation_logger.debug(f"メッセージ {idx} 処理前: F5リロード実行")
 
-                    # 送信者を取得
-                    sender_cell = row.find_element(By.XPATH, "./td[4]")
-                    sender = sender_cell.text.strip()
-                except Exception as e:
-                    operation_logger.error(f"メッセージ {idx} の情報取得エラー: {e}")
-                    print(f"⚠️ メッセージ {idx} の情報取得に失敗しました")
-                    continue
+                            # メインコンテンツに戻る
+                            driver.switch_to.default_content()
 
-                # メッセージIDを取得（リンクのonclick属性から抽出）
-                onclick_attr = title_link.get_attribute("onclick")
-                # 例: __doPostBack('grdJushin$_ctl3$_ctl0','')
-                message_id = None
-                if onclick_attr:
-                    # URLパラメータにIDが含まれる可能性があるため、後でウィンドウから取得
-                    pass
+                            # driver.refresh()を使用（F5と同等）
+                            driver.refresh()
+                            time.sleep(3)  # リロード完了待機
 
-                operation_logger.info(f"処理対象メッセージ: {title}")
-                operation_logger.info(f"  受信日時: {received_datetime}")
-                operation_logger.info(f"  送信者: {sender}")
-                print(f"\n処理対象メッセージ:")
-                print(f"  タイトル: {title}")
-                print(f"  受信日時: {received_datetime}")
-                print(f"  送信者: {sender}")
-
-                # 現在のウィンドウハンドルを保存
-                main_window = driver.current_window_handle
-
-                # タイトルリンクをクリック（新しいウィンドウで開く）
-                safe_click(driver, title_link, "メッセージ詳細", 2, operation_logger)
-
-                # 新しいウィンドウに切り替え
-                all_windows = driver.window_handles
-                for window in all_windows:
-                    if window != main_window:
-                        driver.switch_to.window(window)
-                        break
+                            # 再度フレームに切り替え
+                            driver.switch_to.frame("Itiran")
+                            time.sleep(1)
 
-                # URLからメッセージIDを取得
-                current_url = driver.current_url
-                operation_logger.info(f"メッセージURL: {current_url}")
+                            operation_logger.info("✓ ページをリロードしました")
+                            print("✓ ページをリロードしました")
+                        except Exception as e:
+                            operation_logger.error(f"リロードエラー: {e}")
+                            print(f"⚠️ リロードに失敗しました")
+                            continue
 
-                # URLパラメータからtarget値を抽出
-                target_match = re.search(r'target=(\d+)', current_url)
-                if target_match:
-                    message_id = target_match.group(1)
-                    operation_logger.info(f"メッセージID: {message_id}")
+                    # メッセージリストを再取得
+                    try:
+                        message_rows = get_message_list(driver, operation_logger)
 
-                # タイトルに応じて処理を分岐
-                if title == "購入伺い":
-                    # 購入伺いメッセージ：医薬品情報を抽出してストック保存
-                    operation_logger.info("「購入伺い」メッセージを処理します")
-                    print("\n「購入伺い」メッセージを処理します")
-
-                    # メッセージ本文を取得
-                    safe_wait(1, "メッセージ本文読み込み待機", operation_logger)
-                    body_element = driver.find_element(By.TAG_NAME, "body")
-                    message_content = body_element.text
-
-                    operation_logger.info("メッセージ本文:")
-                    operation_logger.info("-" * 50)
-                    operation_logger.info(message_content)
-                    operation_logger.info("-" * 50)
-
-                    print("\nメッセージ本文:")
-                    print("-" * 50)
-                    print(message_content)
-                    print("-" * 50)
-
-                    # メッセージ本文をパース（複数ロット対応）
-                    parsed_data_list = parse_message_content(message_content)
-
-                    if parsed_data_list:
-                        operation_logger.info(f"抽出されたデータ: {len(parsed_data_list)}件のロット")
-                        print(f"\n抽出されたデータ: {len(parsed_data_list)}件のロット")
-
-                        # 各ロットをストックに保存
-                        saved_count = 0
-                        for lot_idx, parsed_data in enumerate(parsed_data_list, 1):
-                            operation_logger.info(f"  [{lot_idx}] 送信店舗: {parsed_data['sender_store']}")
-                            operation_logger.info(f"      医薬品名: {parsed_data['medicine_name']}")
-                            operation_logger.info(f"      数量: {parsed_data['quantity']}")
-                            operation_logger.info(f"      単位: {parsed_data['unit']}")
-                            operation_logger.info(f"      使用期限: {parsed_data['expiry_date']}")
-
-                            print(f"  [{lot_idx}] 送信店舗: {parsed_data['sender_store']}")
-                            print(f"      医薬品名: {parsed_data['medicine_name']}")
-                            print(f"      数量: {parsed_data['quantity']}")
-                            print(f"      単位: {parsed_data['unit']}")
-                            print(f"      使用期限: {parsed_data['expiry_date']}")
-
-                            # メッセージストックに保存（重複チェック）
-                            if message_id:
-                                # 重複チェック（メッセージID + 医薬品名 + 使用期限で判定）
-                                lot_key = f"{message_id}_{parsed_data['medicine_name']}_{parsed_data['expiry_date']}"
-                                existing = [m for m in message_stock['messages']
-                                           if m.get('message_id') == message_id
-                                           and m.get('medicine_name') == parsed_data['medicine_name']
-                                           and m.get('expiry_date') == parsed_data['expiry_date']]
-
-                                if not existing:
-                                    new_message = {
-                                        'message_id': message_id,
-                                        'lot_key': lot_key,
-                                        'received_datetime': received_datetime,
-                                        'title': title,
-                                        'sender': sender,
-                                        'sender_store': parsed_data['sender_store'],
-                                        'medicine_name': parsed_data['medicine_name'],
-                                        'quantity': parsed_data['quantity'],
-                                        'unit': parsed_data['unit'],
-                                        'expiry_date': parsed_data['expiry_date'],
-                                        'status': 'unprocessed',
-                                        'created_at': datetime.now().isoformat()
-                                    }
-
-                                    message_stock['messages'].append(new_message)
-                                    saved_count += 1
-                                else:
-                                    operation_logger.info(f"      → このロットは既にストックに存在します")
-                                    print(f"      → このロットは既にストックに存在します")
-
-                        if saved_count > 0:
-                            save_message_stock(message_stock, store_id)
-                            operation_logger.info(f"✓ メッセージをストックに保存しました（{saved_count}件のロット）")
-                            print(f"\n✓ メッセージをストックに保存しました（{saved_count}件のロット）")
-                        else:
-                            operation_logger.info("全てのロットが既にストックに存在します")
-                            print("\n全てのロットが既にストックに存在します")
-                    else:
-                        operation_logger.warning("メッセージのパースに失敗しました")
-                        print("\n⚠️ メッセージのパースに失敗しました")
+                        # 最初の処理対象メッセージを探す
+                        row = None
+                        for msg_row in message_rows:
+                            rule = classify_message(router, msg_row['title'])
+                            if rule:
+                                row = msg_row
+                                row['rule'] = rule
+                                break
 
-                elif title.startswith("マッチング：使用期限"):
-                    # マッチングメッセージ：出庫処理を自動実行（最大3回リトライ）
-                    operation_logger.info("「マッチング：使用期限」メッセージを処理します")
-                    print("\n「マッチング：使用期限」メッセージを処理します")
+                        if not row:
+                            operation_logger.warning(f"メッセージ {idx} が見つかりません（スキップ）")
+                            print(f"⚠️ メッセージ {idx} が見つかりません（スキップ）")
+                            continue
 
-                    max_retries = 3
-                    success = False
+                        received_datetime = row['received']
+                        title_link = row['link']
+                        title = row['title']
+                        sender = row['sender']
+                    except Exception as e:
+                        operation_logger.error(f"メッセージ {idx} の情報取得エラー: {e}")
+                        print(f"⚠️ メッセージ {idx} の情報取得に失敗しました")
+                        continue
 
-                    for retry_count in range(max_retries):
-                        try:
-                            if retry_count > 0:
-                                operation_logger.info(f"リトライ {retry_count}/{max_retries - 1} を実行します...")
-                                print(f"\nリトライ {retry_count}/{max_retries - 1} を実行します...")
-                                safe_wait(3, "リトライ前待機", operation_logger)
-                            else:
-                                # 初回のみ：出庫処理リンクをクリック（このクリックでメッセージウィンドウが閉じる）
-                                safe_wait(1, "出庫処理ボタン検索前", operation_logger)
-
-                                operation_logger.info(f"出庫処理ボタン（lnkSyukko）を探します...")
-                                if not safe_find_and_click(driver, By.ID, "lnkSyukko", "出庫処理ボタン", 2, operation_logger):
-                                    raise Exception("出庫処理ボタンのクリックに失敗")
-
-                                # 出庫処理ボタンをクリックするとメッセージウィンドウが閉じて
-                                # メインウィンドウに出庫画面が表示される
-                                operation_logger.info("メインウィンドウに切り替えます...")
-                                safe_wait(2, "ウィンドウ切り替え待機", operation_logger)
-
-                                # メインウィンドウに切り替え
-                                try:
-                                    driver.switch_to.window(main_window)
-                                    operation_logger.info("メインウィンドウに切り替わりました")
-                                except Exception as e:
-                                    operation_logger.warning(f"メインウィンドウ切り替えエラー: {e}")
-                                    # フォールバック：最初のウィンドウに切り替え
-                                    windows = driver.window_handles
-                                    if windows:
-                                        driver.switch_to.window(windows[0])
-                                        operation_logger.info("最初のウィンドウに切り替えました")
-
-                                # 出庫画面への遷移を確認（ページ読み込み完了＋ボタン存在確認）
-                                if not wait_for_shipping_screen(driver, operation_logger, timeout=15):
-                                    raise Exception("出庫画面への遷移がタイムアウトしました")
-
-                            # 再計算ボタンをクリック
-                            operation_logger.info(f"再計算ボタン（btnRecalc）を探します...")
-                            if not safe_find_and_click(driver, By.ID, "btnRecalc", "再計算ボタン", 3, operation_logger):
-                                # ボタンが見つからない場合、初回のみページ構造を調査
-                                if retry_count == 0:
-                                    operation_logger.warning("再計算ボタンが見つかりません。ページ構造を調査します...")
-                                    try:
-                                        from debug_page_structure import debug_page_structure
-                                        debug_page_structure(driver, operation_logger)
-                                    except Exception as e:
-                                        operation_logger.warning(f"ページ構造調査エラー: {e}")
-                                raise Exception("再計算ボタンのクリックに失敗")
-
-                            # 出庫するボタンをクリック
-                            operation_logger.info(f"出庫するボタン（btnSyuko）を探します...")
-                            if not safe_find_and_click(driver, By.ID, "btnSyuko", "出庫するボタン", 2, operation_logger):
-                                raise Exception("出庫するボタンのクリックに失敗")
-
-                            # アラート（確認ダイアログ）の処理
-                            try:
-                                alert = driver.switch_to.alert
-                                alert_text = alert.text
-                                operation_logger.info(f"確認ダイアログ: {alert_text}")
-                                print(f"確認ダイアログ: {alert_text}")
-                                alert.accept()  # OKをクリック
-                                time.sleep(2)
-                                operation_logger.info("✓ 出庫処理が完了しました")
-                                print("\n✓ 出庫処理が完了しました")
-                                success = True
-                                break
-                            except:
-                                # アラートがない場合も成功とみなす
-                                operation_logger.info("✓ 出庫処理が完了しました（確認ダイアログなし）")
-                                print("\n✓ 出庫処理が完了しました")
-                                success = True
-                                break
+                    # メッセージIDを取得（一覧にID付きのURLがある場合。無い場合は後でウィンドウのURLから取得）
+                    # 例: __doPostBack('grdJushin$_ctl3$_ctl0','') はIDを含まない
+                    message_id = row['target_id']
+
+                    operation_logger.info(f"処理対象メッセージ: {title}")
+                    operation_logger.info(f"  受信日時: {received_datetime}")
+                    operation_logger.info(f"  送信者: {sender}")
+                    print(f"\n処理対象メッセージ:")
+                    print(f"  タイトル: {title}")
+                    print(f"  受信日時: {received_datetime}")
+                    print(f"  送信者: {sender}")
+
+                    # メインウィンドウ（ログイン時に記録済み）
+                    main_window = ensure_main_window(driver)
+
+                    # タイトルリンクをクリック（新しいウィンドウで開く）
+                    windows_before = driver.window_handles
+                    safe_click(driver, title_link, "メッセージ詳細", 2, operation_logger,
+                               until=new_window_opened())
+                    new_windows = track_new_windows(driver, windows_before, "メッセージ", "check_messages")
+                    message_window = new_windows[-1] if new_windows else None
+
+                if detail_window:
+                    # 開いたメッセージウィンドウに切り替え（他のポップアップをメッセージと取り違えない）
+                    if not message_window:
+                        operation_logger.warning(f"メッセージ {idx} のウィンドウが開きませんでした（スキップ）")
+                        print(f"⚠️ メッセージ {idx} のウィンドウが開きませんでした（スキップ）")
+                        continue
+                    driver.switch_to.window(message_window)
 
-                        except Exception as e:
-                            operation_logger.error(f"出庫処理エラー (試行 {retry_count + 1}/{max_retries}): {e}")
-                            print(f"\n⚠️ 出庫処理に失敗しました (試行 {retry_count + 1}/{max_retries}): {e}")
+                    # URLからメッセージIDを取得
+                    current_url = driver.current_url
+                    operation_logger.info(f"メッセージURL: {current_url}")
 
-                            if retry_count < max_retries - 1:
-                                operation_logger.info("待機時間を3秒に延長してリトライします...")
-                                print("待機時間を3秒に延長してリトライします...")
-                            else:
-                                operation_logger.error("最大リトライ回数に達しました。このメッセージの処理をスキップします。")
-                                print("\n⚠️ 最大リトライ回数に達しました。このメッセージの処理をスキップします。")
+                    # URLパラメータからtarget値を抽出
+                    target_match = re.search(r'target=(\d+)', current_url)
+                    if target_match:
+                        message_id = target_match.group(1)
+                    if message_id:
+                        operation_logger.info(f"メッセージID: {message_id}")
 
-                    if not success:
-                        operation_logger.warning("出庫処理が完了できませんでした")
-                        print("\n⚠️ 出庫処理が完了できませんでした")
+                # タイトルに応じて処理を分岐
+                # タイトルに応じた処理を実行
+                message = {
+                    'title': title,
+                    'sender': sender,
+                    'received': received_datetime,
+                    'message_id': message_id,
+                    'content': message_content,
+                    'main_window': main_window
+                }
+                handler = MESSAGE_HANDLERS.get(row['rule']['kind'])
+                if handler:
+                    with span(title, "message", driver, kind=row['rule']['kind']):
+                        handler(driver, message, message_stock, operation_logger)
 
                 # ウィンドウ処理：マッチング処理ではメッセージウィンドウは既に閉じられている
                 # それ以外の場合はメッセージウィンドウを閉じる
-                if not title.startswith("マッチング：使用期限"):
+                if not detail_window:
+                    # ウィンドウを開いていない（本文をHTTPで取得した）
+                    pass
+                elif not row['rule']['closes_window']:
                     try:
                         # メッセージウィンドウを閉じる
                         driver.close()
@@ -1947,15 +3320,17 @@ def check_messages(driver, user_id, config=None):
                         operation_logger.warning(f"ウィンドウクローズエラー: {e}")
                         # エラーが発生した場合はメインウィンドウに切り替え
                         try:
-                            driver.switch_to.window(main_window)
+                            switch_to_main_window(driver)
                         except:
-                            windows = driver.window_handles
-                            if windows:
-                                driver.switch_to.window(windows[0])
+                            pass
                 else:
                     # マッチング処理後は既にメインウィンドウにいるはず
                     operation_logger.info("マッチング処理完了（既にメインウィンドウ）")
 
+            # 直接開いた場合は一覧を最後に1回だけ再読み込み（既読状態を反映）
+            if open_mode == "direct":
+                reload_message_list(driver, operation_logger)
+
             operation_logger.info(f"連絡板メッセージ確認処理が完了しました（{target_count}件処理）")
             operation_logger.info(f"ログファイル: {log_file_path}")
             print(f"\n✓ 連絡板メッセージ確認処理が完了しました（{target_count}件処理）")
@@ -1978,8 +3353,6 @@ def check_messages(driver, user_id, config=None):
     finally:
         # メインウィンドウに戻る
         try:
-            windows = driver.window_handles
-            if windows:
-                driver.switch_to.window(windows[0])
+            switch_to_main_window(driver)
         except:
             pass
@@ -0,0 +1,415 @@
+"""画面の記録（リプレイサーバー用の画面スナップショット）
+
+本番の処理中にクリックなどのステップごとに、全フレームのDOM・URL・ウィンドウハンドル・
+読み込み時間を記録する。フレームの構造とHTMLは execute_script 1回でまとめて取得する
+（フレームの切り替えや get_attribute の往復はしない）。
+
+記録はフォルダ単位のアーカイブに保存する。
+    recordings/rec_YYYYMMDD_HHMMSS/
+        manifest.jsonl                  1行1ステップ（フレーム構造・ウィンドウ・時間）
+        blobs/ab/abcdef....html.gz      フレームのHTML（内容のハッシュ名、gzip圧縮）
+同じ内容のHTML（メニューフレームなど）は1回だけ保存する。
+アーカイブは stub_server.py --snapshots にそのまま指定できる。
+
+使用例:
+    start_recording("recordings")
+    record_step(driver, "印刷ボタン")
+    stop_recording()
+"""
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+from log_setup import get_log_context
+
+ARCHIVE_MANIFEST = "manifest.jsonl"
+ARCHIVE_BLOB_DIR = "blobs"
+
+# 存在と状態を調べる要素のID（出庫画面のボタンなど）
+DEFAULT_TARGET_IDS = ["btnRecalc", "btnSyuko", "btnHatyu", "txtReMark"]
+
+# 最上位のウィンドウから全フレームをたどり、構造（とHTML）を返すスクリプト
+# 現在のフレームに関係なく window.top から調べるため、Selenium のフレーム位置は変わらない
+COLLECT_STRUCTURE_SCRIPT = """
+var includeHtml = arguments[0];
+var targetIds = arguments[1];
+
+function displayed(el) {
+    return !!(el.offsetWidth || el.offsetHeight || el.getClientRects().length);
+}
+
+function describe(win, path, element) {
+    var info = {
+        path: path,
+        id: element ? element.id || null : null,
+        name: element ? element.name || null : null,
+        src: element ? element.getAttribute('src') : null,
+        accessible: true
+    };
+    var doc;
+    try {
+        doc = win.document;
+        info.url = win.location.href;
+    } catch (e) {
+        // 読み込み前・別オリジンのフレーム
+        info.accessible = false;
+        return [info];
+    }
+    info.title = doc.title;
+    info.ready_state = doc.readyState;
+
+    var t = win.performance && win.performance.timing;
+    if (t && t.navigationStart) {
+        info.timing = {
+            response: t.responseEnd - t.navigationStart,
+            dom_ready: t.domContentLoadedEventEnd > 0 ? t.domContentLoadedEventEnd - t.navigationStart : null,
+            load: t.loadEventEnd > 0 ? t.loadEventEnd - t.navigationStart : null
+        };
+    }
+
+    info.targets = {};
+    targetIds.forEach(function(id) {
+        var el = doc.getElementById(id);
+        info.targets[id] = el ? {type: el.type || null, value: el.value || null, displayed: displayed(el)} : null;
+    });
+
+    info.buttons = [];
+    var buttons = doc.querySelectorAll('input[type=submit], input[type=button], button');
+    for (var i = 0; i < buttons.length; i++) {
+        var b = buttons[i];
+        info.buttons.push({
+            id: b.id || null,
+            name: b.name || null,
+            value: b.value || b.textContent || null,
+            displayed: displayed(b)
+        });
+    }
+
+    if (includeHtml && doc.documentElement) {
+        info.html = doc.documentElement.outerHTML;
+    }
+
+    var frames = [info];
+    var children = doc.querySelectorAll('iframe, frame');
+    for (var j = 0; j < children.length; j++) {
+        var child = children[j];
+        var key = child.id || child.name || String(j);
+        if (child.contentWindow) {
+            frames = frames.concat(describe(child.contentWindow, path.concat([key]), child));
+        } else {
+            frames.push({path: path.concat([key]), id: child.id || null, name: child.name || null,
+                         src: child.getAttribute('src'), accessible: false});
+        }
+    }
+    return frames;
+}
+
+return describe(window.top, [], null);
+"""
+
+# 記録の状態（start_recording() で開始）
+_recording = {
+    'archive_dir': None,
+    'origin': None,
+    'steps': 0,
+    'frames': 0,
+    'blobs': 0,
+    'html_bytes': 0,  # 記録したHTMLの合計（重複を含む）
+    'stored_bytes': 0  # 実際に保存したサイズ（圧縮・重複除去後）
+}
+_recording_lock = threading.Lock()
+
+# アーカイブ → 画面の索引（リプレイサーバー用、load_replay_index() で作成）
+_replay_indexes = {}
+
+
+def collect_page_structure(driver, include_html=False, target_ids=None):
+    """全フレームの構造を1回の execute_script で取得
+
+    Args:
+        driver: Seleniumドライバー
+        include_html: 各フレームのHTMLも取得する場合True
+        target_ids: 存在と状態を調べる要素のID（省略時は DEFAULT_TARGET_IDS）
+
+    Returns:
+        list: フレームごとの情報（最初が最上位のページ）。
+              {'path', 'id', 'name', 'src', 'accessible', 'url', 'title', 'ready_state',
+               'timing', 'targets', 'buttons', 'html'}
+    """
+    target_ids = DEFAULT_TARGET_IDS if target_ids is None else target_ids
+    return driver.execute_script(COLLECT_STRUCTURE_SCRIPT, include_html, list(target_ids)) or []
+
+
+def start_recording(record_dir="recordings"):
+    """画面の記録を開始（記録中の場合は現在のアーカイブを返す）
+
+    Args:
+        record_dir: アーカイブを作成するフォルダ
+
+    Returns:
+        str: アーカイブのフォルダ
+    """
+    with _recording_lock:
+        if _recording['archive_dir']:
+            return _recording['archive_dir']
+
+        archive_dir = os.path.join(record_dir, f"rec_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        os.makedirs(os.path.join(archive_dir, ARCHIVE_BLOB_DIR), exist_ok=True)
+        _recording.update({
+            'archive_dir': archive_dir, 'origin': time.perf_counter(),
+            'steps': 0, 'frames': 0, 'blobs': 0, 'html_bytes': 0, 'stored_bytes': 0
+        })
+    return archive_dir
+
+
+def stop_recording():
+    """画面の記録を終了
+
+    Returns:
+        dict: 記録の集計（'archive_dir', 'steps', 'frames', 'blobs', 'html_bytes', 'stored_bytes'）。
+              記録していない場合は None
+    """
+    with _recording_lock:
+        if not _recording['archive_dir']:
+            return None
+        summary = {k: v for k, v in _recording.items() if k != 'origin'}
+        _recording['archive_dir'] = None
+    return summary
+
+
+def is_recording():
+    """画面を記録中かどうか"""
+    return _recording['archive_dir'] is not None
+
+
+def _blob_path(archive_dir, digest):
+    return os.path.join(archive_dir, ARCHIVE_BLOB_DIR, digest[:2], f"{digest}.html.gz")
+
+
+def store_blob(archive_dir, html):
+    """HTMLを内容のハッシュ名で保存（同じ内容が保存済みの場合は書き込まない）
+
+    Returns:
+        tuple: (ハッシュ, 保存したバイト数。保存済みの場合は 0)
+    """
+    data = html.encode('utf-8')
+    digest = hashlib.sha1(data).hexdigest()
+    path = _blob_path(archive_dir, digest)
+    if os.path.exists(path):
+        return digest, 0
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    compressed = gzip.compress(data)
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(compressed)
+    os.replace(temp_path, path)
+    return digest, len(compressed)
+
+
+def read_blob(archive_dir, digest):
+    """保存したHTMLを読み込み（ない場合は None）"""
+    path = _blob_path(archive_dir, digest)
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, 'rb') as f:
+        return f.read().decode('utf-8')
+
+
+def record_step(driver, step, **attrs):
+    """現在の画面を記録する（記録していない場合は何もしない）
+
+    確認ダイアログが表示されている場合はDOMを取得できないため、ダイアログの文言だけを記録する。
+
+    Args:
+        driver: Seleniumドライバー
+        step: ステップ名（「印刷ボタン」など）
+        **attrs: 追加情報
+
+    Returns:
+        dict: 記録した内容。記録していない場合は None
+    """
+    archive_dir = _recording['archive_dir']
+    if not archive_dir:
+        return None
+
+    started = time.perf_counter()
+    store_id, operation = get_log_context()
+    entry = {
+        'step': step,
+        'store_id': store_id,
+        'operation': operation,
+        'thread': threading.get_ident(),
+        'recorded_at': datetime.now().isoformat(),
+        'offset': round(started - _recording['origin'], 3),
+        'attrs': attrs,
+        'alert': None,
+        'windows': None,
+        'current_window': None,
+        'frames': [],
+        'error': None
+    }
+
+    try:
+        entry['alert'] = driver.switch_to.alert.text
+    except Exception:
+        pass
+
+    html_bytes = 0
+    stored_bytes = 0
+    new_blobs = 0
+    if entry['alert'] is None:
+        try:
+            entry['current_window'] = driver.current_window_handle
+            entry['windows'] = driver.window_handles
+            for frame in collect_page_structure(driver, include_html=True):
+                html = frame.pop('html', None)
+                if html is not None:
+                    frame['blob'], written = store_blob(archive_dir, html)
+                    html_bytes += len(html.encode('utf-8'))
+                    stored_bytes += written
+                    new_blobs += 1 if written else 0
+                entry['frames'].append(frame)
+        except Exception as e:
+            entry['error'] = str(e)
+
+    entry['capture_time'] = round(time.perf_counter() - started, 3)
+    line = json.dumps(entry, ensure_ascii=False, default=str)
+    with _recording_lock:
+        if _recording['archive_dir'] != archive_dir:
+            return entry
+        with open(os.path.join(archive_dir, ARCHIVE_MANIFEST), 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+        _recording['steps'] += 1
+        _recording['frames'] += len(entry['frames'])
+        _recording['blobs'] += new_blobs
+        _recording['html_bytes'] += html_bytes
+        _recording['stored_bytes'] += stored_bytes
+    return entry
+
+
+def load_manifest(archive_dir):
+    """アーカイブのステップを読み込み
+
+    Returns:
+        list: ステップのリスト（記録順）
+    """
+    steps = []
+    path = os.path.join(archive_dir, ARCHIVE_MANIFEST)
+    if not os.path.exists(path):
+        return steps
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    steps.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 書き込み途中で終了した最後の行
+                    pass
+    return steps
+
+
+def page_key(url):
+    """URLから画面名とキーを取得（I_Jushin.aspx?target=123 → ("I_Jushin.aspx", "123")）"""
+    parsed = urlparse(url or "")
+    page = parsed.path.rsplit("/", 1)[-1]
+    key = parse_qs(parsed.query).get("target", [None])[0]
+    return page, key
+
+
+def is_archive(path):
+    """記録のアーカイブ（manifest.jsonl のあるフォルダ）かどうか"""
+    return bool(path) and os.path.exists(os.path.join(path, ARCHIVE_MANIFEST))
+
+
+def load_replay_index(archive_dir):
+    """アーカイブから「画面名・キー → HTML」の索引を作成（結果はアーカイブごとに保持）
+
+    同じ画面が何度も記録されている場合は最初に記録したものを使う。
+    キーのない索引 (画面名, None) には、キーに関係なく最初の記録が入る。
+
+    Returns:
+        dict: (画面名, キー) → ハッシュ
+    """
+    index = _replay_indexes.get(archive_dir)
+    if index is not None:
+        return index
+
+    index = {}
+    for entry in load_manifest(archive_dir):
+        for frame in entry.get('frames', []):
+            if not frame.get('blob') or not frame.get('url'):
+                continue
+            page, key = page_key(frame['url'])
+            if not page:
+                continue
+            index.setdefault((page, key), frame['blob'])
+            index.setdefault((page, None), frame['blob'])
+    _replay_indexes[archive_dir] = index
+    return index
+
+
+def load_recorded_page(archive_dir, page, key=None):
+    """アーカイブから画面のHTMLを取得
+
+    Args:
+        archive_dir: アーカイブのフォルダ
+        page: 画面名（I_Jushin.aspx など）
+        key: 画面を区別するキー（メッセージIDなど、省略可）
+
+    Returns:
+        str: HTML。記録がない場合は None
+    """
+    index = load_replay_index(archive_dir)
+    digest = index.get((page, key)) if key else None
+    digest = digest or index.get((page, None))
+    return read_blob(archive_dir, digest) if digest else None
+
+
+def summarize_recording(archive_dir):
+    """アーカイブの内容を集計
+
+    Returns:
+        dict: {'steps', 'pages', 'blobs', 'stored_bytes', 'capture_time'}
+    """
+    steps = load_manifest(archive_dir)
+    pages = {}
+    for entry in steps:
+        for frame in entry.get('frames', []):
+            page, _ = page_key(frame.get('url'))
+            if page:
+                pages[page] = pages.get(page, 0) + 1
+
+    blob_files = []
+    for root, _, files in os.walk(os.path.join(archive_dir, ARCHIVE_BLOB_DIR)):
+        blob_files.extend(os.path.join(root, name) for name in files if name.endswith(".html.gz"))
+
+    return {
+        'steps': len(steps),
+        'pages': pages,
+        'blobs': len(blob_files),
+        'stored_bytes': sum(os.path.getsize(path) for path in blob_files),
+        'capture_time': round(sum(entry.get('capture_time', 0) for entry in steps), 3)
+    }
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="画面記録のアーカイブの内容を表示")
+    parser.add_argument("archive_dir", help="アーカイブのフォルダ（recordings/rec_YYYYMMDD_HHMMSS）")
+    args = parser.parse_args()
+
+    summary = summarize_recording(args.archive_dir)
+    print(f"ステップ数: {summary['steps']} / HTML: {summary['blobs']}件 "
+          f"{summary['stored_bytes'] / 1024:.1f}KB / 記録にかかった時間: {summary['capture_time']:.2f}秒")
+    for page, count in sorted(summary['pages'].items(), key=lambda x: -x[1]):
+        print(f"  {page:<30} {count:>5}回")
+
+
+if __name__ == "__main__":
+    main()
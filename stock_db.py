@@ -0,0 +1,397 @@
+"""SQLiteによるストック保存（メッセージストック・不動医薬品リスト）
+
+店舗ごとのJSONファイルの代わりに、全店舗分を1つのSQLiteデータベースに保存する。
+operations.py の load/save 関数から set_stock_backend("sqlite") で切り替えて使う。
+
+テーブル:
+    messages      - メッセージストック（購入伺いのロット）
+    medicines     - 不動医薬品リスト
+    target_stores - 不動医薬品の送り先店舗と受け入れ可否
+
+使用例:
+    python stock_db.py --migrate                 # data/*.json を取り込む
+    python stock_db.py --expiring 2026/07        # 全店舗の未処理ロット（使用期限 2026/07）
+"""
+import os
+import re
+import glob
+import json
+import sqlite3
+import argparse
+import threading
+
+DEFAULT_DB_PATH = os.path.join("data", "stock.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    store_id TEXT NOT NULL,
+    lot_key TEXT NOT NULL,
+    message_id TEXT,
+    medicine_name TEXT,
+    expiry_date TEXT,
+    status TEXT,
+    received_datetime TEXT,
+    sender_store TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (store_id, lot_key)
+);
+CREATE INDEX IF NOT EXISTS idx_messages_medicine_name ON messages (medicine_name);
+CREATE INDEX IF NOT EXISTS idx_messages_expiry_date ON messages (expiry_date, status);
+CREATE INDEX IF NOT EXISTS idx_messages_status ON messages (status, store_id);
+
+CREATE TABLE IF NOT EXISTS medicines (
+    medicine_id TEXT PRIMARY KEY,
+    store_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    medicine_name TEXT,
+    expiry_date TEXT,
+    status TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_medicines_store_id ON medicines (store_id, seq);
+CREATE INDEX IF NOT EXISTS idx_medicines_medicine_name ON medicines (medicine_name);
+CREATE INDEX IF NOT EXISTS idx_medicines_expiry_date ON medicines (expiry_date, status);
+CREATE INDEX IF NOT EXISTS idx_medicines_status ON medicines (status, store_id);
+
+CREATE TABLE IF NOT EXISTS target_stores (
+    medicine_id TEXT NOT NULL,
+    store_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    status TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (medicine_id, store_id)
+);
+CREATE INDEX IF NOT EXISTS idx_target_stores_store_id ON target_stores (store_id, status);
+"""
+
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+def connect(db_path=DEFAULT_DB_PATH):
+    """データベースに接続（初回はテーブルを作成）
+
+    一括処理では複数のスレッドから使うため、呼び出しごとに接続する。
+
+    Args:
+        db_path: データベースファイルのパス
+
+    Returns:
+        sqlite3.Connection: 接続
+    """
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+
+    with _init_lock:
+        if db_path not in _initialized:
+            # WAL: 書き込み中も他のスレッドから読める
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            conn.commit()
+            _initialized.add(db_path)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _message_row(store_id, message):
+    # lot_key を持たない古いデータは operations.make_lot_key() と同じ形式で補う
+    lot_key = message.get('lot_key') or \
+        f"{message.get('message_id')}_{message.get('medicine_name')}_{message.get('expiry_date')}"
+    return (
+        store_id,
+        lot_key,
+        message.get('message_id'),
+        message.get('medicine_name'),
+        message.get('expiry_date'),
+        message.get('status'),
+        message.get('received_datetime'),
+        message.get('sender_store'),
+        json.dumps(message, ensure_ascii=False)
+    )
+
+
+def load_message_stock(store_id, db_path=DEFAULT_DB_PATH):
+    """メッセージストックを読み込み（JSON版と同じ形式）
+
+    Returns:
+        dict: {"messages": [...]}
+    """
+    conn = connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT data FROM messages WHERE store_id = ? ORDER BY rowid", (store_id,)
+        ).fetchall()
+        return {"messages": [json.loads(row['data']) for row in rows]}
+    finally:
+        conn.close()
+
+
+def save_message_stock(data, store_id, db_path=DEFAULT_DB_PATH):
+    """メッセージストックを保存（店舗分を置き換え、1トランザクション）"""
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute("DELETE FROM messages WHERE store_id = ?", (store_id,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [_message_row(store_id, m) for m in data['messages']]
+            )
+    finally:
+        conn.close()
+
+
+def insert_messages(store_id, messages, db_path=DEFAULT_DB_PATH):
+    """メッセージを追加（登録済みの lot_key は無視）
+
+    Returns:
+        int: 追加した件数
+    """
+    conn = connect(db_path)
+    try:
+        with conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [_message_row(store_id, m) for m in messages]
+            )
+            return conn.total_changes - before
+    finally:
+        conn.close()
+
+
+def load_immobile_stock(store_id, db_path=DEFAULT_DB_PATH):
+    """不動医薬品リストを読み込み（JSON版と同じ形式）
+
+    Returns:
+        dict: {"medicines": [...]}
+    """
+    conn = connect(db_path)
+    try:
+        medicines = []
+        by_id = {}
+        for row in conn.execute(
+                "SELECT medicine_id, data FROM medicines WHERE store_id = ? ORDER BY seq", (store_id,)):
+            medicine = json.loads(row['data'])
+            medicine['target_stores'] = []
+            medicines.append(medicine)
+            by_id[row['medicine_id']] = medicine
+
+        for row in conn.execute(
+                "SELECT t.medicine_id, t.data FROM target_stores t "
+                "JOIN medicines m ON m.medicine_id = t.medicine_id "
+                "WHERE m.store_id = ? ORDER BY t.medicine_id, t.seq", (store_id,)):
+            by_id[row['medicine_id']]['target_stores'].append(json.loads(row['data']))
+
+        return {"medicines": medicines}
+    finally:
+        conn.close()
+
+
+def save_immobile_stock(data, store_id, db_path=DEFAULT_DB_PATH):
+    """不動医薬品リストを保存（店舗分を置き換え、1トランザクション）
+
+    Raises:
+        sqlite3.IntegrityError: 薬品ID、または同じ薬品の送り先店舗が重複している場合
+    """
+    medicine_rows = []
+    target_rows = []
+    for seq, medicine in enumerate(data['medicines']):
+        record = {k: v for k, v in medicine.items() if k != 'target_stores'}
+        medicine_rows.append((
+            medicine['medicine_id'],
+            store_id,
+            seq,
+            medicine.get('medicine_name'),
+            medicine.get('expiry_date'),
+            medicine.get('status'),
+            json.dumps(record, ensure_ascii=False)
+        ))
+        for target_seq, target in enumerate(medicine.get('target_stores', [])):
+            target_rows.append((
+                medicine['medicine_id'],
+                target.get('store_id'),
+                target_seq,
+                target.get('status'),
+                json.dumps(target, ensure_ascii=False)
+            ))
+
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute(
+                "DELETE FROM target_stores WHERE medicine_id IN "
+                "(SELECT medicine_id FROM medicines WHERE store_id = ?)", (store_id,))
+            conn.execute("DELETE FROM medicines WHERE store_id = ?", (store_id,))
+            # 薬品ID・送り先店舗が重複している場合は上書きせずにエラーにする（ロールバック）
+            conn.executemany("INSERT INTO medicines VALUES (?, ?, ?, ?, ?, ?, ?)", medicine_rows)
+            conn.executemany("INSERT INTO target_stores VALUES (?, ?, ?, ?, ?)", target_rows)
+    finally:
+        conn.close()
+
+
+def make_unique_medicine_ids(data):
+    """重複している薬品IDに連番を付け、同じ薬品の重複した送り先店舗を除く
+
+    JSON版では同じ秒に追加した薬品が同じIDになることがあったため、取り込み時に直す。
+    送り先店舗は最初のものを残す（JSON版のステータス更新と同じ）。
+
+    Returns:
+        int: 直した件数
+    """
+    fixed = 0
+    seen_ids = set()
+    for medicine in data['medicines']:
+        base = medicine['medicine_id']
+        medicine_id = base
+        n = 2
+        while medicine_id in seen_ids:
+            medicine_id = f"{base}_{n}"
+            n += 1
+        if medicine_id != base:
+            medicine['medicine_id'] = medicine_id
+            fixed += 1
+        seen_ids.add(medicine_id)
+
+        targets = []
+        seen_stores = set()
+        for target in medicine.get('target_stores', []):
+            if target.get('store_id') in seen_stores:
+                fixed += 1
+                continue
+            seen_stores.add(target.get('store_id'))
+            targets.append(target)
+        if 'target_stores' in medicine:
+            medicine['target_stores'] = targets
+    return fixed
+
+
+def update_target_stores(store_id, updates, responded_at, db_path=DEFAULT_DB_PATH):
+    """送り先店舗のステータスをまとめて更新（1トランザクション）
+
+    Args:
+        store_id: 自店舗ID（4桁）
+        updates: (薬品ID, 送り先店舗ID, ステータス[, 返信メッセージID]) のリスト
+        responded_at: 返信日時
+
+    Returns:
+        int: 更新した件数
+    """
+    conn = connect(db_path)
+    try:
+        updated = 0
+        with conn:
+            for update in updates:
+                medicine_id, target_store_id, status = update[:3]
+                message_id = update[3] if len(update) > 3 else None
+
+                row = conn.execute(
+                    "SELECT t.data FROM target_stores t "
+                    "JOIN medicines m ON m.medicine_id = t.medicine_id "
+                    "WHERE m.store_id = ? AND t.medicine_id = ? AND t.store_id = ?",
+                    (store_id, medicine_id, target_store_id)).fetchone()
+                if row is None:
+                    continue
+
+                target = json.loads(row['data'])
+                target['status'] = status
+                target['responded_at'] = responded_at
+                if message_id:
+                    target['response_message_id'] = message_id
+
+                conn.execute(
+                    "UPDATE target_stores SET status = ?, data = ? WHERE medicine_id = ? AND store_id = ?",
+                    (status, json.dumps(target, ensure_ascii=False), medicine_id, target_store_id))
+                updated += 1
+        return updated
+    finally:
+        conn.close()
+
+
+def find_expiring_lots(expiry_month, status="unprocessed", db_path=DEFAULT_DB_PATH):
+    """全店舗のメッセージストックから使用期限が指定月のロットを検索
+
+    Args:
+        expiry_month: 使用期限（例: "2026/07"）
+        status: ステータス（None の場合は全ステータス）
+
+    Returns:
+        list: ロットのリスト（store_id を含む）
+    """
+    conn = connect(db_path)
+    try:
+        query = "SELECT store_id, data FROM messages WHERE expiry_date = ?"
+        params = [expiry_month]
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        query += " ORDER BY store_id, medicine_name"
+
+        lots = []
+        for row in conn.execute(query, params):
+            lot = json.loads(row['data'])
+            lot['store_id'] = row['store_id']
+            lots.append(lot)
+        return lots
+    finally:
+        conn.close()
+
+
+def migrate_json_stock(data_dir="data", db_path=DEFAULT_DB_PATH):
+    """店舗ごとのJSONファイル（ジャーナルを含む）をデータベースに取り込む
+
+    Returns:
+        dict: 取り込んだ店舗数
+    """
+    # 循環importを避けるためここで読み込む
+    from operations import read_message_journal
+
+    counts = {'message_stores': 0, 'immobile_stores': 0}
+
+    for stock_file in glob.glob(os.path.join(data_dir, "message_stock_*.json")):
+        store_id = re.search(r'message_stock_(.+)\.json$', stock_file).group(1)
+        with open(stock_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        journal_file = os.path.join(data_dir, f"message_stock_{store_id}.journal.jsonl")
+        data['messages'].extend(read_message_journal(journal_file))
+        save_message_stock(data, store_id, db_path)
+        counts['message_stores'] += 1
+
+    for stock_file in glob.glob(os.path.join(data_dir, "immobile_stock_*.json")):
+        store_id = re.search(r'immobile_stock_(.+)\.json$', stock_file).group(1)
+        with open(stock_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        fixed = make_unique_medicine_ids(data)
+        if fixed:
+            print(f"⚠️ {store_id}: 重複していた薬品ID・送り先店舗 {fixed}件を直して取り込みます")
+        save_immobile_stock(data, store_id, db_path)
+        counts['immobile_stores'] += 1
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ストックデータベースの管理")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="データベースファイル")
+    parser.add_argument("--migrate", action="store_true", help="data/*.json を取り込む")
+    parser.add_argument("--expiring", metavar="YYYY/MM", help="使用期限が指定月の未処理ロットを表示")
+    args = parser.parse_args()
+
+    if args.migrate:
+        counts = migrate_json_stock(db_path=args.db)
+        print(f"✓ 取り込みました: メッセージストック {counts['message_stores']}店舗 / "
+              f"不動医薬品リスト {counts['immobile_stores']}店舗")
+
+    if args.expiring:
+        lots = find_expiring_lots(args.expiring, db_path=args.db)
+        print(f"使用期限 {args.expiring} の未処理ロット: {len(lots)}件")
+        for lot in lots:
+            print(f"  {lot['store_id']} {lot['medicine_name']} {lot['quantity']}{lot['unit']} "
+                  f"（{lot.get('sender_store') or '-'}）")
+
+
+if __name__ == "__main__":
+    main()
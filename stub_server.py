@@ -0,0 +1,397 @@
+"""Medicom スタブサーバー（検証・ベンチマーク用のリプレイサーバー）
+
+本番のMedicomに接続せずに一括処理（batch_runner.py）を検証・計測するための
+ローカルHTTPサーバー。Sample/main.html と同じ構造の受信一覧、メッセージ詳細、
+棚卸・発注・出庫画面、確認ダイアログ、PDF（ダミー）を返す。
+
+- 記録した画面（スナップショット）があればそれを返す（--snapshots）。
+  画面名.html のフォルダか、page_recorder の記録アーカイブ（recordings/rec_...）を指定する
+- 画面ごとの応答遅延を入れられる（--latency I_JushinList.aspx=0.3）
+- 棚卸・発注の集計時間を再現できる（--tally-delay 5: 印刷ボタンが5秒後に現れる）
+
+使用例:
+    python stub_server.py --port 8765 --tally-delay 3 --latency-all 0.05
+    python batch_runner.py --operations check_messages \
+        --login-url http://127.0.0.1:8765/medicom/LoginTop.aspx
+"""
+import os
+import re
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from page_recorder import is_archive, load_recorded_page
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Sample")
+
+LOGIN_PAGE = """<html><head><title>Medicom ログイン</title></head>
+<body>
+<form method="post" action="LoginTop.aspx">
+  <span id="lblErr" style="color:Red;">{error}</span><br>
+  <input type="text" id="txtUser" name="txtUser">
+  <input type="password" id="txtPass" name="txtPass">
+  <input type="submit" id="btnLogin" name="btnLogin" value="ログイン">
+</form>
+</body></html>"""
+
+HOME_PAGE = """<html><head><title>Medicom メインメニュー</title></head>
+<body>
+<iframe id="menuFrame" name="menuFrame" src="Menu.aspx" width="900" height="120"></iframe>
+<iframe id="Itiran" name="Itiran" src="I_JushinList.aspx" width="1000" height="600"></iframe>
+</body></html>"""
+
+MENU_PAGE = """<html><body>
+<input type="image" src="img/00_getuji.gif" alt="月次処理" onclick="location.href='Getuji.aspx'; return false;">
+<input type="image" src="img/00_hattyu.gif" alt="発注" onclick="location.href='Hattyu.aspx'; return false;">
+<input type="button" id="btnLogout" value="ログアウト"
+       onclick="if (confirm('ログアウトしますか？')) { parent.location.href='LoginTop.aspx'; }">
+</body></html>"""
+
+MESSAGE_PAGE = """<html><head><title>受信メッセージ</title></head>
+<body><pre>
+******************************
+*  ツルハドラッグ　スタブ店
+******************************
+購入伺い（メッセージID: {target}）
+----------------------------------------
+薬品名                          数量 単位
+使用期限
+----------------------------------------
+ロキソプロフェンNa錠60mg「サワイ」  100 錠
+ 2026/07
+アムロジピン錠5mg「トーワ」  30 錠
+ 2026/09
+----------------------------------------
+</pre></body></html>"""
+
+
+MATCHING_PAGE = """<html><head><title>受信メッセージ</title></head>
+<body><pre>
+{title}
+下記の医薬品が使用期限の近い在庫とマッチングしました。
+</pre>
+<a id="lnkSyukko" href="#"
+   onclick="window.opener.top.location.href='/medicom/Syukko.aspx'; window.close(); return false;">出庫処理</a>
+</body></html>"""
+
+# 戻るボタン（メインメニューに戻る）
+BACK_BUTTON = """<input type="button" value="戻る" onclick="top.location.href='HomeMain.aspx';">"""
+
+# 印刷ボタン（集計時間の経過後に表示。確認ダイアログの後、PDFを別ウィンドウで開く）
+PRINT_BUTTON_SCRIPT = """<div id="printArea"></div>
+<script>
+setTimeout(function () {{
+    document.getElementById('printArea').innerHTML =
+        '<input type="button" value="印刷" onclick="if (confirm(\\'印刷しますか？\\')) ' +
+        '{{ window.open(\\'/pdf/{report}.pdf\\'); }}">';
+}}, {delay_ms});
+</script>"""
+
+GETUJI_PAGE = """<html><head><title>月次処理</title></head>
+<body>
+<div class="GyoumuButton" id="GYOUMU_ID_7"><a href="#">在庫照会</a></div>
+<div class="GyoumuButton" id="GYOUMU_ID_8" onclick="location.href='Tanaoroshi.aspx';"><a href="#">棚卸</a></div>
+""" + BACK_BUTTON + """
+</body></html>"""
+
+TANAOROSHI_PAGE = """<html><head><title>棚卸</title></head>
+<body>
+備考: <input type="text" id="txtReMark" name="txtReMark">
+<label><input type="checkbox" id="chkDISP_ZERO" checked>在庫なし薬品を表示</label>
+{print_button}
+""" + BACK_BUTTON + """
+</body></html>"""
+
+HATTYU_PAGE = """<html><head><title>発注</title></head>
+<body>
+<form method="post" action="HattyuList.aspx">
+<input type="submit" value="発注表示">
+</form>
+""" + BACK_BUTTON + """
+</body></html>"""
+
+HATTYU_LIST_PAGE = """<html><head><title>発注一覧</title></head>
+<body>
+<table>
+<tr><td>ロキソプロフェンNa錠60mg「サワイ」</td><td>100</td></tr>
+<tr><td>アムロジピン錠5mg「トーワ」</td><td>30</td></tr>
+</table>
+{print_button}
+<form method="post" action="HattyuDone.aspx">
+<input type="submit" id="btnHatyu" name="btnHatyu" value="発注する"
+       onclick="return confirm('発注しても宜しいですか？');">
+</form>
+""" + BACK_BUTTON + """
+</body></html>"""
+
+HATTYU_DONE_PAGE = """<html><head><title>発注完了</title></head>
+<body>発注しました。
+""" + BACK_BUTTON + """
+</body></html>"""
+
+SYUKKO_PAGE = """<html><head><title>出庫</title></head>
+<body>
+<form method="post" action="Syukko.aspx">
+<input type="submit" id="btnRecalc" name="btnRecalc" value="再計算">
+<input type="submit" id="btnSyuko" name="btnSyuko" value="出庫する"
+       onclick="return confirm('出庫しますか？');">
+</form>
+</body></html>"""
+
+# ダミーのPDF（1ページの白紙）
+FAKE_PDF = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 595 842]>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n%%EOF\n"
+)
+
+# サーバーの既定設定（start_server() の引数で上書き）
+DEFAULT_SETTINGS = {
+    'latency': {},  # 画面名 → 応答遅延（秒）
+    'default_latency': 0.0,  # 画面名の指定がない場合の応答遅延（秒）
+    'tally_delay': 0.0,  # 印刷ボタンが現れるまでの時間（秒、集計処理の再現）
+    'snapshot_dir': None  # 記録した画面のフォルダ（画面名.html）または記録アーカイブ
+}
+
+
+def load_message_list():
+    """Sample/main.html（受信一覧）を読み込み、先頭のポップアップスクリプトと本体に分ける
+
+    Returns:
+        tuple: (ポップアップスクリプト, 受信一覧HTML)
+    """
+    with open(os.path.join(SAMPLE_DIR, "main.html"), 'r', encoding='utf-8') as f:
+        html = f.read().lstrip()
+
+    match = re.match(r'(<script>.*?</script>)\s*', html, re.DOTALL)
+    if match:
+        return match.group(1), html[match.end():]
+    return "", html
+
+
+def load_message_titles(message_list):
+    """受信一覧の行番号（grdJushin$_ctlN）→ タイトル"""
+    return {
+        int(m.group(1)): m.group(2).strip()
+        for m in re.finditer(r"grdJushin\$_ctl(\d+)\$_ctl0','[^']*'\)\"?>([^<]*)</a>", message_list)
+    }
+
+
+def message_target(row):
+    """行番号からメッセージIDを作る（行ごとに異なるID）"""
+    return f"3000000000{row:02d}"
+
+
+def load_snapshot(snapshot_dir, page, key=None):
+    """記録した画面を読み込み
+
+    Args:
+        snapshot_dir: スナップショットのフォルダ（画面名.html）または page_recorder の記録アーカイブ
+        page: 画面名（I_Jushin.aspx など）
+        key: 画面を区別するキー（メッセージIDなど、省略可）
+
+    Returns:
+        str: HTML。記録がない場合は None
+    """
+    if not snapshot_dir:
+        return None
+    if is_archive(snapshot_dir):
+        return load_recorded_page(snapshot_dir, page, key)
+    names = ([f"{page}_{key}.html"] if key else []) + [f"{page}.html"]
+    for name in names:
+        path = os.path.join(snapshot_dir, name)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read()
+    return None
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Medicom画面を返すリクエストハンドラ"""
+
+    popup_script, message_list = load_message_list()
+    message_titles = load_message_titles(message_list)
+    settings = DEFAULT_SETTINGS
+
+    def log_message(self, format, *args):
+        # アクセスログは出力しない（一括処理のログを見やすくするため）
+        pass
+
+    def send_html(self, body, status=200):
+        self.send_bytes(body.encode('utf-8'), "text/html; charset=utf-8", status)
+
+    def send_bytes(self, data, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def delay(self, page):
+        """画面ごとの応答遅延"""
+        seconds = self.settings['latency'].get(page, self.settings['default_latency'])
+        if seconds:
+            time.sleep(seconds)
+
+    def snapshot(self, page, key=None):
+        return load_snapshot(self.settings['snapshot_dir'], page, key)
+
+    def print_button(self, report):
+        return PRINT_BUTTON_SCRIPT.format(report=report, delay_ms=int(self.settings['tally_delay'] * 1000))
+
+    def message_page(self, target):
+        """メッセージ詳細（一覧のタイトルに応じて購入伺い・マッチングの画面を返す）"""
+        snapshot = self.snapshot("I_Jushin.aspx", target)
+        if snapshot:
+            return snapshot
+        title = self.message_titles.get(int(target[-2:]) if target[-2:].isdigit() else -1, "購入伺い")
+        if title.startswith("マッチング"):
+            return MATCHING_PAGE.format(title=title)
+        return MESSAGE_PAGE.format(target=target)
+
+    def redirect(self, location):
+        self.send_response(303)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def read_form(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode('utf-8') if length else ""
+        return {k: v[0] for k, v in parse_qs(body).items()}
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        page = url.path.rsplit("/", 1)[-1]
+        self.delay(page)
+
+        if url.path.startswith("/pdf/"):
+            self.send_bytes(FAKE_PDF, "application/pdf")
+        elif page == "I_Jushin.aspx":
+            target = parse_qs(url.query).get("target", ["0"])[0]
+            self.send_html(self.message_page(target))
+        elif self.snapshot(page):
+            self.send_html(self.snapshot(page))
+        elif page == "LoginTop.aspx":
+            self.send_html(LOGIN_PAGE.format(error=""))
+        elif page == "HomeMain.aspx":
+            self.send_html(HOME_PAGE)
+        elif page == "Menu.aspx":
+            self.send_html(MENU_PAGE)
+        elif page == "I_JushinList.aspx":
+            self.send_html(self.message_list)
+        elif page == "Getuji.aspx":
+            self.send_html(GETUJI_PAGE)
+        elif page == "Tanaoroshi.aspx":
+            self.send_html(TANAOROSHI_PAGE.format(print_button=self.print_button("tanaoroshi")))
+        elif page == "Hattyu.aspx":
+            self.send_html(HATTYU_PAGE)
+        elif page == "HattyuList.aspx":
+            self.send_html(HATTYU_LIST_PAGE.format(print_button=self.print_button("hattyu")))
+        elif page == "Syukko.aspx":
+            self.send_html(SYUKKO_PAGE)
+        else:
+            self.send_html("<html><body>Not Found</body></html>", status=404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        page = url.path.rsplit("/", 1)[-1]
+        form = self.read_form()
+
+        if page == "LoginTop.aspx":
+            self.delay(page)
+            if not form.get("txtUser") or not form.get("txtPass"):
+                self.send_html(LOGIN_PAGE.format(error="ユーザーIDまたはパスワードが違います"))
+            else:
+                self.redirect("HomeMain.aspx")
+        elif page == "I_JushinList.aspx":
+            self.delay(page)
+            # 行のポストバック（grdJushin$_ctlN$_ctl0）ごとに異なるメッセージIDを返す
+            row = re.search(r'_ctl(\d+)\$_ctl0', form.get("__EVENTTARGET", ""))
+            target = message_target(int(row.group(1))) if row else "300023525913"
+            script = re.sub(r'target=\d+', f'target={target}', self.popup_script) if row else ""
+            self.send_html(script + self.message_list)
+        elif page == "HattyuDone.aspx":
+            self.delay(page)
+            self.send_html(HATTYU_DONE_PAGE)
+        elif page == "Syukko.aspx" and "btnSyuko" in form:
+            # 出庫後はメインメニューに戻る
+            self.delay(page)
+            self.redirect("HomeMain.aspx")
+        else:
+            self.do_GET()
+
+
+def make_handler(**settings):
+    """設定を反映したリクエストハンドラのクラスを作成
+
+    Args:
+        **settings: DEFAULT_SETTINGS の項目（latency, default_latency, tally_delay, snapshot_dir）
+
+    Returns:
+        type: StubHandler のサブクラス
+    """
+    unknown = set(settings) - set(DEFAULT_SETTINGS)
+    if unknown:
+        raise ValueError(f"不明な設定です: {', '.join(sorted(unknown))}")
+    merged = {**DEFAULT_SETTINGS, **{k: v for k, v in settings.items() if v is not None}}
+    return type("ConfiguredStubHandler", (StubHandler,), {'settings': merged})
+
+
+def start_server(host="127.0.0.1", port=8765, **settings):
+    """スタブサーバーをバックグラウンドで起動
+
+    Args:
+        host: 待ち受けアドレス
+        port: 待ち受けポート（0の場合は空きポートを自動選択）
+        **settings: 応答遅延・集計時間・スナップショット（make_handler() を参照）
+
+    Returns:
+        tuple: (サーバー, ログイン画面のURL)
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(**settings))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    login_url = f"http://{host}:{server.server_address[1]}/medicom/LoginTop.aspx"
+    return server, login_url
+
+
+def parse_latency(values):
+    """「画面名=秒」のリストを辞書にする"""
+    latency = {}
+    for value in values or []:
+        page, _, seconds = value.partition("=")
+        latency[page] = float(seconds)
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Medicom スタブサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--snapshots", help="記録した画面のフォルダ（画面名.html）または記録アーカイブ")
+    parser.add_argument("--tally-delay", type=float, default=0.0, help="印刷ボタンが現れるまでの秒数")
+    parser.add_argument("--latency-all", type=float, default=0.0, help="全画面の応答遅延（秒）")
+    parser.add_argument("--latency", nargs="*", default=[], metavar="画面名=秒",
+                        help="画面ごとの応答遅延（例: I_JushinList.aspx=0.3）")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(
+        latency=parse_latency(args.latency),
+        default_latency=args.latency_all,
+        tally_delay=args.tally_delay,
+        snapshot_dir=args.snapshots
+    ))
+    print(f"スタブサーバーを起動しました: http://{args.host}:{args.port}/medicom/LoginTop.aspx")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nスタブサーバーを停止します")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
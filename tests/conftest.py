@@ -0,0 +1,5 @@
+"""テスト共通設定（リポジトリ直下のモジュールを import できるようにする）"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
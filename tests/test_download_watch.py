@@ -0,0 +1,54 @@
+"""ダウンロードフォルダの監視（watch_downloads / find_completed_download）のテスト
+
+イベントで受け取ったパスだけを確認し、フォルダ全体を読み直さないことを確認する
+（watchdog が無い環境でも、イベントハンドラを直接呼んで確認する）。
+"""
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import utils
+from utils import _DownloadEventHandler, find_completed_download, watch_downloads, stop_watching_downloads
+
+
+def make_event_watcher(path):
+    return {'path': str(path), 'names': None, 'started_at': time.time(), 'dir_mtime': 0,
+            'event': threading.Event(), 'lock': threading.Lock(), 'changed_paths': set(), 'observer': None}
+
+
+def test_event_paths_are_checked_without_listing_folder(tmp_path, monkeypatch):
+    (tmp_path / "old.pdf").write_bytes(b"%PDF old")
+    watcher = make_event_watcher(tmp_path)
+    handler = _DownloadEventHandler(watcher)
+
+    # Chrome は .crdownload に書き込んでから名前を変更する
+    partial = tmp_path / "report.pdf.crdownload"
+    partial.write_bytes(b"%PDF")
+    handler.on_any_event(SimpleNamespace(is_directory=False, src_path=str(partial)))
+
+    def fail_listdir(path):
+        raise AssertionError("フォルダ全体を読み直しています")
+    monkeypatch.setattr(utils.os, "listdir", fail_listdir)
+
+    assert find_completed_download(watcher) is None
+
+    completed = tmp_path / "report.pdf"
+    os.rename(partial, completed)
+    handler.on_any_event(SimpleNamespace(is_directory=False, src_path=str(partial), dest_path=str(completed)))
+
+    assert watcher['event'].is_set()
+    assert find_completed_download(watcher) == str(completed)
+
+
+def test_polling_falls_back_to_listing_new_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "Observer", None)
+    (tmp_path / "old.pdf").write_bytes(b"%PDF old")
+
+    watcher = watch_downloads(str(tmp_path))
+    try:
+        assert find_completed_download(watcher) is None
+        (tmp_path / "new.pdf").write_bytes(b"%PDF new")
+        assert find_completed_download(watcher) == os.path.join(str(tmp_path), "new.pdf")
+    finally:
+        stop_watching_downloads(watcher)
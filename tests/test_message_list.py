@@ -0,0 +1,125 @@
+"""受信一覧の処理（switch_to_message_list / prepare_next_messages）のテスト
+
+出庫処理の後など、受信一覧フレーム（Itiran）から離れた状態で次のメッセージを
+処理する場合の再読み込みの経路と、メッセージIDを処理の直前に取得することを、
+ブラウザを使わずに確認する。
+"""
+from selenium.common.exceptions import NoSuchFrameException
+from operations import switch_to_message_list
+
+
+class FakeSwitchTo:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def default_content(self):
+        self.driver.frame = None
+
+    def frame(self, name):
+        if not self.driver.has_list_frame:
+            raise NoSuchFrameException(name)
+        self.driver.frame = name
+
+
+class FakeDriver:
+    """Itiran フレームの有無と再読み込みだけを再現するドライバー"""
+
+    def __init__(self, has_list_frame, restore_on_refresh=True):
+        self.has_list_frame = has_list_frame
+        self.restore_on_refresh = restore_on_refresh
+        self.frame = None
+        self.refreshed = 0
+        self.switch_to = FakeSwitchTo(self)
+
+    def refresh(self):
+        self.refreshed += 1
+        if self.restore_on_refresh:
+            self.has_list_frame = True
+
+    def execute_script(self, script, *args):
+        if "getEntriesByType" in script:
+            return ['complete', 3]
+        return 'complete'
+
+
+def test_switches_without_reload_when_frame_exists():
+    driver = FakeDriver(has_list_frame=True)
+
+    assert switch_to_message_list(driver) is True
+    assert driver.frame == "Itiran"
+    assert driver.refreshed == 0
+
+
+def test_reloads_and_switches_when_frame_is_gone():
+    # 出庫処理で受信一覧から離れた状態（再読み込みで一覧に戻る）
+    driver = FakeDriver(has_list_frame=False)
+
+    assert switch_to_message_list(driver) is True
+    assert driver.frame == "Itiran"
+    assert driver.refreshed == 1
+
+
+def test_returns_false_when_frame_does_not_come_back():
+    driver = FakeDriver(has_list_frame=False, restore_on_refresh=False)
+
+    assert switch_to_message_list(driver) is False
+    assert driver.refreshed == 1
+
+
+def make_rows(kinds):
+    return [{'index': i, 'postback': f"grdJushin$_ctl{i + 3}$_ctl0", 'target_id': None,
+             'rule': {'kind': kind}} for i, kind in enumerate(kinds)]
+
+
+def fake_resolve(resolved_postbacks):
+    def resolve(driver, rows, logger=None):
+        for row in rows:
+            resolved_postbacks.append(row['postback'])
+            row['target_id'] = f"3000{row['index']:02d}"
+        return len(rows)
+    return resolve
+
+
+def test_prepare_resolves_only_the_next_messages(monkeypatch):
+    # 全件をまとめて開かず、次の購入伺いの並び（最大 max_workers 件）だけを取得する
+    import operations
+    resolved = []
+    fetched = []
+    monkeypatch.setattr(operations, "switch_to_message_list", lambda driver, logger=None: True)
+    monkeypatch.setattr(operations, "resolve_message_targets", fake_resolve(resolved))
+    monkeypatch.setattr(operations, "fetch_message_bodies",
+                        lambda driver, rows, max_workers=4, logger=None: fetched.extend(r['index'] for r in rows))
+
+    rows = make_rows(["purchase", "purchase", "matching", "purchase"])
+    assert operations.prepare_next_messages(None, rows, fetch_bodies=True, max_workers=4) is True
+    assert resolved == ["grdJushin$_ctl3$_ctl0", "grdJushin$_ctl4$_ctl0"]
+    assert fetched == [0, 1]
+    assert [row.get('prepared') for row in rows] == [True, True, None, None]
+
+    # マッチングはウィンドウで開くため、その1件だけを取得する
+    assert operations.prepare_next_messages(None, rows[2:], fetch_bodies=True, max_workers=4) is True
+    assert resolved[-1] == "grdJushin$_ctl5$_ctl0"
+    assert rows[3].get('target_id') is None
+
+
+def test_prepare_fails_when_next_message_id_is_unknown(monkeypatch):
+    import operations
+    monkeypatch.setattr(operations, "switch_to_message_list", lambda driver, logger=None: True)
+    monkeypatch.setattr(operations, "resolve_message_targets", lambda driver, rows, logger=None: 0)
+
+    rows = make_rows(["matching"])
+    assert operations.prepare_next_messages(None, rows) is False
+    assert rows[0].get('prepared') is None
+
+
+def test_prepare_resolves_only_the_head_without_body_fetch(monkeypatch):
+    # 本文のHTTP取得を選んでいない場合は、続く購入伺いを先に開かない（既読にしない）
+    import operations
+    resolved = []
+    monkeypatch.setattr(operations, "switch_to_message_list", lambda driver, logger=None: True)
+    monkeypatch.setattr(operations, "resolve_message_targets", fake_resolve(resolved))
+
+    rows = make_rows(["purchase", "purchase", "purchase"])
+    assert operations.prepare_next_messages(None, rows) is True
+    assert resolved == ["grdJushin$_ctl3$_ctl0"]
+    assert [row.get('prepared') for row in rows] == [True, None, None]
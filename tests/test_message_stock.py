@@ -0,0 +1,69 @@
+"""メッセージストック（open_message_stock / append_message_lots）のテスト
+
+JSON版のスナップショットとジャーナルを一時フォルダに作って確認する。
+"""
+import json
+
+import operations
+from operations import open_message_stock, append_message_lots, get_message_stock_files
+
+
+def make_lot(n):
+    return {'lot_key': f"m{n}_テスト錠_2026/07", 'message_id': f"m{n}", 'medicine_name': "テスト錠",
+            'expiry_date': "2026/07", 'status': "unprocessed"}
+
+
+def write_stock(store_id, snapshot, journal):
+    stock_file, journal_file = get_message_stock_files(store_id)
+    with open(stock_file, 'w', encoding='utf-8') as f:
+        json.dump({'messages': snapshot}, f, ensure_ascii=False)
+    with open(journal_file, 'w', encoding='utf-8') as f:
+        for record in journal:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def test_open_reads_journal_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    write_stock("0001", [make_lot(1)], [make_lot(2), make_lot(3)])
+
+    calls = []
+    read_message_journal = operations.read_message_journal
+    monkeypatch.setattr(operations, "read_message_journal",
+                        lambda path: calls.append(path) or read_message_journal(path))
+
+    stock = open_message_stock("0001")
+
+    assert len(calls) == 1
+    assert stock['journal_count'] == 2
+    assert set(stock['index']) == {make_lot(n)['lot_key'] for n in (1, 2, 3)}
+
+
+def test_append_skips_registered_lots(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    write_stock("0001", [make_lot(1)], [])
+
+    stock = open_message_stock("0001")
+    assert append_message_lots(stock, [make_lot(1), make_lot(2)]) == 1
+    assert stock['journal_count'] == 1
+
+    reopened = open_message_stock("0001")
+    assert set(reopened['index']) == {make_lot(1)['lot_key'], make_lot(2)['lot_key']}
+
+
+def test_compaction_writes_indexed_messages(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    write_stock("0001", [make_lot(1)], [])
+    monkeypatch.setattr(operations, "MESSAGE_JOURNAL_COMPACT_THRESHOLD", 2)
+
+    stock = open_message_stock("0001")
+    assert 'messages' not in stock  # 索引だけを保持する
+    append_message_lots(stock, [make_lot(2), make_lot(3)])
+
+    stock_file, journal_file = get_message_stock_files("0001")
+    with open(stock_file, encoding='utf-8') as f:
+        messages = json.load(f)['messages']
+    assert [m['message_id'] for m in messages] == ["m1", "m2", "m3"]
+    assert stock['journal_count'] == 0
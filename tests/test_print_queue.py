@@ -0,0 +1,41 @@
+"""印刷キュー（enqueue_print / get_print_job_status）のテスト
+
+印刷は記録するだけのバックエンドで行い、登録順に印刷されることと、
+終了したジョブの記録が残り続けないことを確認する。
+"""
+import utils
+from utils import start_print_queue, stop_print_queue, enqueue_print, get_print_job_status
+
+
+def start_recording_queue(monkeypatch, printed):
+    monkeypatch.setitem(utils._print_queue, 'jobs', {})
+    start_print_queue(lambda pdf_path: printed.append(pdf_path) or True, retry_delay=0)
+
+
+def test_jobs_are_printed_in_order_and_pruned_once_reported(monkeypatch):
+    printed = []
+    start_recording_queue(monkeypatch, printed)
+    try:
+        job_ids = [enqueue_print(f"/tmp/{i}.pdf") for i in range(3)]
+    finally:
+        stop_print_queue(wait=True, timeout=5)
+
+    assert printed == ["/tmp/0.pdf", "/tmp/1.pdf", "/tmp/2.pdf"]
+    assert [job['status'] for job in get_print_job_status()] == ['done'] * 3
+    # 一度報告した終了済みジョブは破棄される
+    assert get_print_job_status() == []
+    assert get_print_job_status(job_ids[0]) is None
+
+
+def test_unreported_finished_jobs_are_capped(monkeypatch):
+    printed = []
+    monkeypatch.setattr(utils, "MAX_FINISHED_PRINT_JOBS", 2)
+    start_recording_queue(monkeypatch, printed)
+    try:
+        for i in range(5):
+            enqueue_print(f"/tmp/{i}.pdf")
+    finally:
+        stop_print_queue(wait=True, timeout=5)
+
+    assert len(printed) == 5
+    assert [job['pdf_path'] for job in get_print_job_status()] == ["/tmp/3.pdf", "/tmp/4.pdf"]
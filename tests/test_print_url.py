@@ -0,0 +1,91 @@
+"""印刷URLの検出（find_print_url）のテスト
+
+印刷ボタンのポストバック後、フレームに埋め込まれた window.open や
+新しく開いたウィンドウから印刷・PDFのURLだけを選ぶことと、
+ウィンドウを確認した後に元のウィンドウ・フレームへ戻ることを、ブラウザを使わずに確認する。
+"""
+import operations
+from operations import find_print_url, POPUP_URL_SCRIPT, CURRENT_FRAME_PATH_SCRIPT
+
+
+class FakeSwitchTo:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def window(self, handle):
+        self.driver.current_window_handle = handle
+        self.driver.frame_path = ()
+
+    def default_content(self):
+        self.driver.frame_path = ()
+
+    def frame(self, index):
+        self.driver.frame_path = self.driver.frame_path + (index,)
+
+
+class FakeDriver:
+    """ウィンドウごとのURLと、現在のフレームの window.open だけを再現するドライバー"""
+
+    def __init__(self, window_urls, popup_urls=(), frame_path=(1,)):
+        self.window_urls = window_urls
+        self.window_handles = list(window_urls)
+        self.popup_urls = list(popup_urls)
+        self.current_window_handle = self.window_handles[0]
+        self.frame_path = frame_path
+        self.switch_to = FakeSwitchTo(self)
+
+    @property
+    def current_url(self):
+        return self.window_urls[self.current_window_handle]
+
+    def execute_script(self, script, *args):
+        if script == POPUP_URL_SCRIPT:
+            return self.popup_urls
+        if script == CURRENT_FRAME_PATH_SCRIPT:
+            return list(self.frame_path)
+        raise AssertionError("想定外のスクリプト")
+
+
+def test_prefers_print_url_embedded_in_frame():
+    driver = FakeDriver(
+        {"main": "https://medicom.example/Top.aspx"},
+        popup_urls=["https://medicom.example/pdf/tanaoroshi.pdf", "https://medicom.example/Help.aspx"],
+    )
+
+    assert find_print_url(driver, ["main"]) == "https://medicom.example/pdf/tanaoroshi.pdf"
+
+
+def test_ignores_urls_that_are_not_print_urls():
+    driver = FakeDriver(
+        {"main": "https://medicom.example/Top.aspx", "popup": "about:blank"},
+        popup_urls=["https://medicom.example/Help.aspx"],
+    )
+
+    assert find_print_url(driver, ["main"]) is None
+
+
+def test_restores_window_and_frame_after_checking_new_windows():
+    driver = FakeDriver(
+        {"main": "https://medicom.example/Top.aspx",
+         "popup": "https://medicom.example/Print.aspx?report=order"},
+        frame_path=(1, 0),
+    )
+
+    assert find_print_url(driver, ["main"]) == "https://medicom.example/Print.aspx?report=order"
+    assert driver.current_window_handle == "main"
+    assert driver.frame_path == (1, 0)
+
+
+def test_obtain_pdf_keeps_downloads_when_print_url_is_not_found(monkeypatch):
+    calls = []
+    monkeypatch.setattr(operations, "pdf_download_mode", "direct")
+    monkeypatch.setattr(operations, "wait_until", lambda *args, **kwargs: False)
+    monkeypatch.setattr(operations, "set_downloads_enabled",
+                        lambda driver, path, enabled=True: calls.append(("downloads", enabled)))
+    monkeypatch.setattr(operations, "download_pdf",
+                        lambda driver, path, watcher: calls.append(("download_pdf", watcher)) or "/tmp/a.pdf")
+
+    driver = FakeDriver({"main": "https://medicom.example/Top.aspx"})
+    watcher = {'observer': None}
+    assert operations.obtain_pdf(driver, "/tmp", "0001", "daily_inventory", ["main"], watcher) == "/tmp/a.pdf"
+    assert calls == [("download_pdf", watcher)]
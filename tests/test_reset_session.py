@@ -0,0 +1,60 @@
+"""ブラウザのリセット（reset_driver_session）のテスト
+
+ストレージを表示中のページのオリジンごとに消去することと、
+消去に失敗してもリセットを続けることを、ブラウザを使わずに確認する。
+"""
+from utils import reset_driver_session, get_origin
+
+
+class FakeSwitchTo:
+    def window(self, handle):
+        pass
+
+    def default_content(self):
+        pass
+
+
+class FakeDriver:
+    def __init__(self, url, failing_commands=()):
+        self.session_id = "test-session"
+        self.window_handles = ["main"]
+        self.current_url = url
+        self.failing_commands = failing_commands
+        self.cdp_commands = []
+        self.switch_to = FakeSwitchTo()
+
+    def delete_all_cookies(self):
+        pass
+
+    def execute_cdp_cmd(self, cmd, params):
+        self.cdp_commands.append((cmd, params))
+        if cmd in self.failing_commands:
+            raise RuntimeError(cmd)
+
+    def get(self, url):
+        self.current_url = url
+
+
+def cleared_origins(driver):
+    return [params['origin'] for cmd, params in driver.cdp_commands if cmd == "Storage.clearDataForOrigin"]
+
+
+def test_get_origin():
+    assert get_origin("https://www.ph-netmaster.jp/medicom/Top.aspx?x=1") == "https://www.ph-netmaster.jp"
+    assert get_origin("about:blank") is None
+
+
+def test_clears_storage_of_visited_origin():
+    driver = FakeDriver("https://www.ph-netmaster.jp/medicom/LoginTop.aspx")
+
+    assert reset_driver_session(driver, origins=["http://127.0.0.1:8765"]) is True
+    assert cleared_origins(driver) == ["http://127.0.0.1:8765", "https://www.ph-netmaster.jp"]
+    assert driver.current_url == "about:blank"
+
+
+def test_continues_when_cache_clear_fails():
+    driver = FakeDriver("https://www.ph-netmaster.jp/medicom/LoginTop.aspx",
+                        failing_commands=("Network.clearBrowserCookies",))
+
+    assert reset_driver_session(driver) is True
+    assert cleared_origins(driver) == ["https://www.ph-netmaster.jp"]
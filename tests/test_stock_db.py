@@ -0,0 +1,50 @@
+"""不動医薬品リストの保存（stock_db / make_medicine_id）のテスト
+
+同じ秒に追加した薬品のIDが重ならないことと、IDが重複した場合に
+既存の行を上書きせずエラーになることを確認する。
+"""
+import sqlite3
+
+import pytest
+
+import stock_db
+from operations import make_medicine_id
+
+
+def make_medicine(medicine_id, targets=()):
+    return {'medicine_id': medicine_id, 'medicine_name': "テスト錠", 'expiry_date': "2026/07",
+            'status': 'active', 'target_stores': [{'store_id': t, 'status': 'pending'} for t in targets]}
+
+
+def test_medicine_ids_added_in_same_second_are_unique():
+    medicines = []
+    for _ in range(3):
+        medicines.append({'medicine_id': make_medicine_id("0001", medicines)})
+
+    assert len({m['medicine_id'] for m in medicines}) == 3
+
+
+def test_duplicate_medicine_id_raises_and_keeps_existing_rows(tmp_path):
+    db_path = str(tmp_path / "stock.db")
+    stock_db.save_immobile_stock({'medicines': [make_medicine("0001_20260101000000", ["0002"])]}, "0001", db_path)
+
+    duplicated = {'medicines': [make_medicine("0001_20260101000000"), make_medicine("0001_20260101000000")]}
+    with pytest.raises(sqlite3.IntegrityError):
+        stock_db.save_immobile_stock(duplicated, "0001", db_path)
+
+    stored = stock_db.load_immobile_stock("0001", db_path)['medicines']
+    assert len(stored) == 1
+    assert stored[0]['target_stores'][0]['store_id'] == "0002"
+
+
+def test_make_unique_medicine_ids_fixes_legacy_duplicates(tmp_path):
+    data = {'medicines': [make_medicine("0001_20260101000000", ["0002", "0002"]),
+                          make_medicine("0001_20260101000000")]}
+
+    assert stock_db.make_unique_medicine_ids(data) == 2
+
+    db_path = str(tmp_path / "stock.db")
+    stock_db.save_immobile_stock(data, "0001", db_path)
+    stored = stock_db.load_immobile_stock("0001", db_path)['medicines']
+    assert [m['medicine_id'] for m in stored] == ["0001_20260101000000", "0001_20260101000000_2"]
+    assert len(stored[0]['target_stores']) == 1
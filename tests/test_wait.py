@@ -0,0 +1,34 @@
+"""待機（wait_until / 待機時間の記録）のテスト"""
+import operations
+from operations import wait_until, network_idle, record_wait, get_wait_timings
+
+
+class FakeDriver:
+    """document.readyState とリソース数だけを返すドライバー"""
+
+    def __init__(self, resource_counts):
+        self.resource_counts = list(resource_counts)
+
+    def execute_script(self, script, *args):
+        count = self.resource_counts.pop(0) if len(self.resource_counts) > 1 else self.resource_counts[0]
+        return ['complete', count]
+
+
+def test_wait_until_prepares_condition_and_records_its_name():
+    get_wait_timings(reset=True)
+    driver = FakeDriver([1, 2, 2])
+
+    assert wait_until(driver, timeout=2, description="読み込み待機", until=network_idle(quiet_period=0)) is True
+
+    timings = get_wait_timings(reset=True)
+    assert [(t['description'], t['condition'], t['met']) for t in timings] == [("読み込み待機", "network_idle", True)]
+
+
+def test_wait_timings_keep_only_recent_records():
+    get_wait_timings(reset=True)
+    for i in range(operations.WAIT_TIMINGS_MAX + 10):
+        record_wait(f"待機{i}", "sleep", 0, True, 0)
+
+    timings = get_wait_timings(reset=True)
+    assert len(timings) == operations.WAIT_TIMINGS_MAX
+    assert timings[-1]['description'] == f"待機{operations.WAIT_TIMINGS_MAX + 9}"
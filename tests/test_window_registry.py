@@ -0,0 +1,98 @@
+"""ウィンドウ整理（close_popups）のテスト
+
+ログイン後・印刷後のウィンドウ整理で、URLを確認して残すべきウィンドウを
+閉じないことを、ブラウザを使わずに確認する。
+"""
+from auth import is_wanted_window
+from operations import is_medicom_window
+from window_registry import (
+    clear_window_registry, register_main_window, track_new_windows, close_popups, get_main_window
+)
+
+
+class FakeSwitchTo:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def window(self, handle):
+        if handle not in self.driver.windows:
+            raise RuntimeError(f"no such window: {handle}")
+        self.driver.current_window_handle = handle
+
+
+class FakeDriver:
+    """ウィンドウごとのURLだけを再現するドライバー（CDPは使えない）"""
+
+    def __init__(self, windows):
+        self.session_id = f"test-{id(self)}"
+        self.windows = dict(windows)
+        self.current_window_handle = next(iter(self.windows))
+        self.switch_to = FakeSwitchTo(self)
+
+    @property
+    def window_handles(self):
+        return list(self.windows)
+
+    @property
+    def current_url(self):
+        return self.windows[self.current_window_handle]
+
+    @property
+    def title(self):
+        return ""
+
+    def execute_cdp_cmd(self, cmd, params):
+        raise RuntimeError("CDP is not available")
+
+    def close(self):
+        del self.windows[self.current_window_handle]
+
+
+def login_driver(windows):
+    driver = FakeDriver({"login": "https://www.ph-netmaster.jp/medicom/LoginTop.aspx"})
+    clear_window_registry(driver)
+    register_main_window(driver)
+    windows_before = driver.window_handles
+    driver.windows.update(windows)
+    track_new_windows(driver, windows_before, "ログイン後のポップアップ", "login")
+    return driver
+
+
+def test_login_closes_only_unwanted_windows():
+    driver = login_driver({
+        "stats": "https://www.ph-netmaster.jp/medicom/I_Tenpo_Sakutaihi_Login.aspx",
+        "menu": "https://www.ph-netmaster.jp/medicom/Menu.aspx",
+    })
+
+    closed, remaining = close_popups(driver, keep_if=is_wanted_window)
+
+    assert closed == 1
+    assert set(driver.windows) == {"login", "menu"}
+    assert get_main_window(driver) == "login"
+
+
+def test_login_switches_main_when_it_moved_to_an_unwanted_page():
+    driver = login_driver({"menu": "https://www.ph-netmaster.jp/medicom/Menu.aspx"})
+    driver.windows["login"] = "https://www.ph-netmaster.jp/medicom/SubFrameSanyo.aspx"
+
+    close_popups(driver, keep_if=is_wanted_window)
+
+    assert set(driver.windows) == {"menu"}
+    assert get_main_window(driver) == "menu"
+    assert driver.current_window_handle == "menu"
+
+
+def test_print_cleanup_keeps_unknown_medicom_windows():
+    driver = FakeDriver({"main": "https://www.ph-netmaster.jp/medicom/Top.aspx",
+                         "other": "https://www.ph-netmaster.jp/medicom/Sub.aspx"})
+    clear_window_registry(driver)
+    register_main_window(driver, "main")
+    driver.windows.update({"print": "https://www.ph-netmaster.jp/medicom/pdf/order.pdf",
+                           "blank": "about:blank"})
+    track_new_windows(driver, ["main", "other", "blank"], "印刷")
+
+    printed, _ = close_popups(driver, purposes=["印刷"])
+    others, remaining = close_popups(driver, keep_if=is_medicom_window)
+
+    assert (printed, others, remaining) == (1, 1, 2)
+    assert set(driver.windows) == {"main", "other"}
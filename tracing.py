@@ -0,0 +1,298 @@
+"""業務処理のトレース（処理ステップごとの所要時間）
+
+フレーム検索・クリック・待機・確認ダイアログ・PDF取得・印刷・ウィンドウ整理などの
+各ステップをスパンとして記録する。スパンには所要時間、その間のWebDriverコマンド数、
+結果（ok / failed / error）、店舗ID・業務名（log_setup のコンテキスト）が入る。
+
+記録は JSON Lines と Chrome のトレースイベント形式で保存でき、後者は
+chrome://tracing や Perfetto（https://ui.perfetto.dev）でタイムラインとして表示できる。
+
+使用例:
+    enable_tracing()
+    with span("印刷ボタン", "click", driver):
+        ...
+    export_trace("traces")
+"""
+import os
+import json
+import time
+import functools
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from log_setup import get_log_context
+
+# トレースの状態（enable_tracing() で有効化）
+_trace = {
+    'enabled': False,
+    'spans': [],
+    'next_id': 1,
+    'origin': time.perf_counter(),  # スパンの開始時刻の基準
+    'origin_epoch': time.time()
+}
+_trace_lock = threading.Lock()
+
+# スレッドごとの実行中スパン（入れ子の親子関係の記録用）
+_span_stack = threading.local()
+
+
+def enable_tracing(enabled=True):
+    """トレースの記録を開始・停止する
+
+    Args:
+        enabled: 記録する場合True
+    """
+    with _trace_lock:
+        _trace['enabled'] = enabled
+
+
+def is_tracing_enabled():
+    """トレースを記録中かどうか"""
+    return _trace['enabled']
+
+
+def get_command_count(driver):
+    """これまでに実行したWebDriverコマンド数（driver_stats.instrument_driver() で数える。数えていないドライバーは None）"""
+    return getattr(driver, '_command_count', None) if driver is not None else None
+
+
+def _stack():
+    if not hasattr(_span_stack, 'spans'):
+        _span_stack.spans = []
+    return _span_stack.spans
+
+
+def start_span(name, category, driver=None, store_id=None, **attrs):
+    """スパンを開始する（トレースが無効の場合は None を返す）
+
+    Args:
+        name: ステップ名（「印刷ボタン」など）
+        category: 種類（frame / click / wait / alert / download / print / window / operation など）
+        driver: Seleniumドライバー（コマンド数の計測用、省略可）
+        store_id: 店舗ID（省略時はこのスレッドのログコンテキスト）
+        **attrs: 追加情報
+
+    Returns:
+        dict: スパン（end_span() に渡す）
+    """
+    if not _trace['enabled']:
+        return None
+
+    context_store_id, operation = get_log_context()
+    stack = _stack()
+    with _trace_lock:
+        span_id = _trace['next_id']
+        _trace['next_id'] += 1
+
+    record = {
+        'id': span_id,
+        'parent': stack[-1]['id'] if stack else None,
+        'name': name,
+        'category': category,
+        'store_id': store_id or context_store_id,
+        'operation': operation,
+        'thread': threading.get_ident(),
+        'start': time.perf_counter() - _trace['origin'],
+        'duration': None,
+        'commands': None,
+        'outcome': None,
+        'error': None,
+        'attrs': attrs,
+        '_driver': driver,
+        '_commands_before': get_command_count(driver)
+    }
+    stack.append(record)
+    return record
+
+
+def end_span(record, outcome="ok", error=None):
+    """スパンを終了して記録する
+
+    Args:
+        record: start_span() の戻り値（None の場合は何もしない）
+        outcome: 結果（ok / failed / timeout / error など）
+        error: エラー内容
+    """
+    if record is None:
+        return
+
+    record['duration'] = time.perf_counter() - _trace['origin'] - record['start']
+    record['outcome'] = outcome
+    record['error'] = str(error) if error is not None else None
+
+    driver = record.pop('_driver')
+    before = record.pop('_commands_before')
+    after = get_command_count(driver)
+    if before is not None and after is not None:
+        record['commands'] = after - before
+
+    stack = _stack()
+    if record in stack:
+        stack.remove(record)
+
+    with _trace_lock:
+        _trace['spans'].append(record)
+
+
+@contextmanager
+def span(name, category, driver=None, store_id=None, **attrs):
+    """with ブロックをスパンとして記録する
+
+    ブロック内で例外が発生した場合は outcome が "error" になる。
+    結果を変える場合は yield されたスパンの 'outcome' を書き換える（トレース無効時は None）。
+    """
+    record = start_span(name, category, driver, store_id, **attrs)
+    if record is None:
+        yield None
+        return
+
+    record['outcome'] = "ok"
+    try:
+        yield record
+    except BaseException as e:
+        end_span(record, "error", e)
+        raise
+    end_span(record, record['outcome'])
+
+
+def traced(name, category="operation"):
+    """関数全体をスパンとして記録するデコレーター
+
+    最初の引数がドライバーの場合はコマンド数も記録する。
+    関数が False または None を返した場合は outcome を "failed" にする。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _trace['enabled']:
+                return func(*args, **kwargs)
+
+            driver = args[0] if args and hasattr(args[0], 'execute') else None
+            record = start_span(name, category, driver)
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                end_span(record, "error", e)
+                raise
+            end_span(record, "failed" if result is False or result is None else "ok")
+            return result
+        return wrapper
+    return decorator
+
+
+def get_trace_spans(reset=False):
+    """記録されたスパンを取得する
+
+    Args:
+        reset: 取得後に記録を消去する場合True
+
+    Returns:
+        list: スパンのリスト（終了順）
+    """
+    with _trace_lock:
+        spans = list(_trace['spans'])
+        if reset:
+            _trace['spans'].clear()
+    return spans
+
+
+def export_trace_jsonl(path, spans=None):
+    """スパンを JSON Lines で保存（1行1スパン、時刻は秒）"""
+    spans = get_trace_spans() if spans is None else spans
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in sorted(spans, key=lambda r: r['start']):
+            record = dict(record)
+            record['started_at'] = datetime.fromtimestamp(_trace['origin_epoch'] + record['start']).isoformat()
+            record['start'] = round(record['start'], 6)
+            record['duration'] = round(record['duration'], 6)
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+def export_chrome_trace(path, spans=None):
+    """スパンを Chrome のトレースイベント形式で保存（chrome://tracing / Perfetto で表示）
+
+    スレッドごとに1行で表示され、行名は最初に処理した店舗IDになる。
+    """
+    spans = get_trace_spans() if spans is None else spans
+    pid = os.getpid()
+    events = []
+    thread_names = {}
+
+    for record in sorted(spans, key=lambda r: r['start']):
+        thread_names.setdefault(record['thread'], record['store_id'])
+        args = {
+            'store_id': record['store_id'],
+            'operation': record['operation'],
+            'commands': record['commands'],
+            'outcome': record['outcome']
+        }
+        if record['error']:
+            args['error'] = record['error']
+        args.update({k: v for k, v in record['attrs'].items() if isinstance(v, (str, int, float, bool))})
+        events.append({
+            'name': record['name'],
+            'cat': record['category'],
+            'ph': 'X',
+            'ts': round(record['start'] * 1e6, 1),
+            'dur': round(record['duration'] * 1e6, 1),
+            'pid': pid,
+            'tid': record['thread'],
+            'args': args
+        })
+
+    for thread, store_id in thread_names.items():
+        events.append({
+            'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread,
+            'args': {'name': f"店舗 {store_id}" if store_id else f"スレッド {thread}"}
+        })
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+
+
+def export_trace(trace_dir="traces", reset=True):
+    """記録されたスパンを JSON Lines と Chrome トレース形式の両方で保存
+
+    Args:
+        trace_dir: 保存先フォルダ
+        reset: 保存後に記録を消去する場合True
+
+    Returns:
+        tuple: (JSON Lines のパス, Chrome トレースのパス)。スパンがない場合は (None, None)
+    """
+    spans = get_trace_spans(reset)
+    if not spans:
+        return None, None
+
+    os.makedirs(trace_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    jsonl_path = os.path.join(trace_dir, f"trace_{timestamp}.jsonl")
+    chrome_path = os.path.join(trace_dir, f"trace_{timestamp}.json")
+    export_trace_jsonl(jsonl_path, spans)
+    export_chrome_trace(chrome_path, spans)
+    return jsonl_path, chrome_path
+
+
+def summarize_trace(spans=None):
+    """スパンをカテゴリ・ステップ名ごとに集計
+
+    Returns:
+        list: {'category', 'name', 'count', 'total', 'max', 'commands', 'failed'} の
+              リスト（合計時間の長い順）
+    """
+    spans = get_trace_spans() if spans is None else spans
+    groups = {}
+    for record in spans:
+        key = (record['category'], record['name'])
+        group = groups.setdefault(key, {
+            'category': record['category'], 'name': record['name'],
+            'count': 0, 'total': 0.0, 'max': 0.0, 'commands': 0, 'failed': 0
+        })
+        group['count'] += 1
+        group['total'] += record['duration']
+        group['max'] = max(group['max'], record['duration'])
+        group['commands'] += record['commands'] or 0
+        if record['outcome'] != "ok":
+            group['failed'] += 1
+
+    return sorted(groups.values(), key=lambda g: g['total'], reverse=True)
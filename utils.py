@@ -1,15 +1,77 @@
 """ユーティリティ関数 (Windows専用)"""
 import os
+import re
 import time
+import queue
+import shutil
+import threading
 import subprocess
-import win32print
-import win32api
+from datetime import datetime
+from urllib.parse import urlparse
+from html.parser import HTMLParser
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from log_setup import get_log_context
+from tracing import span
+from driver_stats import instrument_driver
+from window_registry import close_window, clear_window_registry
+try:
+    import win32print
+    import win32api
+except ImportError:
+    # Windows以外（スタブサーバーでの検証など）では印刷機能のみ利用不可
+    win32print = None
+    win32api = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    # watchdog が無い場合はフォルダの更新日時を見るポーリングで代替
+    Observer = None
+    FileSystemEventHandler = object
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 
 
-def setup_driver(download_path):
-    """Chromeドライバーをセットアップ"""
+# 軽量プロファイル（無人の一括処理向け）で追加するChromeオプション
+LEAN_CHROME_ARGUMENTS = [
+    "--headless=new",
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-dev-shm-usage",
+    "--no-first-run",
+    "--disable-background-networking",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--mute-audio",
+    "--blink-settings=imagesEnabled=false",
+    "--window-size=1280,1024",
+]
+
+# 軽量プロファイルで読み込まない資源（2 = ブロック）
+LEAN_CHROME_PREFS = {
+    "profile.managed_default_content_settings.images": 2,
+    "profile.managed_default_content_settings.fonts": 2,
+    "profile.default_content_setting_values.notifications": 2,
+}
+
+
+def setup_driver(download_path, profile="default"):
+    """Chromeドライバーをセットアップ
+
+    Args:
+        download_path: PDFのダウンロード先フォルダ
+        profile: "default"（通常の画面表示）または "lean"（ヘッドレス・画像/フォント/拡張機能なし）
+
+    Returns:
+        WebDriver: Chromeドライバー
+    """
     chrome_options = Options()
 
     # PDFダウンロード設定
@@ -19,25 +81,506 @@ def setup_driver(download_path):
         "download.directory_upgrade": True,
         "plugins.always_open_pdf_externally": True  # PDFを自動ダウンロード
     }
+
+    if profile == "lean":
+        for argument in LEAN_CHROME_ARGUMENTS:
+            chrome_options.add_argument(argument)
+        prefs.update(LEAN_CHROME_PREFS)
+        # DOMの構築が終われば操作を始める（画像などの読み込み完了を待たない）
+        chrome_options.page_load_strategy = "eager"
+    elif profile != "default":
+        raise ValueError(f"不明なブラウザプロファイルです: {profile}")
+
     chrome_options.add_experimental_option("prefs", prefs)
 
     driver = webdriver.Chrome(options=chrome_options)
+
+    if profile == "lean":
+        # ヘッドレスでもダウンロード先に保存されるよう明示的に許可
+        set_download_path(driver, download_path)
+
+    # WebDriverコマンドの回数・所要時間を集計（トレースのコマンド数にも使う）
+    instrument_driver(driver)
     return driver
 
 
-def download_pdf(driver, download_path):
-    """PDFファイルをダウンロード"""
-    time.sleep(5)  # ダウンロード完了を待つ
+def set_download_path(driver, download_path):
+    """起動中のブラウザのダウンロード先を変更（ブラウザを再起動せずに店舗を切り替える場合など）
+
+    Args:
+        driver: Seleniumドライバー
+        download_path: 新しいダウンロード先フォルダ
+
+    Returns:
+        bool: 変更できた場合True
+    """
+    os.makedirs(download_path, exist_ok=True)
+    try:
+        driver.execute_cdp_cmd("Browser.setDownloadBehavior", {
+            "behavior": "allow",
+            "downloadPath": download_path
+        })
+        return True
+    except Exception as e:
+        print(f"⚠️ ダウンロード設定の適用に失敗しました: {e}")
+        return False
+
+
+def set_downloads_enabled(driver, download_path, enabled=True):
+    """ブラウザのダウンロードを許可・禁止する
+
+    PDFをHTTPで直接取得する場合、印刷ウィンドウからブラウザも同じPDFを
+    ダウンロードして二重に保存しないよう、取得の間だけダウンロードを止める。
+
+    Args:
+        driver: Seleniumドライバー
+        download_path: 許可する場合のダウンロード先フォルダ
+        enabled: 許可する場合True、禁止する場合False
+
+    Returns:
+        bool: 変更できた場合True
+    """
+    if enabled:
+        return set_download_path(driver, download_path)
+    try:
+        driver.execute_cdp_cmd("Browser.setDownloadBehavior", {"behavior": "deny"})
+        return True
+    except Exception as e:
+        print(f"⚠️ ダウンロードの停止に失敗しました: {e}")
+        return False
+
+
+def is_memory_measurable():
+    """ブラウザのメモリ使用量を計測できるか（psutil がインストールされているか）"""
+    return psutil is not None
+
+
+def get_driver_memory(driver):
+    """ドライバーが起動したChrome関連プロセスのメモリ使用量（MB）を取得
+
+    Args:
+        driver: Seleniumドライバー
+
+    Returns:
+        float: RSSの合計（MB）。psutil がない場合や取得できない場合は None
+    """
+    if psutil is None:
+        return None
+
+    try:
+        service = psutil.Process(driver.service.process.pid)
+        processes = [service] + service.children(recursive=True)
+    except Exception:
+        return None
+
+    total = 0
+    for process in processes:
+        try:
+            total += process.memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    return round(total / (1024 * 1024), 1)
+
+
+def get_origin(url):
+    """URLのオリジン（例: https://www.ph-netmaster.jp）。http(s) 以外の場合は None"""
+    parsed = urlparse(url or "")
+    if parsed.scheme not in ("http", "https") or not parsed.netloc:
+        return None
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def reset_driver_session(driver, download_path=None, origins=None):
+    """ブラウザを再起動せずに次のアカウント用に状態をリセット
+
+    余分なウィンドウを閉じ、Cookie・ストレージ・キャッシュを消去して about:blank に戻す。
+
+    Args:
+        driver: Seleniumドライバー
+        download_path: 次のアカウントのダウンロード先（省略時は変更しない）
+        origins: 表示中のページ以外にストレージを消去するオリジン
+
+    Returns:
+        bool: リセットできた場合True
+    """
+    try:
+        # 最初のウィンドウだけを残す（メインウィンドウは次のログインで記録し直す）
+        handles = driver.window_handles
+        for handle in handles[1:]:
+            close_window(driver, handle)
+        driver.switch_to.window(handles[0])
+        clear_window_registry(driver)
+        driver.switch_to.default_content()
+
+        # ストレージはオリジンごとに消去する（表示中のページ＝ログアウト後のMedicomのオリジン）
+        origins = set(origins or [])
+        origin = get_origin(driver.current_url)
+        if origin:
+            origins.add(origin)
+
+        driver.delete_all_cookies()
+        try:
+            driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+        except Exception as e:
+            print(f"⚠️ Cookie・キャッシュの消去に失敗しました: {e}")
+
+        for origin in sorted(origins):
+            try:
+                driver.execute_cdp_cmd("Storage.clearDataForOrigin", {
+                    "origin": origin,
+                    "storageTypes": "all"
+                })
+            except Exception as e:
+                print(f"⚠️ ストレージの消去に失敗しました（{origin}）: {e}")
+
+        driver.get("about:blank")
+        close_http_session(driver)
+
+        if download_path:
+            set_download_path(driver, download_path)
+        return True
+    except Exception as e:
+        print(f"⚠️ ブラウザのリセットに失敗しました: {e}")
+        return False
+
+
+class _DownloadEventHandler(FileSystemEventHandler):
+    """ダウンロードフォルダの変更を通知するイベントハンドラ（watchdog用）
+
+    作成・名前変更・更新されたファイルのパスを記録し、フォルダ全体を読み直さずに済むようにする。
+    """
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if not event.is_directory:
+            with self.watcher['lock']:
+                self.watcher['changed_paths'].add(os.fsdecode(event.src_path))
+                dest_path = getattr(event, 'dest_path', None)
+                if dest_path:
+                    self.watcher['changed_paths'].add(os.fsdecode(dest_path))
+        self.watcher['event'].set()
+
+
+def watch_downloads(download_path):
+    """ダウンロードフォルダの監視を開始（印刷ボタンをクリックする前に呼ぶ）
+
+    watchdog が使える場合はファイル作成・名前変更のイベントで変更されたパスだけを記録する。
+    使えない場合はクリック前のファイル一覧を記録し、フォルダの更新日時の変化で確認する。
+    終了時は例外の場合も stop_watching_downloads() を呼ぶ。
+
+    Args:
+        download_path: ダウンロードフォルダ
+
+    Returns:
+        dict: 監視情報（download_pdf / stop_watching_downloads に渡す）
+    """
+    os.makedirs(download_path, exist_ok=True)
+    watcher = {
+        'path': download_path,
+        'names': None,
+        'started_at': time.time(),
+        'dir_mtime': os.stat(download_path).st_mtime_ns,
+        'event': threading.Event(),
+        'lock': threading.Lock(),
+        'changed_paths': set(),
+        'observer': None
+    }
+
+    if Observer is not None:
+        try:
+            observer = Observer()
+            observer.schedule(_DownloadEventHandler(watcher), download_path, recursive=False)
+            observer.start()
+            watcher['observer'] = observer
+        except Exception as e:
+            print(f"フォルダ監視の開始に失敗しました（ポーリングで代替）: {e}")
+
+    if watcher['observer'] is None:
+        watcher['names'] = set(os.listdir(download_path))
+
+    return watcher
+
+
+def stop_watching_downloads(watcher):
+    """ダウンロードフォルダの監視を終了"""
+    observer = watcher.get('observer')
+    if observer:
+        observer.stop()
+        observer.join(timeout=2)
+        watcher['observer'] = None
+
+
+def _is_completed_pdf(path):
+    """PDFのダウンロードが完了しているか（.crdownload がなく、中身がある）"""
+    try:
+        return (path.lower().endswith('.pdf') and not os.path.exists(path + '.crdownload')
+                and os.path.getsize(path) > 0)
+    except OSError:
+        return False
+
+
+def find_completed_download(watcher):
+    """監視開始後に追加され、ダウンロードが完了したPDFを探す
+
+    イベントで受け取ったパスがある場合はそのパスだけを確認し、
+    フォルダ全体を読み直すのはポーリングで代替している場合だけにする。
+
+    Returns:
+        str: PDFのパス。まだ無い場合None
+    """
+    if watcher['names'] is None:
+        with watcher['lock']:
+            paths = list(watcher['changed_paths'])
+        paths = [path for path in paths
+                 if _is_completed_pdf(path) and os.path.getmtime(path) >= watcher['started_at'] - 1]
+    else:
+        names = set(os.listdir(watcher['path']))
+        paths = [os.path.join(watcher['path'], name) for name in names - watcher['names']]
+        paths = [path for path in paths if _is_completed_pdf(path)]
+
+    return max(paths, key=os.path.getmtime) if paths else None
+
+
+def download_pdf(driver, download_path, watcher=None, timeout=60, poll_interval=0.2):
+    """ダウンロードされたPDFファイルを取得
+
+    watcher（watch_downloads の戻り値）を指定した場合は、新しいPDFが完成した
+    （.crdownload が消えた）時点ですぐに返す。確認するのはイベントで受け取ったパスだけ
+    （ポーリングの場合はフォルダの更新日時が変わった時だけ読み直す）のため、
+    既存のPDFが多くても待機コストは増えない。
+    watcher を省略した場合は従来どおり5秒待ってから最新のPDFを返す。
+
+    Args:
+        driver: Seleniumドライバー
+        download_path: ダウンロードフォルダ
+        watcher: ダウンロードフォルダの監視情報
+        timeout: 最大待機時間（秒）
+        poll_interval: 確認間隔（秒）
+
+    Returns:
+        str: PDFのパス。見つからない場合None
+    """
+    if watcher is None:
+        time.sleep(5)  # ダウンロード完了を待つ
+
+        # ダウンロードされたPDFファイルを取得
+        files = [f for f in os.listdir(download_path) if f.endswith('.pdf')]
+        if files:
+            # 最新のPDFファイルを取得
+            latest_file = max([os.path.join(download_path, f) for f in files],
+                             key=os.path.getctime)
+            return latest_file
+
+        return None
+
+    try:
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            if watcher['observer'] is not None:
+                changed = watcher['event'].wait(poll_interval)
+                watcher['event'].clear()
+            else:
+                time.sleep(poll_interval)
+                dir_mtime = os.stat(watcher['path']).st_mtime_ns
+                changed = dir_mtime != watcher['dir_mtime']
+                watcher['dir_mtime'] = dir_mtime
+
+            if changed:
+                pdf_path = find_completed_download(watcher)
+                if pdf_path:
+                    return pdf_path
 
-    # ダウンロードされたPDFファイルを取得
-    files = [f for f in os.listdir(download_path) if f.endswith('.pdf')]
-    if files:
-        # 最新のPDFファイルを取得
-        latest_file = max([os.path.join(download_path, f) for f in files],
-                         key=os.path.getctime)
-        return latest_file
+        # 更新日時の反映が遅いファイルシステムに備えて最後に一度確認
+        return find_completed_download(watcher)
 
-    return None
+    finally:
+        stop_watching_downloads(watcher)
+
+
+# ブラウザのCookieを引き継いだHTTPセッション（Seleniumのセッションごとに接続をプール）
+_http_sessions = {}
+_http_sessions_lock = threading.Lock()
+
+
+def get_http_session(driver):
+    """Seleniumと同じログイン状態（Cookie）を持つHTTPセッションを取得
+
+    Args:
+        driver: Seleniumドライバー
+
+    Returns:
+        requests.Session: Cookieを同期したHTTPセッション
+    """
+    with _http_sessions_lock:
+        session = _http_sessions.get(driver.session_id)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["User-Agent"] = driver.execute_script("return navigator.userAgent;")
+            _http_sessions[driver.session_id] = session
+
+    # 最新のCookieを反映（ログインし直した場合に備えて毎回同期）
+    for cookie in driver.get_cookies():
+        session.cookies.set(
+            cookie['name'],
+            cookie['value'],
+            domain=cookie.get('domain'),
+            path=cookie.get('path', '/')
+        )
+    return session
+
+
+def close_http_session(driver):
+    """HTTPセッションを閉じる（ブラウザ終了時）"""
+    with _http_sessions_lock:
+        session = _http_sessions.pop(driver.session_id, None)
+    if session:
+        session.close()
+
+
+def build_pdf_path(download_path, store_id, operation):
+    """店舗・業務ごとのPDFファイル名を作成
+
+    Returns:
+        str: 例 downloads/daily_inventory_1705_20251005_093000.pdf
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return os.path.join(download_path, f"{operation}_{store_id or 'unknown'}_{timestamp}.pdf")
+
+
+def fetch_pdf(driver, url, pdf_path, timeout=60):
+    """ブラウザのダウンロードを経由せずにPDFを直接取得
+
+    SeleniumのCookieを引き継いだHTTPセッションで印刷URLを取得し、
+    指定したファイル名でストリーミング保存する。
+
+    Args:
+        driver: Seleniumドライバー
+        url: PDFのURL
+        pdf_path: 保存先のファイルパス
+        timeout: タイムアウト（秒）
+
+    Returns:
+        str: 保存したPDFのパス。失敗時None
+    """
+    part_path = pdf_path + ".part"
+    try:
+        session = get_http_session(driver)
+        with session.get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            with open(part_path, 'wb') as f:
+                head = b""
+                for chunk in response.iter_content(chunk_size=65536):
+                    if len(head) < 4:
+                        head += chunk[:4]
+                        if len(head) >= 4 and not head.startswith(b"%PDF"):
+                            raise ValueError(f"PDFではありません（Content-Type: {response.headers.get('Content-Type')}）")
+                    f.write(chunk)
+
+        os.replace(part_path, pdf_path)
+        return pdf_path
+
+    except Exception as e:
+        print(f"PDF直接取得エラー: {e}")
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return None
+
+
+class _TextExtractor(HTMLParser):
+    """HTMLから表示テキストを取り出す（ブラウザの body.text に近い改行・空白の扱い）"""
+
+    BLOCK_TAGS = {'br', 'p', 'div', 'tr', 'li', 'table', 'pre', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'form'}
+    SKIP_TAGS = {'script', 'style', 'head', 'title'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+        self.pre_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag == 'pre':
+            self.pre_depth += 1
+            self.parts.append('\n')
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+        elif tag == 'td':
+            self.parts.append(' ')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag == 'pre':
+            self.pre_depth = max(0, self.pre_depth - 1)
+            self.parts.append('\n')
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        if self.pre_depth:
+            self.parts.append(data)
+        else:
+            self.parts.append(re.sub(r'\s+', ' ', data))
+
+
+def html_to_text(html):
+    """HTMLを表示テキストに変換（<pre> 内の改行・空白はそのまま）
+
+    Args:
+        html: HTML文字列
+
+    Returns:
+        str: テキスト
+    """
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    text = ''.join(extractor.parts).replace('\xa0', ' ')
+    lines = [line.rstrip() for line in text.split('\n')]
+    return '\n'.join(lines).strip('\n')
+
+
+def fetch_pages(driver, urls, max_workers=4, timeout=15):
+    """ブラウザと同じログイン状態で複数のページを並列に取得
+
+    Args:
+        driver: Seleniumドライバー
+        urls: 取得するURLのリスト
+        max_workers: 同時に取得する数
+        timeout: 1ページあたりのタイムアウト（秒）
+
+    Returns:
+        dict: URL → HTML（取得できなかったURLは None）
+    """
+    session = get_http_session(driver)
+
+    def fetch(url):
+        try:
+            response = session.get(url, timeout=timeout)
+            response.raise_for_status()
+            if response.encoding is None or response.encoding.lower() == 'iso-8859-1':
+                # 文字コードの指定が無い場合は本文から推定
+                response.encoding = response.apparent_encoding
+            return response.text
+        except Exception as e:
+            print(f"ページ取得エラー: {url}: {e}")
+            return None
+
+    pages = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for url, html in zip(urls, executor.map(fetch, urls)):
+            pages[url] = html
+    return pages
 
 
 def print_pdf(pdf_path):
@@ -235,3 +778,248 @@ def print_pdf_with_printer(pdf_path, printer_name=None):
     except Exception as e:
         print(f"印刷エラー: {e}")
         return False
+
+
+# ===========================
+# 印刷キュー（バックグラウンド印刷）
+# ===========================
+# 業務処理は PDF を enqueue_print() で登録するだけで次の処理に進み、
+# 印刷はバックグラウンドのワーカースレッドが登録順に行う。
+
+def noop_print_backend(pdf_path):
+    """何もしない印刷バックエンド（印刷せずに成功扱いにする）"""
+    print(f"（印刷スキップ）{os.path.basename(pdf_path)}")
+    return True
+
+
+def make_copy_print_backend(output_dir):
+    """PDFを指定フォルダにコピーする印刷バックエンドを作成（Windows以外での検証用）
+
+    Args:
+        output_dir: コピー先フォルダ
+
+    Returns:
+        function: 印刷バックエンド（pdf_path を受け取り bool を返す）
+    """
+    def copy_backend(pdf_path):
+        os.makedirs(output_dir, exist_ok=True)
+        shutil.copy2(pdf_path, os.path.join(output_dir, os.path.basename(pdf_path)))
+        print(f"✓ PDFをコピーしました: {os.path.basename(pdf_path)} → {output_dir}")
+        return True
+    return copy_backend
+
+
+def create_print_backend(name="printer", copy_dir=None):
+    """設定名から印刷バックエンドを作成
+
+    Args:
+        name: "printer"（既定のプリンタで印刷）、"noop"、"copy"
+        copy_dir: "copy" の場合のコピー先フォルダ
+
+    Returns:
+        function: 印刷バックエンド
+    """
+    if name == "noop":
+        return noop_print_backend
+    if name == "copy":
+        return make_copy_print_backend(copy_dir or os.path.join(os.getcwd(), "printed"))
+    if name == "printer":
+        return print_pdf
+    raise ValueError(f"不明な印刷バックエンドです: {name}")
+
+
+_print_queue = {
+    'queue': None,
+    'worker': None,
+    'backend': None,
+    'jobs': {},
+    'next_id': 1,
+    'max_retries': 2,
+    'retry_delay': 5
+}
+_print_queue_lock = threading.Lock()
+
+# 終了したジョブの記録を保持する上限（get_print_job_status() で報告した分は先に破棄する）
+MAX_FINISHED_PRINT_JOBS = 1000
+
+
+def start_print_queue(backend=None, max_retries=2, retry_delay=5):
+    """印刷キューのワーカーを起動（起動済みの場合は何もしない）
+
+    Args:
+        backend: 印刷バックエンド（pdf_path を受け取り bool を返す関数）。省略時は print_pdf
+        max_retries: 失敗時の再試行回数
+        retry_delay: 再試行までの待機時間（秒）
+    """
+    with _print_queue_lock:
+        if _print_queue['worker'] and _print_queue['worker'].is_alive():
+            return
+        _print_queue.update({
+            'queue': queue.Queue(),
+            'backend': backend or print_pdf,
+            'max_retries': max_retries,
+            'retry_delay': retry_delay
+        })
+        worker = threading.Thread(target=_print_worker, name="print-queue", daemon=True)
+        _print_queue['worker'] = worker
+        worker.start()
+
+
+def enqueue_print(pdf_path, description=None):
+    """PDFを印刷キューに登録（ワーカー未起動の場合は既定の設定で起動）
+
+    Args:
+        pdf_path: 印刷するPDFのパス
+        description: ジョブの説明（ログ出力用、例: "daily_inventory 1705"）
+
+    Returns:
+        int: ジョブID
+    """
+    start_print_queue()
+    with _print_queue_lock:
+        job_id = _print_queue['next_id']
+        _print_queue['next_id'] += 1
+        _print_queue['jobs'][job_id] = {
+            'job_id': job_id,
+            'pdf_path': pdf_path,
+            'description': description,
+            'store_id': get_log_context()[0],  # トレース用（登録したスレッドの店舗ID）
+            'status': 'queued',  # queued, printing, done, failed
+            'attempts': 0,
+            'error': None,
+            'queued_at': datetime.now().isoformat(),
+            'finished_at': None
+        }
+        print_queue = _print_queue['queue']
+    print_queue.put(job_id)
+    return job_id
+
+
+def get_print_job_status(job_id=None):
+    """印刷ジョブの状態を取得
+
+    終了した（done / failed）ジョブは、ここで一度報告した後は記録から破棄する。
+
+    Args:
+        job_id: ジョブID。省略時は全ジョブ
+
+    Returns:
+        dict or list: ジョブの状態（コピー）
+    """
+    with _print_queue_lock:
+        jobs = _print_queue['jobs']
+        if job_id is not None:
+            job = jobs.get(job_id)
+            reported = [job] if job else []
+        else:
+            reported = list(jobs.values())
+
+        for job in reported:
+            if job['status'] in ('done', 'failed'):
+                del jobs[job['job_id']]
+        statuses = [dict(job) for job in reported]
+
+    if job_id is not None:
+        return statuses[0] if statuses else None
+    return statuses
+
+
+def _prune_finished_print_jobs():
+    """報告されていない終了済みジョブが上限を超えた分を古い順に破棄（ロックを取得して呼ぶ）"""
+    jobs = _print_queue['jobs']
+    finished = [job_id for job_id, job in jobs.items() if job['status'] in ('done', 'failed')]
+    for job_id in finished[:max(0, len(finished) - MAX_FINISHED_PRINT_JOBS)]:
+        del jobs[job_id]
+
+
+def wait_for_print_queue(timeout=None):
+    """キューに登録済みの印刷ジョブがすべて終わるまで待機
+
+    Returns:
+        bool: すべて終わった場合True、タイムアウトした場合False
+    """
+    print_queue = _print_queue['queue']
+    if print_queue is None:
+        return True
+
+    deadline = time.perf_counter() + timeout if timeout is not None else None
+    while print_queue.unfinished_tasks:
+        if deadline is not None and time.perf_counter() >= deadline:
+            return False
+        time.sleep(0.2)
+    return True
+
+
+def stop_print_queue(wait=True, timeout=None):
+    """印刷キューのワーカーを停止
+
+    Args:
+        wait: 残りのジョブを印刷してから停止する場合True
+        timeout: 残りのジョブを待つ最大時間（秒）
+    """
+    if wait:
+        wait_for_print_queue(timeout)
+    with _print_queue_lock:
+        worker = _print_queue['worker']
+        print_queue = _print_queue['queue']
+        _print_queue['worker'] = None
+    if worker and worker.is_alive():
+        print_queue.put(None)
+        worker.join(timeout=5)
+
+
+def _print_job(job_id):
+    """1件の印刷ジョブを実行（失敗時は再試行）"""
+    with _print_queue_lock:
+        job = _print_queue['jobs'][job_id]
+        job['status'] = 'printing'
+        backend = _print_queue['backend']
+        max_retries = _print_queue['max_retries']
+        retry_delay = _print_queue['retry_delay']
+
+    for attempt in range(max_retries + 1):
+        error = None
+        try:
+            success = backend(job['pdf_path'])
+        except Exception as e:
+            success = False
+            error = str(e)
+
+        with _print_queue_lock:
+            job['attempts'] = attempt + 1
+            job['error'] = error
+            if success:
+                job['status'] = 'done'
+                job['finished_at'] = datetime.now().isoformat()
+                _prune_finished_print_jobs()
+                return
+
+        if attempt < max_retries:
+            print(f"⚠️ 印刷に失敗しました。再試行します（{attempt + 1}/{max_retries}）: {job['description'] or job['pdf_path']}")
+            time.sleep(retry_delay)
+
+    with _print_queue_lock:
+        job['status'] = 'failed'
+        job['finished_at'] = datetime.now().isoformat()
+        _prune_finished_print_jobs()
+    print(f"⚠️ 印刷に失敗しました: {job['description'] or job['pdf_path']}")
+
+
+def _print_worker():
+    """印刷キューのワーカースレッド（登録順に1件ずつ印刷）"""
+    print_queue = _print_queue['queue']
+    while True:
+        job_id = print_queue.get()
+        if job_id is None:
+            print_queue.task_done()
+            return
+
+        job = _print_queue['jobs'][job_id]
+        try:
+            with span(job['description'] or "印刷", "print", store_id=job['store_id']) as print_span:
+                _print_job(job_id)
+                if print_span:
+                    print_span['outcome'] = "ok" if job['status'] == 'done' else "failed"
+                    print_span['attrs']['attempts'] = job['attempts']
+        finally:
+            print_queue.task_done()
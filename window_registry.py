@@ -0,0 +1,226 @@
+"""ウィンドウの管理（ウィンドウハンドルと用途の記録）
+
+ウィンドウを開く操作（ログイン・印刷ボタン・メッセージ詳細など）の前後で
+ウィンドウハンドルの差分を取り、開いたウィンドウを用途とともに記録する。
+ウィンドウ整理では、記録した用途のウィンドウ（印刷など）はURL・タイトルを調べずに閉じる
+（ウィンドウごとに切り替えて current_url・title を読む往復が不要になる）。
+用途の分からないウィンドウやメインウィンドウは、keep_if でURL・タイトルを確認してから閉じる。
+
+ウィンドウは CDP（Target.closeTarget）で切り替えずに閉じ、使えない場合は切り替えて閉じる。
+
+使用例:
+    register_main_window(driver)
+    windows_before = driver.window_handles
+    print_button.click()
+    track_new_windows(driver, windows_before, "印刷")
+    close_popups(driver, purposes=["印刷"])
+    closed, remaining = close_popups(driver, keep_if=lambda info: "medicom" in info['url'].lower())
+"""
+import time
+import threading
+
+# セッションID → {'main': メインウィンドウ, 'windows': {ハンドル: 用途など}}
+_window_registries = {}
+_window_registries_lock = threading.Lock()
+
+
+def get_window_registry(driver):
+    """セッションのウィンドウ記録を取得（なければ作成）"""
+    with _window_registries_lock:
+        return _window_registries.setdefault(driver.session_id, {'main': None, 'windows': {}})
+
+
+def clear_window_registry(driver):
+    """セッションのウィンドウ記録を破棄（ブラウザ終了時・アカウント切り替え時など）"""
+    with _window_registries_lock:
+        _window_registries.pop(driver.session_id, None)
+
+
+def register_main_window(driver, handle=None):
+    """メインウィンドウを記録する
+
+    Args:
+        driver: Seleniumドライバー
+        handle: ウィンドウハンドル（省略時は現在のウィンドウ）
+
+    Returns:
+        str: メインウィンドウのハンドル
+    """
+    handle = handle or driver.current_window_handle
+    registry = get_window_registry(driver)
+    registry['main'] = handle
+    registry['windows'][handle] = {'purpose': "main", 'opened_by': None, 'opened_at': time.time()}
+    return handle
+
+
+def get_main_window(driver):
+    """記録したメインウィンドウのハンドル（未記録の場合は None）"""
+    return get_window_registry(driver)['main']
+
+
+def ensure_main_window(driver):
+    """メインウィンドウを取得（未記録の場合は現在のウィンドウを記録する）"""
+    return get_main_window(driver) or register_main_window(driver)
+
+
+def track_new_windows(driver, handles_before, purpose, opened_by=None):
+    """操作の前後のウィンドウハンドルの差分を取り、新しいウィンドウを記録する
+
+    既に閉じられたウィンドウは記録から外す。
+
+    Args:
+        driver: Seleniumドライバー
+        handles_before: 操作前の driver.window_handles
+        purpose: 用途（「印刷」「メッセージ」など）
+        opened_by: 開いた処理の名前（ログ・調査用）
+
+    Returns:
+        list: 新しく開いたウィンドウのハンドル
+    """
+    handles = driver.window_handles
+    before = set(handles_before or [])
+    new_handles = [h for h in handles if h not in before]
+
+    registry = get_window_registry(driver)
+    with _window_registries_lock:
+        for handle in list(registry['windows']):
+            if handle not in handles:
+                del registry['windows'][handle]
+        for handle in new_handles:
+            registry['windows'].setdefault(handle, {
+                'purpose': purpose, 'opened_by': opened_by, 'opened_at': time.time()
+            })
+    return new_handles
+
+
+def get_window_purpose(driver, handle):
+    """ウィンドウの用途（記録がない場合は None）"""
+    info = get_window_registry(driver)['windows'].get(handle)
+    return info['purpose'] if info else None
+
+
+def close_window(driver, handle):
+    """ウィンドウを閉じる（CDPで切り替えずに閉じ、できない場合は切り替えて閉じる）
+
+    Returns:
+        bool: 閉じた場合True
+    """
+    try:
+        # ChromeDriver のウィンドウハンドルは DevTools のターゲットID
+        driver.execute_cdp_cmd("Target.closeTarget", {"targetId": handle.replace("CDwindow-", "")})
+        return True
+    except Exception:
+        pass
+
+    try:
+        driver.switch_to.window(handle)
+        driver.close()
+        return True
+    except Exception:
+        return False
+
+
+def get_window_info(driver, handle):
+    """ウィンドウのURLとタイトルを取得（ウィンドウを切り替えて読む）
+
+    Returns:
+        dict: {'url': URL, 'title': タイトル}。読めない場合（既に閉じられたなど）は None
+    """
+    try:
+        driver.switch_to.window(handle)
+        return {'url': driver.current_url, 'title': driver.title}
+    except Exception:
+        return None
+
+
+def close_popups(driver, purposes=None, keep=None, logger=None, keep_if=None):
+    """メインウィンドウ以外のウィンドウを閉じてメインウィンドウに戻る
+
+    メインウィンドウが未記録の場合は最初のウィンドウをメインとして扱う。
+
+    keep_if を指定した場合は、メインウィンドウを含む各ウィンドウのURL・タイトルを確認し、
+    keep_if が True を返すウィンドウは閉じない。記録したメインウィンドウが対象外のページ
+    （ログイン後の不要な画面など）になっている場合は、keep_if に一致する最初のウィンドウを
+    メインウィンドウにして、元のメインウィンドウは閉じる。
+
+    Args:
+        driver: Seleniumドライバー
+        purposes: 閉じる用途（省略時は記録のないウィンドウも含めてすべて）
+        keep: 閉じないウィンドウのハンドル
+        logger: ロガーオブジェクト
+        keep_if: ウィンドウ情報（get_window_info() の戻り値）を受け取り、残す場合Trueを返す関数
+
+    Returns:
+        tuple: (閉じたウィンドウ数, 残ったウィンドウ数)
+    """
+    handles = driver.window_handles
+    registry = get_window_registry(driver)
+    main = registry['main'] if registry['main'] in handles else None
+    if main is None and handles:
+        main = handles[0]
+        if logger:
+            logger.warning(f"メインウィンドウが記録されていないため最初のウィンドウを使います: {main}")
+        register_main_window(driver, main)
+
+    keep = set(keep or [])
+    infos = {}
+    if keep_if is not None:
+        infos = {handle: get_window_info(driver, handle) for handle in handles}
+        matched = [handle for handle in handles if infos[handle] and keep_if(infos[handle])]
+        if main not in matched and matched:
+            if logger:
+                url = (infos.get(main) or {}).get('url')
+                logger.warning(f"メインウィンドウが対象外のページのため切り替えます: {url} → "
+                               f"{infos[matched[0]]['url']}")
+            main = matched[0]
+            register_main_window(driver, main)
+        elif main not in matched and logger:
+            logger.warning("残すべきウィンドウが見つからないため、記録したメインウィンドウを残します")
+        keep |= set(matched)
+
+    keep |= {main}
+    closed = set()
+    for handle in handles:
+        if handle in keep:
+            continue
+        purpose = get_window_purpose(driver, handle)
+        if purposes is not None and purpose not in purposes:
+            continue
+        if close_window(driver, handle):
+            closed.add(handle)
+            if logger:
+                url = (infos.get(handle) or {}).get('url')
+                logger.info(f"ウィンドウを閉じました（{purpose or '記録なし'}）: {url or handle}")
+        elif logger:
+            logger.debug(f"ウィンドウクローズエラー（既に閉じられている）: {handle}")
+
+    with _window_registries_lock:
+        for handle in list(registry['windows']):
+            if handle not in handles or handle in closed:
+                del registry['windows'][handle]
+
+    if main:
+        driver.switch_to.window(main)
+    return len(closed), len(handles) - len(closed)
+
+
+def switch_to_main_window(driver):
+    """メインウィンドウに切り替える（メインウィンドウがない場合は最初のウィンドウ）
+
+    Returns:
+        str: 切り替えたウィンドウのハンドル。ウィンドウがない場合は None
+    """
+    main = get_main_window(driver)
+    if main:
+        try:
+            driver.switch_to.window(main)
+            return main
+        except Exception:
+            pass
+
+    handles = driver.window_handles
+    if not handles:
+        return None
+    register_main_window(driver, handles[0])
+    driver.switch_to.window(handles[0])
+    return handles[0]